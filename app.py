@@ -3,97 +3,41 @@ import sys
 import os
 from dotenv import load_dotenv
 import json
-import traceback
+import hmac
 from datetime import datetime
 import logging
+import threading
 
 from aiohttp import web
-from aiohttp.web import Request, Response, json_response
+from aiohttp.web import Request, Response
 from botbuilder.core import (BotFrameworkAdapterSettings, TurnContext, BotFrameworkAdapter, ConversationState, MemoryStorage)
 from botbuilder.core.integration import aiohttp_error_middleware
 from botbuilder.schema import Activity, ActivityTypes
 
-import asyncio
-from typing import Dict
-from azure.cosmos.exceptions import CosmosAccessConditionFailedError
-from botbuilder.azure import CosmosDbPartitionedStorage, CosmosDbPartitionedConfig
-
+from bot.admission_control import AdmissionControl
+from bot import tracing
+from bot.data_bundle import DataBundle, DEFAULT_DATA_BUNDLE_PATH
+from bot.structured_logging import configure_logging, QUIET_LOGGERS
 from bot.bot import Bot
+from bot.metrics import registry as metrics_registry
 from config import DefaultConfig
+from server import fast_path
+from server.auth_cache import TokenValidationCache, instrument_authentication
+from server.connector_pool import PooledConnectorAdapter
+from server.loop_watchdog import LoopWatchdog
+from server.profiling import ProfilingEndpoint
+from server.turn_queue import TurnQueue, PRIORITY_ONGOING_CONVERSATION, PRIORITY_NEW_CONVERSATION
+from server.warmup import StartupWarmup
+from server.workers import WORKER_AFFINITY_KEY, serve
 
 
-class RetryCosmosDbPartitionedStorage(CosmosDbPartitionedStorage):
-    """
-    Extension of the Botbuilder Storage, which undertakes automatic retries 
-    at PreconditionFailed errors with the database. 
-    """
-
-    def __init__(
-        self,
-        config: CosmosDbPartitionedConfig,
-        max_retries: int = 3,
-        retry_delay: float = 0.5
-    ):
-        """
-        Constructor of the RetryCosmosDbPartitionedStorage class. Inherits from
-        the CosmosDbPartitionedStorage class.
-
-        Args: 
-            config (CosmosDbPartitionedConfig): The config class instance for 
-            the cosmos db database.
-            max_retries (int): The maximum number of retries when an error 
-            with the internal database occurs.
-            retry_delay (float): The delay before a new retry of the database
-            operation.
-        """
-
-        super().__init__(config)
-        self.max_retries = max_retries 
-        self.retry_delay = retry_delay 
-
-    async def write(self, changes: Dict[str, object]):
-        """
-        Overwrites the write method of the parent class 
-        CosmosDbPartitionedStorage to retry failed database operations.
-
-        This method attempts to write a set of changes to the Cosmos DB
-        partitioned storage. If a write operation fails due to a 
-        PreconditionFailed (i.e., a concurrency conflict), it will 
-        automatically retry the operation up to the maximum number of retries 
-        specified in the constructor.
-
-        Args: 
-            changes (Dict[str, object]): A dictionary of key-value pairs 
-            representing items to be written to the storage. 
-        """
-        
-        attempt = 0
-        while True:
-            try:
-                # Invoke the orignial implementation from 
-                # CosmosDbPartitionedStorage
-                return await super().write(changes)
-            except CosmosAccessConditionFailedError as e:
-                attempt += 1
-                if attempt >= self.max_retries:
-                    # If all retries are exhausted, pass on the error
-                    raise e
-                # Wait a short time an try the databse operation again
-                await asyncio.sleep(self.retry_delay)
-
-
-#logging.basicConfig(level=logging.DEBUG)  //TODO: Zum debuggen entkommentieren
-#logger = logging.getLogger(__name__)  //TODO: Zum debuggen entkommentieren
+logger = logging.getLogger(__name__)
 
 config = DefaultConfig()
 
 # Load environment variables
 load_dotenv()
 
-# Create adapter
-settings = BotFrameworkAdapterSettings(config.APP_ID, config.APP_PASSWORD)
-adapter = BotFrameworkAdapter(settings)
-
 # Load botsettings
 botsettings_file_path = os.path.join(os.path.dirname(__file__), "botsettings.json")
 try:
@@ -101,15 +45,76 @@ try:
         botsettings_data = json.load(f)
     treatment_fallback = int(botsettings_data.get("treatment_group_fallback", 1))
     use_cosmos_db_storage = bool(botsettings_data.get("use_cosmos_db_storage", False))
+    turn_queue_settings = dict(botsettings_data.get("turn_queue", {}))
+    admission_control_settings = dict(botsettings_data.get("admission_control", {}))
+    serving_settings = dict(botsettings_data.get("serving", {}))
+    fast_path_settings = dict(botsettings_data.get("fast_path", {}))
+    connector_pool_settings = dict(botsettings_data.get("connector_pool", {}))
+    auth_cache_settings = dict(botsettings_data.get("auth_cache", {}))
+    metrics_settings = dict(botsettings_data.get("metrics", {}))
+    tracing_settings = dict(botsettings_data.get("tracing", {}))
+    logging_settings = dict(botsettings_data.get("logging", {}))
+    profiling_settings = dict(botsettings_data.get("profiling", {}))
+    loop_watchdog_settings = dict(botsettings_data.get("loop_watchdog", {}))
+    slot_classifier_settings = dict(botsettings_data.get("slot_classifier", {}))
+    slot_filling_batching_settings = dict(botsettings_data.get("slot_filling_batching", {}))
+    data_bundle_settings = dict(botsettings_data.get("data_bundle", {}))
+    warmup_settings = dict(botsettings_data.get("warmup", {}))
 except (ValueError, json.decoder.JSONDecodeError):
     treatment_fallback = 1
     use_cosmos_db_storage = False
+    turn_queue_settings = {}
+    admission_control_settings = {}
+    serving_settings = {}
+    fast_path_settings = {}
+    connector_pool_settings = {}
+    auth_cache_settings = {}
+    metrics_settings = {}
+    tracing_settings = {}
+    logging_settings = {}
+    profiling_settings = {}
+    loop_watchdog_settings = {}
+    slot_classifier_settings = {}
+    slot_filling_batching_settings = {}
+    data_bundle_settings = {}
+    warmup_settings = {}
+
+# Write the logs as json lines from a background thread (set level to DEBUG
+# for debugging)
+if logging_settings.get("enabled", False):
+    configure_logging(
+        level=logging_settings.get("level", "INFO"),
+        sample_rate=float(logging_settings.get("sample_rate", 1.0)),
+        max_queue_size=int(logging_settings.get("max_queue_size", 10000)),
+        max_text_length=int(logging_settings.get("max_text_length", 200)),
+        redacted_fields=tuple(logging_settings.get("redacted_fields", [])),
+        quiet_loggers=tuple(logging_settings.get("quiet_loggers", QUIET_LOGGERS))
+    )
+
+# Select the event loop and the json codec (falls back to asyncio and json if
+# uvloop or orjson are not installed)
+event_loop_name = fast_path.install_event_loop(bool(fast_path_settings.get("uvloop", True)))
+json_codec_name = fast_path.install_json_codec(bool(fast_path_settings.get("orjson", True)))
+
+# Create adapter (optionally with pooled outbound connections and a cached 
+# access token for sending the replies)
+settings = BotFrameworkAdapterSettings(config.APP_ID, config.APP_PASSWORD)
+if connector_pool_settings.get("enabled", False):
+    adapter = PooledConnectorAdapter(
+        settings,
+        limit_per_host=int(connector_pool_settings.get("limit_per_host", 100)),
+        keepalive_timeout=float(connector_pool_settings.get("keepalive_timeout_seconds", 60.0)),
+        token_refresh_margin=float(connector_pool_settings.get("token_refresh_margin_seconds", 300.0))
+    )
+else:
+    adapter = BotFrameworkAdapter(settings)
 
 # Catch-all for errors
 async def on_error(context: TurnContext, error: Exception):
-    logging.error(f"Unhandled error: {error}")
-    print(f"\n [on_turn_error] unhandled error: {error}", file=sys.stderr)
-    traceback.print_exc()
+    logger.error("Unhandled error in turn", exc_info=error, extra={"fields": {
+        "conversation_id": context.activity.conversation.id if context.activity.conversation else None,
+        "activity_type": context.activity.type,
+    }})
     if context.activity.channel_id == "emulator":
         trace_activity = Activity(
             label="TurnError",
@@ -124,8 +129,28 @@ async def on_error(context: TurnContext, error: Exception):
 
 adapter.on_turn_error = on_error
 
-# Create global ConversationState and Storage
+# Cache the identities of validated inbound tokens and refresh the signing 
+# keys in the background
+if auth_cache_settings.get("enabled", False):
+    token_validation_cache = TokenValidationCache(
+        max_entries=int(auth_cache_settings.get("max_entries", 10000)),
+        clock_skew=float(auth_cache_settings.get("clock_skew_seconds", 300.0)),
+        max_key_age=float(auth_cache_settings.get("max_key_age_seconds", 43200.0)),
+        key_refresh_interval=float(auth_cache_settings.get("key_refresh_interval_seconds", 3600.0))
+    )
+    token_validation_cache.attach(adapter)
+else:
+    token_validation_cache = None
+    instrument_authentication(adapter)
+
+# Create global Storage (the cosmos db packages are only imported if the 
+# cosmos db storage is used)
 if use_cosmos_db_storage == True: 
+    from botbuilder.azure import CosmosDbPartitionedConfig
+    from server.cosmos_storage import RetryCosmosDbPartitionedStorage
+
+    # Parse the stored state with the selected json codec
+    fast_path.install_storage_codec()
     cosmos_db_endpoint = os.getenv("COSMOS_DB_ENDPOINT")
     auth_key = os.getenv("COSMOS_DB_AUTH_KEY")
     database_id = os.getenv("COSMOS_DB_DATABASE_ID")
@@ -142,36 +167,281 @@ if use_cosmos_db_storage == True:
         max_retries=3,
         retry_delay=0.5
     )
-    conversation_state = ConversationState(storage)
 else:
-    memory = MemoryStorage()
-    conversation_state = ConversationState(memory)
+    storage = MemoryStorage()
+
+# Trace a sample of the turns (span tree per activity, exported to a local 
+# file or an OTLP/HTTP collector) and create global ConversationState
+if tracing_settings.get("enabled", False):
+    if tracing_settings.get("exporter", "file") == "otlp":
+        span_exporter = tracing.OtlpHttpSpanExporter(tracing_settings.get("otlp_endpoint", "http://localhost:4318/v1/traces"))
+    else:
+        span_exporter = tracing.FileSpanExporter(tracing_settings.get("file_path", "traces.jsonl"))
+    tracing.tracer.configure(
+        sample_rate=float(tracing_settings.get("sample_rate", 0.01)),
+        exporter=span_exporter,
+        service_name=tracing_settings.get("service_name", "bot")
+    )
+    storage = tracing.TracedStorage(storage)
+conversation_state = ConversationState(storage)
+
+# Create the admission control, which degrades turns when the bot is overloaded
+if admission_control_settings.get("enabled", False):
+    admission_control = AdmissionControl(
+        max_in_flight_turns=int(admission_control_settings.get("max_in_flight_turns", 32)),
+        max_queue_wait=float(admission_control_settings.get("max_queue_wait_seconds", 5.0)),
+        new_conversation_max_in_flight_turns=int(admission_control_settings.get("new_conversation_max_in_flight_turns", 24)),
+        new_conversation_max_queue_wait=float(admission_control_settings.get("new_conversation_max_queue_wait_seconds", 2.0)),
+        queue_wait_half_life=float(admission_control_settings.get("queue_wait_half_life_seconds", 5.0))
+    )
+else:
+    admission_control = None
+
+# Load the data files of the bot from the precompiled data bundle if it has 
+# been built from the current data files (see tools.build_data_bundle), 
+# otherwise the files are read
+data_bundle = None
+if data_bundle_settings.get("enabled", False):
+    data_bundle_path = data_bundle_settings.get("file_path")
+    data_bundle_path = os.path.join(os.path.dirname(__file__), data_bundle_path) if data_bundle_path else DEFAULT_DATA_BUNDLE_PATH
+    try:
+        data_bundle = DataBundle.load(data_bundle_path)
+        if data_bundle_settings.get("check_source_digest", True) and not data_bundle.is_up_to_date():
+            logger.warning("Data bundle %s is out of date (rebuild it with python -m tools.build_data_bundle), "
+                           "the data files are read", data_bundle_path)
+            data_bundle = None
+    except FileNotFoundError:
+        logger.info("No data bundle at %s, the data files are read", data_bundle_path)
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning("Data bundle %s could not be loaded, the data files are read: %r", data_bundle_path, e)
 
 # Create the Bot
-bot = Bot(conversation_state, treatment_fallback)
+bot = Bot(conversation_state, treatment_fallback, admission_control, data_bundle)
+
+# Classify the slots with the local slot classifier if it is confident (the 
+# gpt api is called otherwise) and log the slot labels of the gpt api as its 
+# training data
+if slot_classifier_settings.get("enabled", False) or slot_classifier_settings.get("label_log_enabled", False):
+    bot.message_processing.slot_filling.configure_slot_classifier(
+        model_path=(slot_classifier_settings.get("model_path", "slot_classifier.json")
+                    if slot_classifier_settings.get("enabled", False) else None),
+        confidence_threshold=float(slot_classifier_settings.get("confidence_threshold", 0.95)),
+        audit_rate=float(slot_classifier_settings.get("audit_rate", 0.05)),
+        label_log_path=(slot_classifier_settings.get("label_log_path", "slot_labels.jsonl")
+                        if slot_classifier_settings.get("label_log_enabled", False) else None)
+    )
+
+# Combine the slot filling requests of concurrent turns in the same dialogue 
+# state into one request
+if slot_filling_batching_settings.get("enabled", False):
+    bot.message_processing.slot_filling.configure_batching(
+        window=float(slot_filling_batching_settings.get("window_seconds", 0.005)),
+        max_batch_size=int(slot_filling_batching_settings.get("max_batch_size", 8))
+    )
+
+# Create the queue for asynchronous turn processing (acknowledge first, 
+# process the turn on a background worker and reply proactively)
+if turn_queue_settings.get("enabled", False):
+    turn_queue = TurnQueue(
+        adapter=adapter,
+        logic=bot.on_turn,
+        worker_count=int(turn_queue_settings.get("worker_count", 8)),
+        max_queue_size=int(turn_queue_settings.get("max_queue_size", 256)),
+        admission_control=admission_control,
+        drain_timeout=float(turn_queue_settings.get("drain_timeout_seconds", 10.0))
+    )
+else:
+    turn_queue = None
+
+# Measure the event loop lag and capture the stack when the loop is blocked
+if loop_watchdog_settings.get("enabled", False):
+    loop_watchdog = LoopWatchdog(
+        interval=float(loop_watchdog_settings.get("interval_seconds", 0.1)),
+        block_threshold=float(loop_watchdog_settings.get("block_threshold_seconds", 0.1))
+    )
+else:
+    loop_watchdog = None
+
+# Warm up the worker in the background after the start (pipeline, openai 
+# client, storage and reply token) and report the readiness on /readyz
+startup_warmup = StartupWarmup(timeout=float(warmup_settings.get("timeout_seconds", 30.0)))
+
+# Key read by the storage step of the warm-up (opens the connection to the 
+# storage, the key does not exist)
+WARMUP_STORAGE_KEY = "startup-warmup"
 
 # Listen for incoming requests on /api/messages
 async def messages(req: Request) -> Response:
     if "application/json" in req.headers["Content-Type"]:
-        body = await req.json()
+        body = fast_path.loads(await req.read())
     else:
         return Response(status=415)
 
+    # Forward the turn to the worker process owning the conversation (the turn 
+    # is processed here if the owner is not reachable)
+    worker_affinity = req.app.get(WORKER_AFFINITY_KEY)
+    if worker_affinity is not None:
+        owner = worker_affinity.get_owner(req, body)
+        if owner != worker_affinity.worker_index:
+            response = await worker_affinity.forward(req, body, owner)
+            if response is not None:
+                return response
+
     activity = Activity().deserialize(body)
     auth_header = req.headers["Authorization"] if "Authorization" in req.headers else ""
 
-    response = await adapter.process_activity(activity, auth_header, bot.on_turn)
+    # Acknowledge message and conversation update activities immediately and 
+    # process them on the turn queue (invoke activities need a direct response)
+    if turn_queue is not None and activity.type in (ActivityTypes.message, ActivityTypes.conversation_update):
+        identity = await adapter._authenticate_request(activity, auth_header)
+        if activity.type == ActivityTypes.conversation_update:
+            priority = PRIORITY_NEW_CONVERSATION
+        else:
+            priority = PRIORITY_ONGOING_CONVERSATION
+        if not turn_queue.enqueue(activity, identity, priority):
+            return Response(status=503, headers={"Retry-After": "1"})
+        return Response(status=202)
+
+    if admission_control is not None:
+        admission_control.turn_started()
+    try:
+        conversation_id = activity.conversation.id if activity.conversation else None
+        with tracing.trace("process_activity", conversation_id=conversation_id, activity_type=activity.type):
+            response = await adapter.process_activity(activity, auth_header, bot.on_turn)
+    finally:
+        if admission_control is not None:
+            admission_control.turn_finished()
     if response:
-        return json_response(data=response.body, status=response.status)
+        return fast_path.json_response(data=response.body, status=response.status)
     return Response(status=201)
 
 
+# Expose the turn metrics (stage durations, token usage) in the Prometheus 
+# text format on /metrics (requires the admin token, all requests are refused 
+# if none is configured)
+async def metrics(req: Request) -> Response:
+    expected = f"Bearer {config.ADMIN_TOKEN}"
+    if not config.ADMIN_TOKEN or not hmac.compare_digest(req.headers.get("Authorization", ""), expected):
+        raise PermissionError("Invalid admin token")
+    return Response(
+        body=metrics_registry.render().encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
+
+
+async def preload_openai_client(app: web.Application):
+    threading.Thread(target=bot.message_processing.preload_openai_client, name="openai-client-preload",
+                     daemon=True).start()
+
+
+def warm_up_pipeline():
+    bot.message_processing.warm_up()
+
+
+def warm_up_openai_client():
+    bot.message_processing.preload_openai_client()
+    # The gpt api request of the warm-up is billed for every worker start, so 
+    # deployments opt in with warmup.llm_request
+    if warmup_settings.get("llm_request", False):
+        bot.message_processing.send_warm_up_request(timeout=float(warmup_settings.get("llm_request_timeout_seconds", 10.0)))
+
+
+async def warm_up_storage():
+    await storage.read([WARMUP_STORAGE_KEY])
+
+
+async def warm_up_connector_token():
+    await adapter.prefetch_token(config.APP_ID, config.APP_PASSWORD)
+
+
+async def start_warmup(app: web.Application):
+    startup_warmup.start()
+
+
+async def stop_warmup(app: web.Application):
+    await startup_warmup.stop()
+
+
+async def start_turn_queue(app: web.Application):
+    await turn_queue.start()
+
+
+async def stop_turn_queue(app: web.Application):
+    await turn_queue.stop()
+
+
+async def close_connector_sessions(app: web.Application):
+    await adapter.close_sessions()
+
+
+async def start_loop_watchdog(app: web.Application):
+    loop_watchdog.start()
+
+
+async def stop_loop_watchdog(app: web.Application):
+    await loop_watchdog.stop()
+
+
+async def start_key_refresh(app: web.Application):
+    token_validation_cache.start_key_refresh()
+
+
+async def stop_key_refresh(app: web.Application):
+    await token_validation_cache.stop_key_refresh()
+
+
 app = web.Application(middlewares=[aiohttp_error_middleware])
 app.router.add_post("/api/messages", messages)
+# Liveness (/healthz) and readiness (/readyz) probes of the load balancer
+app.router.add_get("/healthz", startup_warmup.handle_liveness)
+app.router.add_get("/readyz", startup_warmup.handle_readiness)
+if warmup_settings.get("enabled", False):
+    startup_warmup.add_step("pipeline", warm_up_pipeline)
+    startup_warmup.add_step("openai", warm_up_openai_client)
+    startup_warmup.add_step("storage", warm_up_storage)
+    if isinstance(adapter, PooledConnectorAdapter):
+        startup_warmup.add_step("connector_token", warm_up_connector_token)
+else:
+    # Import the openai package in the background once the server accepts 
+    # requests (the import is most of the cold start of the bot)
+    app.on_startup.append(preload_openai_client)
+app.on_startup.append(start_warmup)
+app.on_cleanup.append(stop_warmup)
+if metrics_settings.get("enabled", False):
+    app.router.add_get("/metrics", metrics)
+if profiling_settings.get("enabled", False):
+    # On-demand profile of the worker process handling the request (requires 
+    # the admin token)
+    profiling_endpoint = ProfilingEndpoint(config.ADMIN_TOKEN, float(profiling_settings.get("max_seconds", 60.0)))
+    app.router.add_get("/admin/profile", profiling_endpoint.handle)
+if turn_queue is not None:
+    app.on_startup.append(start_turn_queue)
+    app.on_cleanup.append(stop_turn_queue)
+if isinstance(adapter, PooledConnectorAdapter):
+    app.on_cleanup.append(close_connector_sessions)
+if loop_watchdog is not None:
+    app.on_startup.append(start_loop_watchdog)
+    app.on_cleanup.append(stop_loop_watchdog)
+if token_validation_cache is not None and config.APP_ID:
+    app.on_startup.append(start_key_refresh)
+    app.on_cleanup.append(stop_key_refresh)
 
 if __name__ == "__main__":
     try:
-        web.run_app(app, host="0.0.0.0", port=config.PORT)
+        worker_count = int(serving_settings.get("worker_count", 1))
+        if worker_count > 1:
+            # Load all prompt templates before forking the worker processes
+            bot.message_processing.preload_prompt_templates()
+            serve(
+                app,
+                host="0.0.0.0",
+                port=config.PORT,
+                worker_count=worker_count,
+                conversation_affinity=bool(serving_settings.get("conversation_affinity", False)),
+                internal_base_port=int(serving_settings.get("internal_base_port", 8100))
+            )
+        else:
+            web.run_app(app, host="0.0.0.0", port=config.PORT)
     except Exception as error:
         #logger.error(f"An error occurred while starting the app: {error}")
         raise error
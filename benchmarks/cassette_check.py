@@ -0,0 +1,116 @@
+"""
+Check that the llm cassette records and replays the calls of the openai
+client.
+
+Records chat completions of the real openai client against the local fake
+OpenAI api (which compresses its responses with gzip like the OpenAI api),
+replays them from the cassette without the fake api and compares the
+answers. Exits with status 1 if a call fails or a replayed answer differs
+from the recorded one. Needs the openai package. Run from the repository
+root:
+
+    python -m benchmarks.cassette_check
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+
+import httpx
+import openai
+
+from bot.llm_cassette import Cassette, CassetteTransport
+
+
+MESSAGES = [
+    [{"role": "user", "content": "Ich habe eine Bestellung gemacht, aber der Pullover ist nicht angekommen."}],
+    [{"role": "user", "content": "Meine Bestellnummer ist 2246."}],
+]
+
+
+def run_fake_openai(port: int, started: threading.Event, stopped: threading.Event):
+    """
+    Runs the fake OpenAI api with compressed responses until stopped (in a
+    thread with its own event loop).
+
+    Args:
+        port (int): The port of the fake api.
+        started (threading.Event): Set when the fake api accepts requests.
+        stopped (threading.Event): Set to stop the fake api.
+    """
+
+    from tools.fake_openai import FakeOpenAI
+
+    async def serve():
+        fake_openai = FakeOpenAI(compress=True)
+        await fake_openai.start(port=port)
+        started.set()
+        try:
+            while not stopped.is_set():
+                await asyncio.sleep(0.05)
+        finally:
+            await fake_openai.stop()
+
+    asyncio.run(serve())
+
+
+def create_completions(cassette_path: str, mode: str, port: int) -> list:
+    """
+    Creates the chat completions with an openai client whose calls go through
+    the cassette.
+
+    Args:
+        cassette_path (str): The path of the cassette file.
+        mode (str): "record" or "replay".
+        port (int): The port of the fake api.
+
+    Returns:
+        list: The answers.
+    """
+
+    transport = CassetteTransport(Cassette(cassette_path), mode)
+    client = openai.OpenAI(api_key="cassette-check", base_url=f"http://127.0.0.1:{port}/v1", max_retries=0,
+                           http_client=httpx.Client(transport=transport))
+    try:
+        return [
+            client.chat.completions.create(model="gpt-4o-mini", messages=messages).choices[0].message.content
+            for messages in MESSAGES
+        ]
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--openai-port", type=int, default=3985)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cassette_path = os.path.join(directory, "llm_cassette.jsonl")
+
+        started = threading.Event()
+        stopped = threading.Event()
+        thread = threading.Thread(target=run_fake_openai, args=(args.openai_port, started, stopped), daemon=True)
+        thread.start()
+        started.wait(10)
+        try:
+            recorded = create_completions(cassette_path, "record", args.openai_port)
+        finally:
+            stopped.set()
+            thread.join()
+
+        # Replay without the fake api
+        replayed = create_completions(cassette_path, "replay", args.openai_port)
+
+    print(json.dumps({"calls": len(MESSAGES), "recorded": recorded, "replayed": replayed}, ensure_ascii=False))
+    if replayed != recorded:
+        print("The replayed answers differ from the recorded answers", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Benchmark of the reply path (connector client) of the default
+BotFrameworkAdapter against the PooledConnectorAdapter, using the local fake
+connector. Run from the repository root:
+
+    python -m benchmarks.connector_benchmark --sends 2000 --concurrency 16 --token-latency 0.002
+
+With --token-latency > 0, the replies are sent with simulated app credentials
+whose token lookup takes the given time in seconds.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import time
+
+from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings
+from botbuilder.schema import Activity, ActivityTypes
+from botframework.connector.auth import ClaimsIdentity, MicrosoftAppCredentials
+
+from server.connector_pool import PooledConnectorAdapter
+from tools.fake_connector import FakeConnector
+
+
+class SimulatedAppCredentials(MicrosoftAppCredentials):
+    """
+    App credentials which simulate the token lookup with a fixed delay and
+    return an unsigned token valid for one hour.
+    """
+
+    def __init__(self, app_id: str, token_latency: float):
+        super().__init__(app_id, "password")
+        self.token_latency = token_latency
+        self.token_requests = 0
+
+    def get_access_token(self, force_refresh: bool = False) -> str:
+        self.token_requests += 1
+        time.sleep(self.token_latency)
+        payload = json.dumps({"aud": "https://api.botframework.com", "exp": int(time.time()) + 3600})
+        encoded_payload = base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+        return f"eyJhbGciOiJub25lIn0.{encoded_payload}."
+
+
+async def run_benchmark(adapter_name: str, send_count: int, concurrency: int, token_latency: float, port: int) -> dict:
+    """
+    Sends replies through the connector client of an adapter.
+
+    Args:
+        adapter_name (str): "default" or "pooled".
+        send_count (int): The number of replies to send.
+        concurrency (int): The number of concurrent senders.
+        token_latency (float): The simulated token lookup time in seconds (0
+        for the unauthenticated scenario).
+        port (int): The port of the fake connector.
+
+    Returns:
+        dict: The benchmark results.
+    """
+
+    credentials = None
+    identity = None
+    if token_latency > 0:
+        credentials = SimulatedAppCredentials("benchmark-app-id", token_latency)
+        identity = ClaimsIdentity({"aud": "benchmark-app-id", "appid": "benchmark-app-id"}, True)
+    settings = BotFrameworkAdapterSettings("", app_credentials=credentials)
+    adapter = PooledConnectorAdapter(settings) if adapter_name == "pooled" else BotFrameworkAdapter(settings)
+
+    service_url = f"http://127.0.0.1:{port}"
+    latencies = []
+    counter = iter(range(send_count))
+
+    async def sender():
+        for index in counter:
+            start = time.perf_counter()
+            client = await adapter.create_connector_client(service_url, identity)
+            reply = Activity(type=ActivityTypes.message, text=f"Antwort {index}")
+            await client.conversations.reply_to_activity(f"conversation-{index % 50}", f"activity-{index}", reply)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(sender() for _ in range(concurrency)))
+    duration = time.perf_counter() - start
+    if adapter_name == "pooled":
+        await adapter.close_sessions()
+
+    latencies.sort()
+    return {
+        "adapter": adapter_name,
+        "sends": send_count,
+        "concurrency": concurrency,
+        "token_latency_ms": token_latency * 1000,
+        "sends_per_second": round(send_count / duration, 1),
+        "latency_p50_ms": round(1000 * latencies[len(latencies) // 2], 3),
+        "latency_p99_ms": round(1000 * latencies[int(len(latencies) * 0.99)], 3),
+        "token_requests": credentials.token_requests if credentials else 0,
+    }
+
+
+async def run_all(args) -> list:
+    fake_connector = FakeConnector()
+    await fake_connector.start(port=args.port)
+    results = []
+    try:
+        for adapter_name in ("default", "pooled"):
+            await run_benchmark(adapter_name, min(100, args.sends), args.concurrency, args.token_latency, args.port)  # warm-up
+            results.append(await run_benchmark(adapter_name, args.sends, args.concurrency, args.token_latency, args.port))
+    finally:
+        await fake_connector.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sends", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=3981)
+    args = parser.parse_args()
+
+    for result in asyncio.run(run_all(args)):
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
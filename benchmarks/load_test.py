@@ -0,0 +1,388 @@
+"""
+End-to-end load test of the bot.
+
+Runs the real aiohttp app (in a separate process, with the memory storage)
+against the local fake of the OpenAI api and the fake connector, and drives it
+over http with concurrent simulated participants. Each participant follows a
+realistic path through the dialogue states of states.json: it reads the
+dialogue state of the last bot reply, picks one of the outgoing edges of that
+state and sends a message which fills the slots of the edge, until the bot
+reports the final state. Prints the throughput, the turn latency
+percentiles, the error and fallback rates and the storage operations as json.
+Run from the repository root:
+
+    python -m benchmarks.load_test --conversations 200 --participants 20 --llm-latency 0.5 --llm-error-rate 0.02
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import time
+
+import aiohttp
+from aiohttp import web
+from botbuilder.core import MemoryStorage
+
+
+STATES_FILE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "bot", "data", "states", "states.json")
+
+# Messages of the participants which fill the slots (each matches the slot
+# patterns of its slot only, except for f which also fills g)
+SLOT_MESSAGES = {
+    "a": "Ich habe ein Problem mit meiner Bestellung.",
+    "b": "Ein Teil ist nicht angekommen.",
+    "c": "Der Pullover fehlt.",
+    "d": "Meine Bestellnummer ist 2246.",
+    "f": "Nein, damit bin ich nicht einverstanden.",
+    "g": "Okay, das passt.",
+    "h": "Wann kommt die Nachlieferung?",
+}
+# Message of the participants which fills no slot
+NO_SLOT_MESSAGE = "Hallo."
+
+
+class CountingStorage(MemoryStorage):
+    """
+    Memory storage which counts the storage operations of the bot.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.read_count = 0
+        self.write_count = 0
+        self.written_item_count = 0
+        self.delete_count = 0
+
+    async def read(self, keys: list):
+        self.read_count += 1
+        return await super().read(keys)
+
+    async def write(self, changes: dict):
+        self.write_count += 1
+        self.written_item_count += len(changes or {})
+        return await super().write(changes)
+
+    async def delete(self, keys: list):
+        self.delete_count += 1
+        return await super().delete(keys)
+
+
+def run_server(port: int, openai_port: int, conn):
+    """
+    Runs the aiohttp app with the counting storage in a separate process and
+    reports the storage operations and the stage variants of the turns.
+
+    Args:
+        port (int): The port to listen on.
+        openai_port (int): The port of the fake OpenAI api.
+        conn: The pipe connection to the load test process.
+    """
+
+    # Let the openai clients of the bot use the fake api
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{openai_port}/v1"
+    os.environ["OPENAI_API_KEY"] = "fake-key"
+
+    import app as app_module
+    from botbuilder.core import ConversationState
+    from bot.bot import Bot
+    from bot.metrics import STAGE_DURATION
+
+    # Only log warnings and errors of the turns
+    logging.getLogger().setLevel(logging.WARNING)
+
+    storage = CountingStorage()
+    app_module.bot = Bot(ConversationState(storage), app_module.treatment_fallback, app_module.admission_control,
+                         app_module.data_bundle)
+    app_module.storage = storage
+    # Skip the gpt api request of the warm-up (the fake api is started after
+    # the server and counts the requests of the turns)
+    app_module.warmup_settings["llm_request"] = False
+    if app_module.turn_queue is not None:
+        app_module.turn_queue.logic = app_module.bot.on_turn
+
+    async def serve():
+        runner = web.AppRunner(app_module.app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        # Start the load once the worker is warmed up (as the load balancer
+        # does with the readiness probe)
+        await app_module.startup_warmup.wait_ready()
+        conn.send("ready")
+        await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+        await runner.cleanup()
+
+        # Number of turns per stage and variant (e.g. slot_filling/fallback)
+        stage_counts = {
+            f"{stage}/{variant}": sum(counts)
+            for (stage, variant), (counts, total) in STAGE_DURATION.series.items()
+        }
+        conn.send({
+            "storage_reads": storage.read_count,
+            "storage_writes": storage.write_count,
+            "storage_written_items": storage.written_item_count,
+            "storage_deletes": storage.delete_count,
+            "stage_counts": stage_counts,
+        })
+
+    asyncio.run(serve())
+
+
+def build_activity(activity_type: str, conversation_id: str, message_index: int, connector_port: int,
+                   text: str = None) -> dict:
+    """
+    Builds an activity as sent by the channel.
+
+    Args:
+        activity_type (str): "conversationUpdate" or "message".
+        conversation_id (str): The id of the conversation.
+        message_index (int): The index of the message within the conversation.
+        connector_port (int): The port of the fake connector.
+        text (str): The text of a message.
+
+    Returns:
+        dict: The activity in json format.
+    """
+
+    activity = {
+        "type": activity_type,
+        "id": f"{conversation_id}-{message_index}",
+        "channelId": "test",
+        "serviceUrl": f"http://127.0.0.1:{connector_port}",
+        "from": {"id": f"user-{conversation_id}", "name": "User"},
+        "conversation": {"id": conversation_id},
+        "recipient": {"id": "bot", "name": "Bot"},
+        "locale": "de-DE",
+    }
+    if activity_type == "conversationUpdate":
+        activity["membersAdded"] = [{"id": f"user-{conversation_id}"}]
+    else:
+        activity["text"] = text
+    return activity
+
+
+def choose_message(states: dict, dialogue_state: str, rng: random.Random) -> str:
+    """
+    Chooses the next message of a participant, which fills the slots of a
+    random outgoing edge of the current dialogue state.
+
+    Args:
+        states (dict): The states of states.json.
+        dialogue_state (str): The current dialogue state.
+        rng (random.Random): The random generator of the participant.
+
+    Returns:
+        str: The message.
+    """
+
+    edges = states.get(dialogue_state, {}).get("edges", {})
+    if not edges:
+        return NO_SLOT_MESSAGE
+    slot_combinations = edges[rng.choice(sorted(edges))]
+    slots = rng.choice(slot_combinations)
+    if not slots:
+        return NO_SLOT_MESSAGE
+    return " ".join(SLOT_MESSAGES.get(slot, NO_SLOT_MESSAGE) for slot in slots)
+
+
+class LoadTestResults:
+    """
+    Class that collects the results of the simulated conversations.
+    """
+
+    def __init__(self):
+        self.turn_latencies = []
+        self.turn_count = 0
+        self.error_count = 0
+        self.completed_conversation_count = 0
+        self.visited_states = {}
+
+
+async def run_conversation(session: aiohttp.ClientSession, url: str, conversation_id: str, replies: asyncio.Queue,
+                           states: dict, rng: random.Random, results: LoadTestResults, args):
+    """
+    Simulates a participant of a conversation.
+
+    Args:
+        session (aiohttp.ClientSession): The http session.
+        url (str): The url of the webhook.
+        conversation_id (str): The id of the conversation.
+        replies (asyncio.Queue): The bot replies of the conversation received
+        by the fake connector.
+        states (dict): The states of states.json.
+        rng (random.Random): The random generator of the participant.
+        results (LoadTestResults): The results to update.
+        args: The command line arguments.
+    """
+
+    async def send_and_wait(activity: dict) -> dict:
+        async with session.post(url, json=activity) as response:
+            await response.read()
+            if response.status >= 300:
+                raise RuntimeError(f"Unexpected status {response.status}")
+        while True:
+            reply = await asyncio.wait_for(replies.get(), args.reply_timeout)
+            channel_data = reply.get("channelData") or {}
+            if reply.get("type") == "message" and "dialogueState" in channel_data:
+                return channel_data
+
+    try:
+        channel_data = await send_and_wait(build_activity("conversationUpdate", conversation_id, 0, args.connector_port))
+        for message_index in range(1, args.max_turns + 1):
+            dialogue_state = channel_data["dialogueState"]
+            results.visited_states[dialogue_state] = results.visited_states.get(dialogue_state, 0) + 1
+            text = choose_message(states, dialogue_state, rng)
+            activity = build_activity("message", conversation_id, message_index, args.connector_port, text)
+            start = time.perf_counter()
+            results.turn_count += 1
+            channel_data = await send_and_wait(activity)
+            results.turn_latencies.append(time.perf_counter() - start)
+            if channel_data.get("finalState"):
+                results.completed_conversation_count += 1
+                break
+    except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError):
+        results.error_count += 1
+
+
+async def run_load(args, states: dict) -> tuple:
+    """
+    Runs the fakes and the simulated participants.
+
+    Args:
+        args: The command line arguments.
+        states (dict): The states of states.json.
+
+    Returns:
+        tuple: The results, the duration in seconds and the fake OpenAI api.
+    """
+
+    from tools.fake_connector import FakeConnector
+    from tools.fake_openai import FakeOpenAI
+
+    replies = {}
+
+    def on_activity(conversation_id: str, activity: dict, arrival_time: float):
+        if conversation_id in replies:
+            replies[conversation_id].put_nowait(activity)
+
+    fake_openai = FakeOpenAI(
+        latency=args.llm_latency,
+        latency_distribution=args.llm_latency_distribution,
+        error_rate=args.llm_error_rate,
+        seed=args.seed
+    )
+    fake_connector = FakeConnector(on_activity=on_activity)
+    await fake_openai.start(port=args.openai_port)
+    await fake_connector.start(port=args.connector_port)
+
+    results = LoadTestResults()
+    url = f"http://127.0.0.1:{args.port}/api/messages"
+    conversation_indexes = iter(range(args.conversations))
+    try:
+        connector = aiohttp.TCPConnector(limit=args.participants)
+        async with aiohttp.ClientSession(connector=connector) as session:
+
+            async def participant():
+                for conversation_index in conversation_indexes:
+                    conversation_id = f"conversation-{conversation_index}"
+                    replies[conversation_id] = asyncio.Queue()
+                    rng = random.Random(f"{args.seed}-{conversation_index}")
+                    await run_conversation(session, url, conversation_id, replies[conversation_id], states, rng,
+                                           results, args)
+                    del replies[conversation_id]
+
+            start = time.perf_counter()
+            await asyncio.gather(*(participant() for _ in range(args.participants)))
+            duration = time.perf_counter() - start
+    finally:
+        await fake_connector.stop()
+        await fake_openai.stop()
+    return results, duration, fake_openai
+
+
+def percentile(sorted_values: list, quantile: float) -> float:
+    """
+    Returns a percentile of sorted values (nearest rank).
+
+    Args:
+        sorted_values (list): The values in ascending order.
+        quantile (float): The quantile between 0 and 1.
+
+    Returns:
+        float: The percentile, or 0.0 without values.
+    """
+
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * quantile))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=100)
+    parser.add_argument("--participants", type=int, default=10)
+    parser.add_argument("--max-turns", type=int, default=15)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--llm-latency-distribution", choices=("fixed", "exponential", "lognormal"), default="lognormal")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--reply-timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=3992)
+    parser.add_argument("--openai-port", type=int, default=3985)
+    parser.add_argument("--connector-port", type=int, default=3981)
+    args = parser.parse_args()
+
+    with open(STATES_FILE_PATH, encoding="utf-8") as file:
+        states = json.load(file)["states"]
+
+    context = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = context.Pipe()
+    server = context.Process(target=run_server, args=(args.port, args.openai_port, child_conn))
+    server.start()
+    parent_conn.recv()
+
+    results, duration, fake_openai = asyncio.run(run_load(args, states))
+
+    parent_conn.send("stop")
+    server_results = parent_conn.recv()
+    server.join()
+
+    stage_counts = server_results.pop("stage_counts")
+    latencies = sorted(results.turn_latencies)
+    turn_count = max(1, results.turn_count)
+
+    def fallback_rate(stage: str) -> float:
+        total = sum(count for key, count in stage_counts.items() if key.startswith(f"{stage}/"))
+        return round(stage_counts.get(f"{stage}/fallback", 0) / total, 4) if total else 0.0
+
+    print(json.dumps({
+        "conversations": args.conversations,
+        "participants": args.participants,
+        "llm_latency_ms": args.llm_latency * 1000,
+        "llm_latency_distribution": args.llm_latency_distribution,
+        "llm_error_rate": args.llm_error_rate,
+        "duration_seconds": round(duration, 3),
+        "turns": results.turn_count,
+        "turns_per_second": round(results.turn_count / duration, 2),
+        "turn_latency_p50_ms": round(1000 * percentile(latencies, 0.50), 3),
+        "turn_latency_p95_ms": round(1000 * percentile(latencies, 0.95), 3),
+        "turn_latency_p99_ms": round(1000 * percentile(latencies, 0.99), 3),
+        "completed_conversations": results.completed_conversation_count,
+        "conversation_error_rate": round(results.error_count / max(1, args.conversations), 4),
+        "slot_filling_fallback_rate": fallback_rate("slot_filling"),
+        "dialogue_management_fallback_rate": fallback_rate("dialogue_management"),
+        "response_generation_fallback_rate": fallback_rate("response_generation"),
+        "llm_requests": fake_openai.request_count,
+        "llm_injected_errors": fake_openai.error_count,
+        **server_results,
+        "storage_writes_per_turn": round(server_results["storage_writes"] / turn_count, 3),
+        "visited_states": dict(sorted(results.visited_states.items())),
+    }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Benchmark of the turn logging under log backpressure.
+
+Simulates turns on the event loop which each log the user and bot text to a
+slow log stream (e.g. backed up App Service log streaming) and compares the
+blocking print with the non-blocking structured logger. Run from the
+repository root:
+
+    python -m benchmarks.logging_benchmark --turns 2000 --concurrency 32 --write-latency 0.002
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from bot.structured_logging import configure_logging
+
+
+USER_TEXT = "Ich habe eine Bestellung bei euch gemacht, aber der Pullover ist nicht angekommen."
+BOT_RESPONSE = "Das tut mir leid! Kannst du mir bitte deine Bestellnummer nennen, damit ich nachsehen kann?"
+
+
+class SlowStream:
+    """
+    Stream that simulates a backed up log sink with a fixed delay per write.
+    """
+
+    def __init__(self, write_latency: float):
+        """
+        Constructor of the SlowStream class.
+
+        Args:
+            write_latency (float): The blocking time per write in seconds.
+        """
+
+        self.write_latency = write_latency
+        self.writes = 0
+
+    def write(self, text: str):
+        self.writes += 1
+        time.sleep(self.write_latency)
+
+    def flush(self):
+        pass
+
+
+async def run_turns(log_turn, turn_count: int, concurrency: int) -> list:
+    """
+    Runs the simulated turns.
+
+    Args:
+        log_turn (Callable): The function which logs a turn.
+        turn_count (int): The number of turns.
+        concurrency (int): The number of concurrent conversations.
+
+    Returns:
+        list: The latencies of the turns in seconds.
+    """
+
+    latencies = []
+    counter = iter(range(turn_count))
+
+    async def conversation():
+        for index in counter:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)  # simulated i/o of the turn
+            log_turn(index)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(conversation() for _ in range(concurrency)))
+    return latencies
+
+
+def run_benchmark(mode: str, turn_count: int, concurrency: int, write_latency: float, max_queue_size: int) -> dict:
+    """
+    Runs the benchmark for one logging mode.
+
+    Args:
+        mode (str): "print" or "structured".
+        turn_count (int): The number of turns.
+        concurrency (int): The number of concurrent conversations.
+        write_latency (float): The blocking time per write of the log stream.
+        max_queue_size (int): The queue size of the structured logger.
+
+    Returns:
+        dict: The benchmark results.
+    """
+
+    stream = SlowStream(write_latency)
+    handler = None
+    if mode == "print":
+        def log_turn(index: int):
+            print(f"User message: {USER_TEXT}\nChatbot response: {BOT_RESPONSE}\nNew State: BD\n\n\n", file=stream)
+    else:
+        handler = configure_logging(max_queue_size=max_queue_size, stream=stream)
+        logger = logging.getLogger("benchmark")
+
+        def log_turn(index: int):
+            logger.info("Turn processed", extra={"fields": {
+                "conversation_id": f"conversation-{index % concurrency}",
+                "user_text": USER_TEXT,
+                "bot_response": BOT_RESPONSE,
+                "new_dialogue_state": "BD",
+            }})
+
+    start = time.perf_counter()
+    latencies = asyncio.run(run_turns(log_turn, turn_count, concurrency))
+    duration = time.perf_counter() - start
+    if handler is not None:
+        handler.close()
+        logging.getLogger().removeHandler(handler)
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "turns": turn_count,
+        "concurrency": concurrency,
+        "write_latency_ms": write_latency * 1000,
+        "turns_per_second": round(turn_count / duration, 1),
+        "latency_p50_ms": round(1000 * latencies[len(latencies) // 2], 3),
+        "latency_p99_ms": round(1000 * latencies[int(len(latencies) * 0.99)], 3),
+        "dropped_records": handler.dropped_records if handler is not None else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--write-latency", type=float, default=0.002)
+    parser.add_argument("--max-queue-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    for mode in ("print", "structured"):
+        result = run_benchmark(mode, args.turns, args.concurrency, args.write_latency, args.max_queue_size)
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Check that no stage of the bot pipeline blocks the event loop.
+
+Drives conversations through the real aiohttp app against the local fake
+OpenAI api and the fake connector, while the loop watchdog captures the stack
+of every blocking of the event loop longer than the threshold. Exits with
+status 1 (and prints the stacks) if the loop was blocked by code of the
+pipeline. Delays where the loop thread was caught inside the selector (waiting
+for the GIL held by the message processing threads) are only counted. Run from
+the repository root:
+
+    python -m benchmarks.loop_blocking_check --max-block-ms 100
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+
+def build_activity(activity_type: str, conversation_index: int, message_index: int, port: int) -> dict:
+    """
+    Builds an activity as sent by the channel.
+
+    Args:
+        activity_type (str): "conversationUpdate" or "message".
+        conversation_index (int): The index of the conversation.
+        message_index (int): The index of the message within the conversation.
+        port (int): The port of the fake connector.
+
+    Returns:
+        dict: The activity in json format.
+    """
+
+    activity = {
+        "type": activity_type,
+        "id": f"activity-{conversation_index}-{message_index}",
+        "channelId": "test",
+        "serviceUrl": f"http://127.0.0.1:{port}",
+        "from": {"id": f"user-{conversation_index}", "name": "User"},
+        "conversation": {"id": f"conversation-{conversation_index}"},
+        "recipient": {"id": "bot", "name": "Bot"},
+        "locale": "de-DE",
+    }
+    if activity_type == "conversationUpdate":
+        activity["membersAdded"] = [{"id": f"user-{conversation_index}"}]
+    else:
+        activity["text"] = "Ich habe eine Bestellung gemacht, aber der Pullover ist nicht angekommen. Bestellnummer 2246."
+    return activity
+
+
+async def drive_conversations(args):
+    """
+    Runs the fake OpenAI api, the fake connector and the simulated
+    participants (in a child process, so that they neither add load to the
+    event loop of the app nor compete for its GIL).
+
+    Args:
+        args: The command line arguments.
+    """
+
+    from tools.fake_connector import FakeConnector
+    from tools.fake_openai import FakeOpenAI
+
+    fake_openai = FakeOpenAI(latency=args.llm_latency)
+    fake_connector = FakeConnector()
+    await fake_openai.start(port=args.openai_port)
+    await fake_connector.start(port=args.connector_port)
+    url = f"http://127.0.0.1:{args.port}/api/messages"
+    try:
+        async with aiohttp.ClientSession() as session:
+
+            async def conversation(conversation_index: int):
+                activity = build_activity("conversationUpdate", conversation_index, 0, args.connector_port)
+                async with session.post(url, json=activity) as response:
+                    response.raise_for_status()
+                for message_index in range(1, args.messages + 1):
+                    activity = build_activity("message", conversation_index, message_index, args.connector_port)
+                    async with session.post(url, json=activity) as response:
+                        response.raise_for_status()
+
+            await asyncio.gather(*(conversation(index) for index in range(args.conversations)))
+    finally:
+        await fake_connector.stop()
+        await fake_openai.stop()
+
+
+def run_conversations(args):
+    """
+    Entry point of the child process which drives the conversations.
+
+    Args:
+        args: The command line arguments.
+    """
+
+    asyncio.run(drive_conversations(args))
+
+
+async def run_check(args) -> dict:
+    """
+    Runs the conversations and collects the blockings of the event loop.
+
+    Args:
+        args: The command line arguments.
+
+    Returns:
+        dict: The results of the check.
+    """
+
+    # Let the openai clients of the bot use the fake api
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.openai_port}/v1"
+    os.environ["OPENAI_API_KEY"] = "fake-key"
+
+    import app as app_module
+    from botbuilder.core import ConversationState, MemoryStorage
+    from bot.bot import Bot
+    from server.loop_watchdog import LoopWatchdog
+
+    app_module.bot = Bot(ConversationState(MemoryStorage()), 1)
+    app_module.turn_queue = None
+    app_module.admission_control = None
+
+    runner = web.AppRunner(app_module.app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+
+    # Start the threads of the default executor up front, as starting a thread
+    # waits for it on the loop (once per thread of the pool)
+    await asyncio.gather(*(asyncio.to_thread(time.sleep, 0.05) for _ in range(args.conversations)))
+
+    watchdog = LoopWatchdog(interval=0.005, block_threshold=args.max_block_ms / 1000)
+    watchdog.start()
+    try:
+        process = multiprocessing.get_context("spawn").Process(target=run_conversations, args=(args,))
+        process.start()
+        await asyncio.to_thread(process.join)
+        if process.exitcode != 0:
+            raise RuntimeError(f"The conversations failed with exit code {process.exitcode}")
+    finally:
+        await watchdog.stop()
+        await runner.cleanup()
+
+    return {
+        "conversations": args.conversations,
+        "messages_per_conversation": args.messages,
+        "max_block_ms": args.max_block_ms,
+        "max_loop_lag_ms": round(watchdog.max_lag * 1000, 3),
+        "gil_delays": sum(report.in_loop_internals for report in watchdog.reports),
+        "blockings": sum(not report.in_loop_internals for report in watchdog.reports),
+        "stacks": [report.stack for report in watchdog.reports if not report.in_loop_internals],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=10)
+    parser.add_argument("--max-block-ms", type=float, default=100.0)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--port", type=int, default=3991)
+    parser.add_argument("--openai-port", type=int, default=3985)
+    parser.add_argument("--connector-port", type=int, default=3981)
+    args = parser.parse_args()
+
+    result = asyncio.run(run_check(args))
+    stacks = result.pop("stacks")
+    print(json.dumps(result))
+    if stacks:
+        for stack in stacks:
+            print(f"\nEvent loop blocked at:\n{stack}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
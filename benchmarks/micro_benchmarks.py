@@ -0,0 +1,425 @@
+"""
+Micro-benchmarks of the pipeline components which do not need the network.
+
+Measures the time per call of the slot filling helpers (including the
+pattern matching fallback on short, long and adversarial texts), of the
+dialogue management for every state and combination of newly filled slots
+of the conversation history formatting and the token-budgeted history
+window of the response generation for long histories, and of the inference of
+the local slot classifier (with random weights). The results are
+compared with the stored baselines and the script exits with status 1 if a
+benchmark is slower than its baseline by more than the threshold plus the
+noise of the benchmark (in every one of up to --runs measurements, the
+first in the process itself and the others in new processes).
+
+A baseline is the median of --runs measurements in separate processes, and
+the spread of these measurements above the median is stored as the noise of
+the benchmark (at least a minimum noise for benchmarks of a few
+microseconds, which vary much more between runs than the slower ones). The
+measurements are compared with the measurement settings of the baselines
+unless they are given, and always with the same hash seed. Run from the repository root:
+
+    python -m benchmarks.micro_benchmarks --threshold 0.25
+    python -m benchmarks.micro_benchmarks --save-baseline
+
+The baselines depend on the machine, so save them again when the benchmarks
+run on a different machine.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from bot.message_processing import MessageProcessing
+from bot.slot_classifier import DEFAULT_HASH_BITS, MAX_USER_TEXT_LENGTH, SlotClassifier
+
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "micro_benchmarks.json")
+
+SHORT_TEXT = "Der Pullover fehlt."
+LONG_TEXT = " ".join([
+    "Hallo, ich habe vor zwei Wochen eine Bestellung bei euch aufgegeben und heute ist das Paket angekommen.",
+    "Leider ist die Lieferung nicht vollständig, der Pullover fehlt und die Jeans war auch nicht dabei.",
+    "Meine Bestellnummer ist 2246. Wann kommt der fehlende Artikel? Ich brauche ihn dringend.",
+] * 10)
+# Text with many repetitions of a word which starts many partial matches of
+# the slot patterns (backtracking of the patterns with unbounded repetitions)
+ADVERSARIAL_TEXT = "bestellung " * 200
+
+# Hash seed of the measurements (the time of some benchmarks differs by up to
+# 70% between processes with different hash seeds)
+HASH_SEED = "0"
+
+# Minimum noise of a benchmark by its time per call (the time of benchmarks of
+# a few microseconds varies between processes more than between the
+# measurements of one process)
+MIN_NOISE = ((1e-5, 0.5), (1e-4, 0.4))
+
+
+def measure(function, min_time: float, repeat: int) -> float:
+    """
+    Measures the time per call of a function.
+    - Calibrates the number of calls per round so that a round takes at least
+    min_time / repeat seconds and returns the fastest round (the least
+    disturbed by other processes).
+
+    Args:
+        function (Callable): The function to measure (without arguments).
+        min_time (float): The minimum measurement time in seconds.
+        repeat (int): The number of rounds.
+
+    Returns:
+        float: The time per call in seconds.
+    """
+
+    number = 1
+    round_time = min_time / repeat
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= round_time:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(round_time / elapsed) + 1))
+
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def get_noise(measurements: list) -> float:
+    """
+    Returns the noise of a benchmark: the relative spread of its measurements
+    above their median, at least the minimum noise for its time per call.
+
+    Args:
+        measurements (list): The times per call in seconds.
+
+    Returns:
+        float: The noise relative to the median measurement.
+    """
+
+    seconds = statistics.median(measurements)
+    min_noise = next((noise for max_seconds, noise in MIN_NOISE if seconds < max_seconds), 0.0)
+    return max(max(measurements) / seconds - 1, min_noise)
+
+
+def build_conversation_history(message_count: int) -> list:
+    """
+    Builds a conversation history with alternating bot and user messages.
+
+    Args:
+        message_count (int): The number of messages.
+
+    Returns:
+        list: The conversation history.
+    """
+
+    return [
+        ("bot", f"Nachricht {index} des Chatbots: Können Sie mir bitte Ihre Bestellnummer nennen?")
+        if index % 2 == 0 else
+        ("user", f"Nachricht {index} des Kunden: Der Pullover aus meiner Bestellung ist nicht angekommen.")
+        for index in range(message_count)
+    ]
+
+
+def build_dialogue_management_cases(message_processing: MessageProcessing) -> list:
+    """
+    Builds the arguments of the dialogue management for every dialogue state
+    and every combination of newly filled slots of that state.
+
+    Args:
+        message_processing (MessageProcessing): The message processing.
+
+    Returns:
+        list: The arguments (current state, slot filling, newly filled slots).
+    """
+
+    slot_filling = message_processing.slot_filling
+    cases = []
+    for dialogue_state in message_processing.state_info:
+        slots_to_check = slot_filling._get_slots_to_check(dialogue_state)
+        for size in range(len(slots_to_check) + 1):
+            for slots in itertools.combinations(slots_to_check, size):
+                newly_filled_slots = slot_filling.prepare_result({slot: 1 for slot in slots})
+                cases.append((dialogue_state, dict(newly_filled_slots), newly_filled_slots))
+    return cases
+
+
+def build_slot_classifier(slot_ids: list, weight_count: int = 20000) -> SlotClassifier:
+    """
+    Builds a slot classifier with random weights (the inference time does not
+    depend on the values of the weights).
+
+    Args:
+        slot_ids (list): The slots of the classifier.
+        weight_count (int): The number of weights per slot.
+
+    Returns:
+        SlotClassifier: The slot classifier (which is confident for every
+        turn).
+    """
+
+    rng = random.Random(0)
+    slot_models = {
+        slot_id: {
+            "bias": 0.0,
+            "weights": {rng.randrange(1 << DEFAULT_HASH_BITS): rng.gauss(0.0, 1.0) for _ in range(weight_count)},
+        }
+        for slot_id in slot_ids
+    }
+    return SlotClassifier(slot_models, confidence_threshold=0.0)
+
+
+def build_benchmarks(message_processing: MessageProcessing) -> dict:
+    """
+    Builds the benchmarks.
+
+    Args:
+        message_processing (MessageProcessing): The message processing.
+
+    Returns:
+        dict: The functions to measure (without arguments) per benchmark name.
+    """
+
+    slot_filling = message_processing.slot_filling
+    dialogue_management = message_processing.dialogue_management
+    response_generation = message_processing.response_generation
+    dialogue_states = list(message_processing.state_info)
+    slots_per_state = [slot_filling._get_slots_to_check(state) for state in dialogue_states]
+    all_slots = max(slots_per_state, key=len)
+    example = slot_filling.prepare_output_example(all_slots)
+    dialogue_management_cases = build_dialogue_management_cases(message_processing)
+    conversation_history_200 = build_conversation_history(200)
+    conversation_history_2000 = build_conversation_history(2000)
+    slot_classifier = build_slot_classifier(list(message_processing.slot_template))
+    classifier_state = dialogue_states[slots_per_state.index(all_slots)]
+
+    def get_slots_to_check():
+        for state in dialogue_states:
+            slot_filling._get_slots_to_check(state)
+
+    def run_dialogue_management():
+        for current_dialogue_state, filled_slots, newly_filled_slots in dialogue_management_cases:
+            try:
+                dialogue_management.run(current_dialogue_state, filled_slots, newly_filled_slots)
+            except Exception:
+                pass
+
+    benchmarks = {
+        "slot_filling.get_slots_to_check[all_states]": get_slots_to_check,
+        "slot_filling.get_slot_filling_prompts[short]": lambda: slot_filling._get_slot_filling_prompts(
+            "Können Sie mir bitte Ihre Bestellnummer nennen?", SHORT_TEXT, all_slots),
+        "slot_filling.get_slot_filling_prompts[long]": lambda: slot_filling._get_slot_filling_prompts(
+            "Können Sie mir bitte Ihre Bestellnummer nennen?", LONG_TEXT, all_slots),
+        "slot_filling.prepare_output_example": lambda: slot_filling.prepare_output_example(all_slots),
+        "slot_filling.extract_gpt_response[valid]": lambda: slot_filling._extract_gpt_response(example, all_slots),
+        "slot_filling.extract_gpt_response[invalid]": lambda: slot_filling._extract_gpt_response(
+            "Die Klassifikation lautet: a=1", all_slots),
+        "slot_filling.prepare_result": lambda: slot_filling.prepare_result({slot: 1 for slot in all_slots}),
+        "dialogue_management.run[all_states_and_slots]": run_dialogue_management,
+        "response_generation.get_conv_hist_for_prompt[200]": lambda: response_generation._get_conv_hist_for_prompt(
+            conversation_history_200, SHORT_TEXT),
+        "response_generation.get_conv_hist_for_prompt[2000]": lambda: response_generation._get_conv_hist_for_prompt(
+            conversation_history_2000, SHORT_TEXT),
+        "response_generation.get_history_window[2000]": lambda: response_generation._get_history_window(
+            conversation_history_2000, SHORT_TEXT, response_generation.history_token_budget),
+        "slot_classifier.classify[short]": lambda: slot_classifier.classify(
+            classifier_state, "Können Sie mir bitte Ihre Bestellnummer nennen?", SHORT_TEXT, all_slots),
+        "slot_classifier.classify[max_length]": lambda: slot_classifier.classify(
+            classifier_state, "Können Sie mir bitte Ihre Bestellnummer nennen?", LONG_TEXT[:MAX_USER_TEXT_LENGTH],
+            all_slots),
+    }
+    for text_name, text in (("short", SHORT_TEXT), ("long", LONG_TEXT), ("adversarial", ADVERSARIAL_TEXT)):
+        benchmarks[f"slot_filling.run_fallback[{text_name}]"] = (
+            lambda text=text: [slot_filling.run_fallback(text, state) for state in dialogue_states]
+        )
+    return benchmarks
+
+
+def load_baselines(file_path: str) -> dict:
+    """
+    Loads the stored baselines.
+
+    Args:
+        file_path (str): The path of the baseline file.
+
+    Returns:
+        dict: The baseline file with the time per call in seconds
+        ("benchmarks") and the noise ("noise") per benchmark name, and the
+        measurement settings ("settings").
+    """
+
+    if not os.path.exists(file_path):
+        return {"benchmarks": {}, "noise": {}, "settings": {}}
+    with open(file_path, "r", encoding="utf-8") as f:
+        baselines = json.load(f)
+    baselines.setdefault("noise", {})
+    baselines.setdefault("settings", {})
+    return baselines
+
+
+def save_baselines(file_path: str, results: dict, noise: dict, settings: dict):
+    """
+    Stores the results as baselines.
+
+    Args:
+        file_path (str): The path of the baseline file.
+        results (dict): The time per call in seconds per benchmark name.
+        noise (dict): The relative spread of the measurements per benchmark
+        name.
+        settings (dict): The measurement settings of the results.
+    """
+
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    baselines = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "settings": settings,
+        "benchmarks": {name: round(seconds, 9) for name, seconds in sorted(results.items())},
+        "noise": {name: round(spread, 4) for name, spread in sorted(noise.items())},
+    }
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(baselines, indent=2) + "\n")
+
+
+def measure_in_processes(name_filter: str, settings: dict) -> dict:
+    """
+    Measures the benchmarks once in each of a number of new processes (so that
+    the spread of the measurements includes the differences between processes
+    and the changes of the load of the machine over time).
+
+    Args:
+        name_filter (str): The text the names of the benchmarks must contain.
+        settings (dict): The measurement settings.
+
+    Returns:
+        dict: The times per call in seconds (one per process) per benchmark
+        name.
+    """
+
+    measurements = {}
+    for _ in range(settings["runs"]):
+        completed = subprocess.run(
+            [sys.executable, "-m", "benchmarks.micro_benchmarks", "--measure-once", "--filter", name_filter,
+             "--min-time", str(settings["min_time"]), "--repeat", str(settings["repeat"])],
+            cwd=ROOT_PATH, capture_output=True, text=True, check=True)
+        for name, seconds in json.loads(completed.stdout.splitlines()[-1]).items():
+            measurements.setdefault(name, []).append(seconds)
+    return measurements
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="", help="Only run the benchmarks whose name contains this text")
+    parser.add_argument("--min-time", type=float, default=None,
+                        help="Minimum measurement time per benchmark in seconds (default: as for the baselines, or 0.5)")
+    parser.add_argument("--repeat", type=int, default=None,
+                        help="Number of rounds per measurement (default: as for the baselines, or 5)")
+    parser.add_argument("--runs", type=int, default=None,
+                        help="Number of measurements per benchmark (default: as for the baselines, or 5)")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Allowed slowdown relative to the baseline (in addition to the noise of the benchmark)")
+    parser.add_argument("--baseline-file", default=BASELINE_FILE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    # Measures every benchmark once and prints the results (in the processes
+    # of measure_in_processes)
+    parser.add_argument("--measure-once", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Restart the process with the fixed hash seed
+    if os.environ.get("PYTHONHASHSEED") != HASH_SEED:
+        os.environ["PYTHONHASHSEED"] = HASH_SEED
+        os.execv(sys.executable, sys.orig_argv)
+
+    baselines = load_baselines(args.baseline_file)
+    settings = {
+        "min_time": args.min_time if args.min_time is not None else baselines["settings"].get("min_time", 0.5),
+        "repeat": args.repeat if args.repeat is not None else baselines["settings"].get("repeat", 5),
+        "runs": args.runs if args.runs is not None else baselines["settings"].get("runs", 5),
+    }
+
+    if args.save_baseline:
+        process_measurements = measure_in_processes(args.filter, settings)
+        benchmarks = dict.fromkeys(process_measurements)
+    else:
+        # Make the random output examples reproducible
+        random.seed(0)
+        message_processing = MessageProcessing()
+        message_processing.preload_prompt_templates()
+        benchmarks = build_benchmarks(message_processing)
+
+    if args.measure_once:
+        print(json.dumps({
+            name: measure(function, settings["min_time"], settings["repeat"])
+            for name, function in benchmarks.items() if args.filter in name
+        }))
+        return
+
+    results = {}
+    noise = {}
+    regressions = []
+    for name, function in benchmarks.items():
+        if args.filter not in name:
+            continue
+        baseline = baselines["benchmarks"].get(name)
+        allowed_change = args.threshold + baselines["noise"].get(name, 0.0)
+
+        if args.save_baseline:
+            measurements = process_measurements[name]
+            seconds = statistics.median(measurements)
+            noise[name] = get_noise(measurements)
+        else:
+            # Measure again in new processes while the fastest measurement is
+            # beyond the allowed change (the time of some benchmarks depends on
+            # the memory layout of the process, and the load of the machine
+            # changes over time)
+            measurements = [measure(function, settings["min_time"], settings["repeat"])]
+            for _ in range(settings["runs"] - 1):
+                if not baseline or min(measurements) / baseline - 1 <= allowed_change:
+                    break
+                measurements += measure_in_processes(name, {**settings, "runs": 1}).get(name, [])
+            seconds = min(measurements)
+        results[name] = seconds
+
+        change = (seconds / baseline - 1) if baseline else None
+        regression = change is not None and change > allowed_change and not args.save_baseline
+        if regression:
+            regressions.append(name)
+        print(json.dumps({
+            "benchmark": name,
+            "time_per_call_us": round(seconds * 1e6, 3),
+            "baseline_us": round(baseline * 1e6, 3) if baseline else None,
+            "change": round(change, 4) if change is not None else None,
+            "allowed_change": round(allowed_change, 4),
+            "regression": regression,
+        }))
+
+    if args.save_baseline:
+        save_baselines(
+            args.baseline_file,
+            {**baselines["benchmarks"], **results},
+            {**baselines["noise"], **noise},
+            settings
+        )
+    elif regressions:
+        print(f"Regressions beyond the threshold of {args.threshold:.0%} plus the noise: {', '.join(regressions)}",
+              file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
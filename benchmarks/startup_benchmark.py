@@ -0,0 +1,279 @@
+"""
+Startup benchmark of the bot.
+
+Measures the cold start of the app in fresh processes:
+- The import time of the app and of each module it imports directly (from
+python -X importtime), and which optional heavy packages (e.g. openai,
+azure.cosmos) are loaded by the import.
+- The time from the start of the server process to the readiness of the
+worker (/readyz answers 200 after the startup warm-up), to the first served
+turn (the welcome message of a conversation update, sent once the worker is
+ready, as by the load balancer) and the latency of the first and the second
+message turn (sent after a think time of the participant), against the local
+fake of the OpenAI api and the fake connector (with the memory storage).
+Prints the medians over the runs as json. Run from the repository root:
+
+    python -m benchmarks.startup_benchmark --runs 5
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Optional packages which the import of the app should not load unless they
+# are configured
+OPTIONAL_MODULES = ("openai", "httpx", "azure.cosmos", "botbuilder.azure", "numpy")
+
+FIRST_MESSAGE = "Ich habe ein Problem mit meiner Bestellung."
+SECOND_MESSAGE = "Ein Teil ist nicht angekommen."
+
+
+def measure_imports() -> tuple:
+    """
+    Imports the app in a fresh interpreter with python -X importtime.
+
+    Returns:
+        tuple: The import time of the app in seconds, the cumulative import
+        time in seconds per module imported directly by the app and the
+        optional modules that were loaded.
+    """
+
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=ROOT_PATH,
+                               capture_output=True, text=True, check=True)
+
+    # Lines of the form "import time: <self us> | <cumulative us> | <indented name>",
+    # where the imports of a module are listed before the module itself
+    entries = []
+    for line in completed.stderr.splitlines():
+        parts = line.split("|")
+        if not line.startswith("import time:") or len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        entries.append((len(name) - len(name.lstrip()), name.strip(), int(parts[1]) / 1e6))
+
+    app_index = max(index for index, (indent, name, _) in enumerate(entries) if indent == 1 and name == "app")
+    module_seconds = {}
+    for indent, name, cumulative_seconds in reversed(entries[:app_index]):
+        if indent == 1:
+            break
+        if indent == 3:
+            module_seconds[name] = cumulative_seconds
+    loaded_modules = {name for _, name, _ in entries}
+    optional_modules = [name for name in OPTIONAL_MODULES if name in loaded_modules]
+    return entries[app_index][2], module_seconds, optional_modules
+
+
+def run_server(port: int, openai_port: int, conn):
+    """
+    Imports and runs the aiohttp app with the memory storage in a separate
+    process and reports the import time of the app.
+
+    Args:
+        port (int): The port to listen on.
+        openai_port (int): The port of the fake OpenAI api.
+        conn: The pipe connection to the benchmark process.
+    """
+
+    # Let the openai client of the bot use the fake api
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{openai_port}/v1"
+    os.environ["OPENAI_API_KEY"] = "fake-key"
+
+    start = time.perf_counter()
+    import app as app_module
+    import_seconds = time.perf_counter() - start
+    from botbuilder.core import ConversationState, MemoryStorage
+    from bot.bot import Bot
+
+    # Only log warnings and errors of the turns
+    logging.getLogger().setLevel(logging.WARNING)
+
+    storage = MemoryStorage()
+    app_module.bot = Bot(ConversationState(storage), app_module.treatment_fallback,
+                         app_module.admission_control, app_module.data_bundle)
+    app_module.storage = storage
+    if app_module.turn_queue is not None:
+        app_module.turn_queue.logic = app_module.bot.on_turn
+
+    async def serve():
+        runner = web.AppRunner(app_module.app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        conn.send({"server_import_seconds": import_seconds})
+        await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+        await runner.cleanup()
+
+    asyncio.run(serve())
+
+
+def build_activity(activity_type: str, message_index: int, connector_port: int, text: str = None) -> dict:
+    """
+    Builds an activity of the benchmark conversation as sent by the channel.
+
+    Args:
+        activity_type (str): "conversationUpdate" or "message".
+        message_index (int): The index of the message within the conversation.
+        connector_port (int): The port of the fake connector.
+        text (str): The text of a message.
+
+    Returns:
+        dict: The activity in json format.
+    """
+
+    activity = {
+        "type": activity_type,
+        "id": f"startup-{message_index}",
+        "channelId": "test",
+        "serviceUrl": f"http://127.0.0.1:{connector_port}",
+        "from": {"id": "user-startup", "name": "User"},
+        "conversation": {"id": "conversation-startup"},
+        "recipient": {"id": "bot", "name": "Bot"},
+        "locale": "de-DE",
+    }
+    if activity_type == "conversationUpdate":
+        activity["membersAdded"] = [{"id": "user-startup"}]
+    else:
+        activity["text"] = text
+    return activity
+
+
+async def measure_first_turns(args) -> dict:
+    """
+    Starts the server process and measures the time to the first served turn
+    and the latency of the first message turns.
+
+    Args:
+        args: The command line arguments.
+
+    Returns:
+        dict: The durations in seconds and the import time of the server
+        process.
+    """
+
+    from tools.fake_connector import FakeConnector
+    from tools.fake_openai import FakeOpenAI
+
+    replies = asyncio.Queue()
+    fake_openai = FakeOpenAI(latency=args.llm_latency)
+    fake_connector = FakeConnector(on_activity=lambda conversation_id, activity, arrival_time: replies.put_nowait(activity))
+    await fake_openai.start(port=args.openai_port)
+    await fake_connector.start(port=args.connector_port)
+
+    context = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = context.Pipe()
+    server = context.Process(target=run_server, args=(args.port, args.openai_port, child_conn))
+    url = f"http://127.0.0.1:{args.port}/api/messages"
+    readiness_url = f"http://127.0.0.1:{args.port}/readyz"
+
+    async def wait_for_reply():
+        while True:
+            reply = await asyncio.wait_for(replies.get(), args.timeout)
+            if reply.get("type") == "message" and "dialogueState" in (reply.get("channelData") or {}):
+                return
+
+    async def send_turn(session: aiohttp.ClientSession, activity: dict) -> float:
+        start = time.perf_counter()
+        async with session.post(url, json=activity) as response:
+            await response.read()
+            if response.status >= 300:
+                raise RuntimeError(f"Unexpected status {response.status}")
+        await wait_for_reply()
+        return time.perf_counter() - start
+
+    try:
+        start = time.perf_counter()
+        server.start()
+        async with aiohttp.ClientSession() as session:
+            # Poll the readiness probe until the worker is warmed up
+            while True:
+                try:
+                    async with session.get(readiness_url) as response:
+                        await response.read()
+                        if response.status == 200:
+                            break
+                except aiohttp.ClientConnectionError:
+                    pass
+                if time.perf_counter() - start > args.timeout:
+                    raise RuntimeError("The server did not become ready")
+                await asyncio.sleep(0.005)
+            ready_seconds = time.perf_counter() - start
+            await send_turn(session, build_activity("conversationUpdate", 0, args.connector_port))
+            first_turn_seconds = time.perf_counter() - start
+            await asyncio.sleep(args.think_time)
+            first_message_seconds = await send_turn(
+                session, build_activity("message", 1, args.connector_port, FIRST_MESSAGE))
+            second_message_seconds = await send_turn(
+                session, build_activity("message", 2, args.connector_port, SECOND_MESSAGE))
+        server_results = await asyncio.get_running_loop().run_in_executor(None, parent_conn.recv)
+        parent_conn.send("stop")
+        await asyncio.get_running_loop().run_in_executor(None, server.join)
+    finally:
+        if server.is_alive():
+            server.terminate()
+        await fake_connector.stop()
+        await fake_openai.stop()
+
+    return {
+        **server_results,
+        "time_to_ready_seconds": ready_seconds,
+        "time_to_first_turn_seconds": first_turn_seconds,
+        "first_message_turn_seconds": first_message_seconds,
+        "second_message_turn_seconds": second_message_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Number of modules in the import report")
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--think-time", type=float, default=1.0,
+                        help="Seconds between the welcome message and the first message of the participant")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--port", type=int, default=3994)
+    parser.add_argument("--openai-port", type=int, default=3986)
+    parser.add_argument("--connector-port", type=int, default=3982)
+    args = parser.parse_args()
+
+    import_seconds = []
+    module_seconds = {}
+    optional_modules = []
+    turn_results = []
+    for _ in range(args.runs):
+        run_import_seconds, run_module_seconds, optional_modules = measure_imports()
+        import_seconds.append(run_import_seconds)
+        for name, seconds in run_module_seconds.items():
+            module_seconds.setdefault(name, []).append(seconds)
+        turn_results.append(asyncio.run(measure_first_turns(args)))
+
+    def median_ms(values: list) -> float:
+        return round(1000 * statistics.median(values), 3)
+
+    modules_ms = sorted(((name, median_ms(values)) for name, values in module_seconds.items()),
+                        key=lambda item: item[1], reverse=True)
+    print(json.dumps({
+        "runs": args.runs,
+        "import_app_ms": median_ms(import_seconds),
+        "import_modules_ms": dict(modules_ms[:args.top]),
+        "loaded_optional_modules": optional_modules,
+        **{
+            key.replace("_seconds", "_ms"): median_ms([result[key] for result in turn_results])
+            for key in turn_results[0]
+        },
+    }))
+
+
+if __name__ == "__main__":
+    main()
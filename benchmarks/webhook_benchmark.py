@@ -0,0 +1,173 @@
+"""
+Benchmark of the /api/messages webhook with the bot pipeline stubbed out.
+
+Measures the requests per second and the cpu time per request of the server
+process for the standard library path (asyncio + json) and the fast path
+(uvloop + orjson). Run from the repository root:
+
+    python -m benchmarks.webhook_benchmark --requests 5000 --concurrency 32
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import time
+
+import aiohttp
+from aiohttp import web
+
+
+def build_activity(index: int) -> dict:
+    """
+    Builds a message activity as sent by the channel.
+
+    Args:
+        index (int): The index of the request.
+
+    Returns:
+        dict: The activity in json format.
+    """
+
+    return {
+        "type": "message",
+        "id": f"activity-{index}",
+        "timestamp": "2025-01-01T12:00:00.000Z",
+        "channelId": "webchat",
+        "serviceUrl": "http://127.0.0.1:1",
+        "from": {"id": f"user-{index % 100}", "name": "User"},
+        "conversation": {"id": f"conversation-{index % 100}"},
+        "recipient": {"id": "bot", "name": "Bot"},
+        "text": "Ich habe eine Bestellung bei euch gemacht, aber der Pullover ist nicht angekommen.",
+        "locale": "de-DE",
+        "channelData": {"treatmentGroup": index % 2},
+    }
+
+
+def run_server(port: int, use_fast_path: bool, conn):
+    """
+    Runs the aiohttp app with a stubbed bot pipeline in a separate process and
+    reports the cpu time consumed while serving the benchmark requests.
+
+    Args:
+        port (int): The port to listen on.
+        use_fast_path (bool): Whether to use uvloop and orjson.
+        conn: The pipe connection to the benchmark process.
+    """
+
+    import app as app_module
+    from server import fast_path
+
+    event_loop_name = fast_path.install_event_loop(use_fast_path)
+    json_codec_name = fast_path.install_json_codec(use_fast_path)
+
+    # Stub out the bot pipeline and the optional subsystems
+    async def on_turn_stub(turn_context):
+        return None
+
+    app_module.bot.on_turn = on_turn_stub
+    app_module.turn_queue = None
+    app_module.admission_control = None
+
+    async def serve():
+        runner = web.AppRunner(app_module.app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        conn.send((event_loop_name, json_codec_name))
+        cpu_start = time.process_time()
+        await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+        conn.send(time.process_time() - cpu_start)
+        await runner.cleanup()
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(serve())
+
+
+async def send_requests(url: str, request_count: int, concurrency: int) -> list:
+    """
+    Sends the benchmark requests with a fixed number of concurrent clients.
+
+    Args:
+        url (str): The url of the webhook.
+        request_count (int): The number of requests to send.
+        concurrency (int): The number of concurrent clients.
+
+    Returns:
+        list: The latencies of the requests in seconds.
+    """
+
+    latencies = []
+    counter = iter(range(request_count))
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+
+        async def client():
+            for index in counter:
+                start = time.perf_counter()
+                async with session.post(url, json=build_activity(index)) as response:
+                    await response.read()
+                    if response.status >= 300:
+                        raise RuntimeError(f"Unexpected status {response.status}")
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies
+
+
+def run_benchmark(use_fast_path: bool, request_count: int, concurrency: int, port: int) -> dict:
+    """
+    Runs the benchmark for one configuration.
+
+    Args:
+        use_fast_path (bool): Whether to use uvloop and orjson.
+        request_count (int): The number of requests to send.
+        concurrency (int): The number of concurrent clients.
+        port (int): The port of the server.
+
+    Returns:
+        dict: The benchmark results.
+    """
+
+    context = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = context.Pipe()
+    server = context.Process(target=run_server, args=(port, use_fast_path, child_conn))
+    server.start()
+    event_loop_name, json_codec_name = parent_conn.recv()
+
+    url = f"http://127.0.0.1:{port}/api/messages"
+    asyncio.run(send_requests(url, min(100, request_count), concurrency))  # warm-up
+    start = time.perf_counter()
+    latencies = asyncio.run(send_requests(url, request_count, concurrency))
+    duration = time.perf_counter() - start
+
+    parent_conn.send("stop")
+    server_cpu_time = parent_conn.recv()
+    server.join()
+
+    latencies.sort()
+    return {
+        "event_loop": event_loop_name,
+        "json_codec": json_codec_name,
+        "requests": request_count,
+        "concurrency": concurrency,
+        "requests_per_second": round(request_count / duration, 1),
+        "cpu_time_per_request_ms": round(1000 * server_cpu_time / (request_count + min(100, request_count)), 4),
+        "latency_p50_ms": round(1000 * latencies[len(latencies) // 2], 3),
+        "latency_p99_ms": round(1000 * latencies[int(len(latencies) * 0.99)], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--port", type=int, default=3990)
+    args = parser.parse_args()
+
+    for use_fast_path in (False, True):
+        result = run_benchmark(use_fast_path, args.requests, args.concurrency, args.port)
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
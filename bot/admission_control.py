@@ -0,0 +1,177 @@
+import itertools
+import time
+
+
+class AdmissionControl:
+    """
+    Class that tracks the load of the bot and decides whether turns should be 
+    processed in a degraded mode.
+    """
+
+    def __init__(
+        self,
+        max_in_flight_turns: int = 32,
+        max_queue_wait: float = 5.0,
+        new_conversation_max_in_flight_turns: int = 24,
+        new_conversation_max_queue_wait: float = 2.0,
+        smoothing_factor: float = 0.2,
+        queue_wait_half_life: float = 5.0
+    ):
+        """
+        Constructor of the AdmissionControl class.
+        - Initializes the thresholds above which the bot is considered to be 
+        overloaded. The thresholds for new conversations are lower than the 
+        thresholds for ongoing conversations, so that ongoing conversations 
+        take priority over new ones.
+        - Initializes the counter of the turns in flight, the queued turns 
+        and the smoothed queue wait time. A turn is in flight from the moment 
+        it has been queued (or has started processing without a queue) until 
+        it has finished.
+
+        Args:
+            max_in_flight_turns (int): The number of turns in flight above 
+            which ongoing conversations use the fallbacks.
+            max_queue_wait (float): The smoothed queue wait time in seconds 
+            above which ongoing conversations use the fallbacks.
+            new_conversation_max_in_flight_turns (int): The number of turns in 
+            flight above which new conversations get the wait message.
+            new_conversation_max_queue_wait (float): The smoothed queue wait 
+            time in seconds above which new conversations get the wait message.
+            smoothing_factor (float): The weight of a new queue wait 
+            measurement in the exponential moving average. 
+            queue_wait_half_life (float): The time in seconds after which 
+            the smoothed queue wait time has decayed to half without new 
+            measurements (so that turns are not degraded after a burst while 
+            the queue is idle). Must be greater than 0.
+        """
+
+        if queue_wait_half_life <= 0:
+            raise ValueError(f"queue_wait_half_life must be greater than 0, got {queue_wait_half_life}")
+
+        self.max_in_flight_turns = max_in_flight_turns
+        self.max_queue_wait = max_queue_wait
+        self.new_conversation_max_in_flight_turns = new_conversation_max_in_flight_turns
+        self.new_conversation_max_queue_wait = new_conversation_max_queue_wait
+        self.smoothing_factor = smoothing_factor
+        self.queue_wait_half_life = queue_wait_half_life
+
+        self.in_flight_turns = 0
+        self.queue_wait = 0.0
+        self.queue_wait_updated_at = time.monotonic()
+
+        # Enqueue times of the queued turns by key (in the order of enqueueing, 
+        # so that the first entry is the oldest queued turn)
+        self.queued_turns = {}
+        self._queue_keys = itertools.count()
+
+    @property
+    def pending_turns(self) -> int:
+        """
+        Returns the number of turns which are queued or processing.
+
+        Returns:
+            int: The number of pending turns.
+        """
+
+        return len(self.queued_turns) + self.in_flight_turns
+
+    def turn_queued(self) -> int:
+        """
+        Registers a turn which has been added to the turn queue.
+
+        Returns:
+            int: The key of the queued turn (see turn_dequeued).
+        """
+
+        key = next(self._queue_keys)
+        self.queued_turns[key] = time.monotonic()
+        return key
+
+    def turn_dequeued(self, key: int):
+        """
+        Registers a turn which has been taken from the turn queue and records 
+        its queue wait time. The turn must then be registered with 
+        turn_started.
+
+        Args:
+            key (int): The key of the queued turn.
+        """
+
+        enqueued_at = self.queued_turns.pop(key, None)
+        if enqueued_at is not None:
+            self.record_queue_wait(time.monotonic() - enqueued_at)
+
+    def turn_started(self):
+        """
+        Registers a turn which has started processing.
+        """
+
+        self.in_flight_turns += 1
+
+    def turn_finished(self):
+        """
+        Registers a turn which has finished processing.
+        """
+
+        self.in_flight_turns = max(0, self.in_flight_turns - 1)
+
+    def record_queue_wait(self, queue_wait: float):
+        """
+        Updates the exponential moving average of the queue wait time.
+
+        Args:
+            queue_wait (float): The time in seconds a turn has waited before 
+            it was processed.
+        """
+
+        self.queue_wait = self.get_queue_wait(include_queued=False)
+        self.queue_wait += self.smoothing_factor * (queue_wait - self.queue_wait)
+        self.queue_wait_updated_at = time.monotonic()
+
+    def get_queue_wait(self, include_queued: bool = True) -> float:
+        """
+        Returns the current estimate of the queue wait time.
+        - The smoothed queue wait time decays with the time since the last 
+        measurement.
+        - The wait time of the oldest queued turn is a lower bound, so that a 
+        queue whose turns are not taken (e.g. all workers wait on the gpt api) 
+        is detected before the turns are dequeued.
+
+        Args:
+            include_queued (bool): Whether to include the wait time of the 
+            oldest queued turn.
+
+        Returns:
+            float: The queue wait time in seconds.
+        """
+
+        now = time.monotonic()
+        queue_wait = self.queue_wait * 0.5 ** ((now - self.queue_wait_updated_at) / self.queue_wait_half_life)
+        if include_queued and self.queued_turns:
+            queue_wait = max(queue_wait, now - next(iter(self.queued_turns.values())))
+        return queue_wait
+
+    def should_degrade_turn(self) -> bool:
+        """
+        Checks whether a turn of an ongoing conversation should be processed 
+        with the pattern matching and canned response fallbacks instead of the 
+        gpt api.
+
+        Returns:
+            bool: True if the bot is overloaded for ongoing conversations.
+        """
+
+        return (self.pending_turns > self.max_in_flight_turns 
+                or self.get_queue_wait() > self.max_queue_wait)
+
+    def should_delay_new_conversation(self) -> bool:
+        """
+        Checks whether a new conversation should receive the wait message 
+        instead of the standard welcome message.
+
+        Returns:
+            bool: True if the bot is overloaded for new conversations.
+        """
+
+        return (self.pending_turns > self.new_conversation_max_in_flight_turns 
+                or self.get_queue_wait() > self.new_conversation_max_queue_wait)
@@ -1,22 +1,34 @@
+import asyncio
+import logging
+
 from botbuilder.core import ActivityHandler, TurnContext, ConversationState
 from botbuilder.schema import ChannelAccount, Activity, ActivityTypes
 
+from bot import instrumentation, tracing
+from bot.admission_control import AdmissionControl
+from bot.data_bundle import DataBundle
 from bot.dialogue_start import DialogueStart
 from bot.message_processing import MessageProcessing
 
 
+logger = logging.getLogger(__name__)
+
+
 class Bot(ActivityHandler):
     """
     Class that represents the chatbot.
     """
 
-    def __init__(self, conversation_state: ConversationState, treatment_fallback: int):
+    def __init__(self, conversation_state: ConversationState, treatment_fallback: int, admission_control: AdmissionControl = None,
+                 data_bundle: DataBundle = None):
         """
         Constructor of the Bot class. 
         - Specifies the conversation state variables of a bot instance: 
             - welcome_state_accessor: Specifies whether a bot instance is in the welcome state.
             - treatment_state_accessor: Specifies whether a bot instance should be treated as treatment or control group.
             - conversation_history_accessor: The conversation history. 
+            - conversation_history_tokens_accessor: The cached token counts of the messages of the 
+            conversation history. 
             - dialogue_state_history_accessor: The dialogue state history. 
             - slot_filling_accessor: The slot filling information. 
         - Initializes an instance of the StartDialogue class to initially start the dialogue.
@@ -25,20 +37,37 @@ class Bot(ActivityHandler):
         Args: 
             conversation_state (ConversationState): The stored conversation state.
             treatment_fallback (int): Fallback value if no treatmentGroup provided in channel_data.
+            admission_control (AdmissionControl): Optional admission control to degrade turns when 
+            the bot is overloaded.
+            data_bundle (DataBundle): Optional precompiled data files of the bot, which replace the 
+            reads of the data files.
         """
 
         self.conversation_state = conversation_state
         self.treatment_fallback = treatment_fallback
+        self.admission_control = admission_control
 
         # Specify conversation state variables
         self.welcome_state_accessor = self.conversation_state.create_property("WelcomeState")
         self.treatment_state_accessor = self.conversation_state.create_property("TreatmentGroup")
         self.conversation_history_accessor = self.conversation_state.create_property("ConversationHistory")
+        self.conversation_history_tokens_accessor = self.conversation_state.create_property("ConversationHistoryTokens")
         self.dialogue_state_history_accessor = self.conversation_state.create_property("DialogueStateHistory")
         self.slot_filling_accessor = self.conversation_state.create_property("SlotFilling")
 
-        self.dialogue_start = DialogueStart()
-        self.message_processing = MessageProcessing()
+        self.dialogue_start = DialogueStart(data_bundle)
+        self.message_processing = MessageProcessing(data_bundle)
+
+    async def on_turn(self, turn_context: TurnContext):
+        """
+        Handles an incoming activity. Records the turn as span if it is traced.
+
+        Args: 
+            turn_context (TurnContext): The information about the current activity.
+        """
+
+        with tracing.span("on_turn", activity_type=turn_context.activity.type):
+            await super().on_turn(turn_context)
 
     async def set_treatment_state(self, turn_context: TurnContext) -> int:
         """
@@ -104,6 +133,25 @@ class Bot(ActivityHandler):
         
         return conversation_history
     
+    async def get_conversation_history_tokens(self, turn_context: TurnContext) -> list:
+        """
+        Retrieves the cached token counts of the messages of the conversation history from the 
+        conversation state.
+        - If there are no token counts stored, returns an empty list.
+        
+        Args: 
+            turn_context (TurnContext): The information about the current activity.
+
+        Returns: 
+            list: The token counts (None for messages which were not counted yet).
+        """
+
+        conversation_history_tokens = await self.conversation_history_tokens_accessor.get(turn_context)
+        if conversation_history_tokens is None:
+            conversation_history_tokens = []
+
+        return conversation_history_tokens
+
     async def get_dialogue_state_history(self, turn_context: TurnContext) -> list:
         """
         Retrieves the dialogue state history from the conversation state.
@@ -147,7 +195,7 @@ class Bot(ActivityHandler):
         message was already sent. 
         - Determines the treatment group value for the conversation and stores it in the conversation state. 
         - If the welcome message has not been sent to the user: Switches the welcome_sent variable, sends 
-        the welcome message, initializes the conversation history and dialogue state history and updates the 
+        the welcome message (or the wait message if the bot is overloaded), initializes the conversation history and dialogue state history and updates the 
         conversation state. 
 
         Args: 
@@ -171,7 +219,8 @@ class Bot(ActivityHandler):
                 dialogue_state_history = await self.get_dialogue_state_history(turn_context)
                 
                 # Retrieve welcome text and initial state
-                welcome_text, initial_dialogue_state = self.dialogue_start.start_dialogue()
+                overloaded = self.admission_control is not None and self.admission_control.should_delay_new_conversation()
+                welcome_text, initial_dialogue_state = self.dialogue_start.start_dialogue(overloaded)
 
                 # Update the conversation state variables
                 conversation_history.append(("bot", welcome_text))
@@ -197,8 +246,11 @@ class Bot(ActivityHandler):
         sends a message to the chatbot. 
         - Retrieves the conversation state variables of the conversation.
         - Receives the user message.
+        - Checks whether the turn should use the fallbacks because the bot is 
+        overloaded.
         - Executes the process_message function from the MessageProcessing 
-        class to determine the bot response, the new dialogue state, the 
+        class in a worker thread (so that the gpt api calls do not block the 
+        event loop) to determine the bot response, the new dialogue state, the 
         final_state flag and the new slot filling dictionary, given the user 
         message, the treatment group value, the conversation history, the 
         dialogue state history and the current slot filling dictionary. 
@@ -211,22 +263,32 @@ class Bot(ActivityHandler):
         """
 
         # Retrieve conversation state variables
-        treatment_group = await self.get_treatment_state(turn_context)
-        conversation_history = await self.get_conversation_history(turn_context)
-        dialogue_state_history = await self.get_dialogue_state_history(turn_context)
-        slot_filling = await self.get_slot_filling(turn_context)
+        with instrumentation.stage("state_load"):
+            treatment_group = await self.get_treatment_state(turn_context)
+            conversation_history = await self.get_conversation_history(turn_context)
+            conversation_history_tokens = await self.get_conversation_history_tokens(turn_context)
+            dialogue_state_history = await self.get_dialogue_state_history(turn_context)
+            slot_filling = await self.get_slot_filling(turn_context)
 
         # Extract the user message
         user_text = turn_context.activity.text
 
+        # Check whether the bot is overloaded
+        use_fallbacks = self.admission_control is not None and self.admission_control.should_degrade_turn()
+
         # Process the user message
-        bot_response, new_dialogue_state, final_state, new_slot_filling = self.message_processing.process_message(
-            user_text,
-            treatment_group,
-            conversation_history,
-            dialogue_state_history,
-            slot_filling
-        )
+        with tracing.span("process_message", use_fallbacks=use_fallbacks):
+            bot_response, new_dialogue_state, final_state, new_slot_filling = await asyncio.to_thread(
+                self.message_processing.process_message,
+                user_text,
+                treatment_group,
+                conversation_history,
+                dialogue_state_history,
+                slot_filling,
+                use_fallbacks,
+                conversation_history_tokens
+            )
+        tracing.set_attributes(new_dialogue_state=new_dialogue_state, final_state=final_state)
 
         # Update the conversation state variables
         conversation_history.append(("user", user_text))
@@ -241,11 +303,20 @@ class Bot(ActivityHandler):
             text=bot_response,
             channel_data={"finalState": final_state, "dialogueState": new_dialogue_state}
         )
-        await turn_context.send_activity(activity)
-        print(f"User message: {user_text}\nChatbot response: {bot_response}\nNew State: {new_dialogue_state}\n\n\n")
+        with instrumentation.stage("send"):
+            await turn_context.send_activity(activity)
+        logger.info("Turn processed", extra={"fields": {
+            "conversation_id": turn_context.activity.conversation.id,
+            "user_text": user_text,
+            "bot_response": bot_response,
+            "new_dialogue_state": new_dialogue_state,
+            "final_state": final_state,
+        }})
 
         # Store updated conversation state variables
-        await self.conversation_history_accessor.set(turn_context, conversation_history)
-        await self.dialogue_state_history_accessor.set(turn_context, dialogue_state_history)
-        await self.slot_filling_accessor.set(turn_context, slot_filling)
-        await self.conversation_state.save_changes(turn_context)       
+        with instrumentation.stage("state_save"):
+            await self.conversation_history_accessor.set(turn_context, conversation_history)
+            await self.conversation_history_tokens_accessor.set(turn_context, conversation_history_tokens)
+            await self.dialogue_state_history_accessor.set(turn_context, dialogue_state_history)
+            await self.slot_filling_accessor.set(turn_context, slot_filling)
+            await self.conversation_state.save_changes(turn_context)       
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+
+
+# Version of the bundle format (a bundle of another version is not loaded)
+DATA_BUNDLE_VERSION = 1
+
+# Directory of the data files of the bot and default path of the bundle
+DATA_PATH = os.path.join(os.path.dirname(__file__), "data")
+DATA_BUNDLE_DIRECTORY_NAME = "data_bundle"
+DEFAULT_DATA_BUNDLE_PATH = os.path.join(DATA_PATH, DATA_BUNDLE_DIRECTORY_NAME, "data_bundle.json")
+
+# Extensions of the bundled data files (json files are stored parsed, the
+# other files as text)
+DATA_FILE_EXTENSIONS = (".json", ".txt")
+
+
+class DataBundle:
+    """
+    Class that holds all data files of the bot (states, slot template, rg
+    mapping, model routing, prompt templates and canned responses) in one
+    precompiled json file, so that the start of the bot reads and parses one
+    file instead of every file of the data directory (see
+    tools.build_data_bundle).
+    - The files are keyed by their path relative to the data directory (with
+    "/" as separator).
+    - The bundle is a build artifact of the deployment. The digest of the
+    source files lets the build tool and the bot check whether a bundle is up
+    to date (reading the files without parsing them), so that a stale bundle
+    does not hide changes of the data files.
+    - The parsed json files are shared by all users of the bundle and must not
+    be changed.
+    """
+
+    def __init__(self, files: dict, source_digest: str = None):
+        """
+        Constructor of the DataBundle class.
+
+        Args:
+            files (dict): The content per relative file path (parsed json or
+            text).
+            source_digest (str): The digest of the source files.
+        """
+
+        self.files = files
+        self.source_digest = source_digest
+
+    @classmethod
+    def build(cls, data_path: str = DATA_PATH) -> "DataBundle":
+        """
+        Builds a data bundle from the files of the data directory (without
+        the directory of the bundle itself).
+
+        Args:
+            data_path (str): The data directory.
+
+        Returns:
+            DataBundle: The data bundle.
+        """
+
+        files = {}
+        digest = hashlib.sha256()
+        for relative_path, file_path in _list_data_files(data_path):
+            with open(file_path, "rb") as f:
+                content = f.read()
+            digest.update(relative_path.encode("utf-8") + b"\0" + content + b"\0")
+            text = content.decode("utf-8")
+            files[relative_path] = json.loads(text) if relative_path.endswith(".json") else text
+        return cls(files, digest.hexdigest())
+
+    @classmethod
+    def load(cls, file_path: str = DEFAULT_DATA_BUNDLE_PATH) -> "DataBundle":
+        """
+        Loads a data bundle.
+
+        Args:
+            file_path (str): The path of the bundle.
+
+        Returns:
+            DataBundle: The data bundle.
+        """
+
+        with open(file_path, "r", encoding="utf-8") as f:
+            bundle = json.load(f)["data_bundle"]
+        if bundle.get("version") != DATA_BUNDLE_VERSION:
+            raise ValueError(f"Data bundle {file_path} has version {bundle.get('version')}, "
+                             f"expected {DATA_BUNDLE_VERSION}")
+        return cls(bundle["files"], bundle.get("source_digest"))
+
+    def save(self, file_path: str = DEFAULT_DATA_BUNDLE_PATH):
+        """
+        Saves the data bundle.
+
+        Args:
+            file_path (str): The path of the bundle.
+        """
+
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        with open(file_path, "w", encoding="utf-8") as f:
+            json.dump({"data_bundle": {
+                "version": DATA_BUNDLE_VERSION,
+                "source_digest": self.source_digest,
+                "files": self.files,
+            }}, f, ensure_ascii=False, separators=(",", ":"))
+
+    def is_up_to_date(self, data_path: str = DATA_PATH) -> bool:
+        """
+        Checks whether the bundle was built from the current data files.
+
+        Args:
+            data_path (str): The data directory.
+
+        Returns:
+            bool: True if the digest of the data files equals the digest of
+            the bundle.
+        """
+
+        return self.source_digest is not None and self.source_digest == compute_source_digest(data_path)
+
+    def get(self, path_suffix_parts: list):
+        """
+        Returns the content of a data file.
+
+        Args:
+            path_suffix_parts (list): The path of the file below the bot
+            directory, where the parts are provided as strings in a list
+            (e.g. ["data", "states", "states.json"]).
+
+        Returns:
+            The parsed json file or the text of the file, or None if the file
+            is not in the bundle.
+        """
+
+        if not path_suffix_parts or path_suffix_parts[0] != "data":
+            return None
+        return self.files.get("/".join(path_suffix_parts[1:]))
+
+    def get_prompt_templates(self, root_path: str) -> dict:
+        """
+        Returns the text files of the bundle for the prompt template cache of
+        the slot filling and the response generation.
+
+        Args:
+            root_path (str): The bot directory.
+
+        Returns:
+            dict: The text per file path (as built by load_prompt_template).
+        """
+
+        return {
+            os.path.join(root_path, "data", *relative_path.split("/")): content
+            for relative_path, content in self.files.items()
+            if isinstance(content, str) and not relative_path.endswith(".json")
+        }
+
+
+def compute_source_digest(data_path: str = DATA_PATH) -> str:
+    """
+    Computes the digest of the data files as stored in a bundle built from
+    them.
+
+    Args:
+        data_path (str): The data directory.
+
+    Returns:
+        str: The digest of the data files.
+    """
+
+    digest = hashlib.sha256()
+    for relative_path, file_path in _list_data_files(data_path):
+        with open(file_path, "rb") as f:
+            digest.update(relative_path.encode("utf-8") + b"\0" + f.read() + b"\0")
+    return digest.hexdigest()
+
+
+def _list_data_files(data_path: str) -> list:
+    """
+    Lists the data files to bundle in a stable order.
+
+    Args:
+        data_path (str): The data directory.
+
+    Returns:
+        list: The relative path (with "/" as separator) and the file path of
+        each data file.
+    """
+
+    data_files = []
+    for directory_path, directory_names, file_names in os.walk(data_path):
+        directory_names[:] = sorted(name for name in directory_names if name != DATA_BUNDLE_DIRECTORY_NAME)
+        for file_name in sorted(file_names):
+            if not file_name.endswith(DATA_FILE_EXTENSIONS):
+                continue
+            file_path = os.path.join(directory_path, file_name)
+            relative_path = os.path.relpath(file_path, data_path).replace(os.sep, "/")
+            data_files.append((relative_path, file_path))
+    return data_files
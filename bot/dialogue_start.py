@@ -1,21 +1,31 @@
 import os
 import json
 
+from bot.data_bundle import DataBundle
+
 class DialogueStart:
     """
     Class that manages the welcome message and the state initialization.
     """
 
-    def __init__(self):
+    def __init__(self, data_bundle: DataBundle = None):
         """
         Constructor of the DialogueStart class.
         - Loads the initial_state.json file.
         - Loads the welcome_message.txt file.
+        - Loads the wait_message.txt file.
+        - Takes the files from the data bundle if provided.
+
+        Args:
+            data_bundle (DataBundle): The precompiled data files of the bot 
+            (see bot.data_bundle), or None to read the data files.
         """
 
         root_path = os.path.join(os.path.dirname(__file__))
+        self.data_bundle = data_bundle
         self.initial_state = self.load_initial_state(root_path)
         self.welcome_message = self.load_welcome_message(root_path)
+        self.wait_message = self.load_wait_message(root_path)
     
     def load_initial_state(self, root_path: str) -> str:
         """
@@ -28,9 +38,11 @@ class DialogueStart:
             str: The initial state, read in from the initial_state.json file. 
         """
 
-        file_path = os.path.join(root_path, "data", "dialogue_start", "initial_state.json")
-        with open(file_path, "r", encoding="utf-8") as f:
-            initial_state_data = json.load(f)
+        initial_state_data = self._get_bundled_file(["data", "dialogue_start", "initial_state.json"])
+        if initial_state_data is None:
+            file_path = os.path.join(root_path, "data", "dialogue_start", "initial_state.json")
+            with open(file_path, "r", encoding="utf-8") as f:
+                initial_state_data = json.load(f)
         initial_dialogue_state = str(initial_state_data.get("initial_dialogue_state", "0"))
         return initial_dialogue_state
 
@@ -45,18 +57,63 @@ class DialogueStart:
             str: The bot's welcome message, read from the welcome_message.txt file. 
         """
 
-        file_path = os.path.join(root_path, "data", "dialogue_start", "welcome_message.txt")
-        with open(file_path, "r", encoding="utf-8") as f:
-            welcome_message = f.read()
+        welcome_message = self._get_bundled_file(["data", "dialogue_start", "welcome_message.txt"])
+        if welcome_message is None:
+            file_path = os.path.join(root_path, "data", "dialogue_start", "welcome_message.txt")
+            with open(file_path, "r", encoding="utf-8") as f:
+                welcome_message = f.read()
         return welcome_message
     
-    def start_dialogue(self) -> tuple[str, str]:
+    def load_wait_message(self, root_path: str) -> str:
+        """
+        Loads the wait_message.txt file and extracts the bot's welcome message 
+        for the case that the bot is overloaded.
+
+        Args: 
+            root_path (str): The path of this file. 
+        
+        Returns:
+            str: The bot's wait message, read from the wait_message.txt file. 
+        """
+
+        wait_message = self._get_bundled_file(["data", "dialogue_start", "wait_message.txt"])
+        if wait_message is None:
+            file_path = os.path.join(root_path, "data", "dialogue_start", "wait_message.txt")
+            with open(file_path, "r", encoding="utf-8") as f:
+                wait_message = f.read()
+        return wait_message
+
+    def _get_bundled_file(self, path_suffix_parts: list):
+        """
+        Returns the content of a data file from the data bundle.
+
+        Args:
+            path_suffix_parts (list): The file path below this directory, 
+            where the parts are provided as strings in a list.
+
+        Returns:
+            The content of the file, or None without a data bundle or if the 
+            bundle does not contain the file.
+        """
+
+        if self.data_bundle is None:
+            return None
+        return self.data_bundle.get(path_suffix_parts)
+    
+    def start_dialogue(self, overloaded: bool = False) -> tuple[str, str]:
         """
         Returns the bot's welcome message and the initial dialogue state.
+        - If the bot is overloaded, returns the wait message instead of the 
+        welcome message.
+
+        Args:
+            overloaded (bool): Flag whether the bot is currently overloaded.
         
         Returns: 
             tuple[str, str]: A tuple containing the bot's welcome message and the initial dialogue state.
         """
 
+        if overloaded:
+            return self.wait_message, self.initial_state
         return self.welcome_message, self.initial_state
         
\ No newline at end of file
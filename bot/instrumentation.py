@@ -0,0 +1,238 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+from bot import tracing
+from bot.metrics import (LLM_CALL_DURATION, LLM_COMPLETION_TOKENS, LLM_ROUTE_CALL_DURATION, LLM_ROUTE_COST,
+                         LLM_TOKENS, LLM_TRUNCATIONS, STAGE_DURATION)
+
+
+# Labels of the current turn (dialogue state, rg_action, treatment group),
+# which are attached to the token usage of the gpt api calls
+_turn_labels = contextvars.ContextVar("turn_labels", default=None)
+
+# Recorder of the current turn (e.g. of the batch transcript processor), which
+# collects the stage durations and the gpt api calls of the turn
+_turn_recorder = contextvars.ContextVar("turn_recorder", default=None)
+
+
+class StageTimer:
+    """
+    Class that represents a running stage measurement.
+    - The variant (e.g. "llm" or "fallback") can be changed while the stage is
+    running.
+    """
+
+    def __init__(self, name: str, variant: str):
+        """
+        Constructor of the StageTimer class.
+
+        Args:
+            name (str): The name of the stage.
+            variant (str): The variant of the stage.
+        """
+
+        self.name = name
+        self.variant = variant
+        self.start = time.perf_counter()
+
+
+class TurnRecorder:
+    """
+    Class that collects the stage durations and the gpt api calls (with their
+    token usage) of a single turn.
+    """
+
+    def __init__(self):
+        """
+        Constructor of the TurnRecorder class.
+        """
+
+        self.stages = []
+        self.llm_calls = []
+
+
+@contextmanager
+def record_turn():
+    """
+    Records the stages and the gpt api calls of the turn processed within the
+    context (including the worker thread of the message processing, which
+    gets a copy of the context).
+
+    Yields:
+        TurnRecorder: The recorder of the turn.
+    """
+
+    recorder = TurnRecorder()
+    token = _turn_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _turn_recorder.reset(token)
+
+
+@contextmanager
+def stage(name: str, variant: str = ""):
+    """
+    Measures the duration of a stage of a turn (e.g. state_load, slot_filling,
+    dialogue_management, response_generation, send, state_save) and records it
+    as span if the turn is traced.
+
+    Args:
+        name (str): The name of the stage.
+        variant (str): The variant of the stage, e.g. "llm" or "fallback".
+
+    Yields:
+        StageTimer: The running measurement.
+    """
+
+    timer = StageTimer(name, variant)
+    with tracing.span(name) as stage_span:
+        try:
+            yield timer
+        finally:
+            duration = time.perf_counter() - timer.start
+            STAGE_DURATION.observe(duration, stage=timer.name, variant=timer.variant)
+            recorder = _turn_recorder.get()
+            if recorder is not None:
+                recorder.stages.append({"stage": timer.name, "variant": timer.variant, "duration": duration})
+            if stage_span is not None and timer.variant:
+                stage_span.set_attribute("variant", timer.variant)
+
+
+def set_turn_labels(**labels):
+    """
+    Sets labels of the current turn for the token usage metrics (and as
+    attributes of the current span). Existing labels are kept unless they are
+    overwritten.
+    - The labels live in a context variable, so they are bound to the current
+    turn (and are copied into the worker thread of the message processing).
+
+    Args:
+        **labels: The labels, e.g. dialogue_state, rg_action, treatment_group.
+    """
+
+    turn_labels = dict(_turn_labels.get() or {})
+    turn_labels.update(labels)
+    _turn_labels.set(turn_labels)
+    tracing.set_attributes(**labels)
+
+
+class LlmCall:
+    """
+    Class that represents a running gpt api call measurement. The completion
+    returned by the openai client is assigned to it once the call returns.
+    """
+
+    def __init__(self, component: str, model: str):
+        """
+        Constructor of the LlmCall class.
+
+        Args:
+            component (str): The calling component ("slot_filling" or
+            "response_generation").
+            model (str): The gpt model.
+        """
+
+        self.component = component
+        self.model = model
+        self.completion = None
+        self.start = time.perf_counter()
+
+
+@contextmanager
+def llm_call(component: str, model: str, route=None):
+    """
+    Measures the duration and the token usage of a gpt api call and records it
+    as span if the turn is traced.
+    - If the call has a model route, also records the duration and the cost
+    of the call per route.
+    - Counts the calls whose output was cut by the output budget.
+
+    Args:
+        component (str): The calling component ("slot_filling" or
+        "response_generation").
+        model (str): The gpt model.
+        route (ModelRoute): The model route of the call, or None.
+
+    Yields:
+        LlmCall: The running measurement.
+    """
+
+    call = LlmCall(component, model)
+    route_name = route.name if route is not None else ""
+    with tracing.span("gpt_api_call", component=component, model=model, route=route_name) as call_span:
+        try:
+            yield call
+        finally:
+            duration = time.perf_counter() - call.start
+            LLM_CALL_DURATION.observe(duration, component=component, model=model)
+            usage = getattr(call.completion, "usage", None)
+            tokens = _record_usage(component, model, usage, call_span) if usage is not None else {}
+            finish_reason = _finish_reason(call.completion)
+            if finish_reason == "length":
+                turn_labels = _turn_labels.get() or {}
+                LLM_TRUNCATIONS.inc(component=component, dialogue_state=turn_labels.get("dialogue_state", ""),
+                                    rg_action=turn_labels.get("rg_action", ""))
+            if route is not None:
+                LLM_ROUTE_CALL_DURATION.observe(duration, component=component, route=route_name, model=model)
+                LLM_ROUTE_COST.inc(route.cost(tokens), component=component, route=route_name, model=model)
+            recorder = _turn_recorder.get()
+            if recorder is not None:
+                recorder.llm_calls.append({"component": component, "model": model, "route": route_name,
+                                           "finish_reason": finish_reason, "duration": duration, **tokens})
+
+
+def _record_usage(component: str, model: str, usage, call_span: tracing.Span) -> dict:
+    """
+    Records the token usage of a gpt api call.
+
+    Args:
+        component (str): The calling component.
+        model (str): The gpt model.
+        usage: The usage of the chat completion.
+        call_span (tracing.Span): The span of the call, or None.
+
+    Returns:
+        dict: The prompt, completion and cached tokens of the call.
+    """
+
+    turn_labels = _turn_labels.get() or {}
+    labels = {
+        "component": component,
+        "model": model,
+        "dialogue_state": turn_labels.get("dialogue_state", ""),
+        "rg_action": turn_labels.get("rg_action", ""),
+        "treatment_group": turn_labels.get("treatment_group", ""),
+    }
+    prompt_tokens = usage.prompt_tokens or 0
+    completion_tokens = usage.completion_tokens or 0
+    prompt_tokens_details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(prompt_tokens_details, "cached_tokens", None) or 0
+    LLM_TOKENS.inc(prompt_tokens, kind="prompt", **labels)
+    LLM_TOKENS.inc(completion_tokens, kind="completion", **labels)
+    LLM_TOKENS.inc(cached_tokens, kind="cached", **labels)
+    LLM_COMPLETION_TOKENS.observe(completion_tokens, component=component, dialogue_state=labels["dialogue_state"],
+                                  rg_action=labels["rg_action"])
+    if call_span is not None:
+        call_span.set_attribute("prompt_tokens", prompt_tokens)
+        call_span.set_attribute("completion_tokens", completion_tokens)
+        call_span.set_attribute("cached_tokens", cached_tokens)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "cached_tokens": cached_tokens}
+
+
+def _finish_reason(completion) -> str:
+    """
+    Returns the finish reason of the first choice of a chat completion.
+
+    Args:
+        completion: The chat completion, or None.
+
+    Returns:
+        str: The finish reason (e.g. "stop" or "length"), or an empty string.
+    """
+
+    choices = getattr(completion, "choices", None)
+    if not choices:
+        return ""
+    return getattr(choices[0], "finish_reason", "") or ""
@@ -0,0 +1,281 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import httpx
+
+
+logger = logging.getLogger(__name__)
+
+# Environment variables which enable the cassette for the openai clients
+CASSETTE_MODE_VARIABLE = "LLM_CASSETTE_MODE"
+CASSETTE_PATH_VARIABLE = "LLM_CASSETTE_PATH"
+CASSETTE_REPLAY_LATENCY_VARIABLE = "LLM_CASSETTE_REPLAY_LATENCY"
+
+CASSETTE_MODES = ("off", "record", "replay")
+
+# Random output example of the slot filling prompt, which must not change the
+# key of a request
+OUTPUT_EXAMPLE_PATTERN = re.compile(r"(Beispiel: )\{.*?\}", re.DOTALL)
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# Request fields which do not influence the response
+IGNORED_REQUEST_FIELDS = ("user", "metadata", "store")
+
+# Headers of a recorded response which do not apply to its decoded body
+DECODED_RESPONSE_EXCLUDED_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+
+
+def normalize_content(content) -> str:
+    """
+    Normalizes the content of a message for the request key (collapses the
+    whitespace and removes the random output example of the slot filling
+    prompt).
+
+    Args:
+        content: The content of the message (a string or a list of parts).
+
+    Returns:
+        str: The normalized content.
+    """
+
+    if not isinstance(content, str):
+        content = json.dumps(content, sort_keys=True, ensure_ascii=False)
+    content = OUTPUT_EXAMPLE_PATTERN.sub(r"\1{}", content)
+    return WHITESPACE_PATTERN.sub(" ", content).strip()
+
+
+def request_key(method: str, path: str, body: dict) -> str:
+    """
+    Computes the key of a request in the cassette (a hash of the endpoint, the
+    parameters and the normalized prompt).
+
+    Args:
+        method (str): The http method.
+        path (str): The path of the endpoint (e.g. /v1/chat/completions).
+        body (dict): The json body of the request.
+
+    Returns:
+        str: The key of the request.
+    """
+
+    normalized_body = {key: value for key, value in body.items() if key not in IGNORED_REQUEST_FIELDS}
+    if isinstance(normalized_body.get("messages"), list):
+        normalized_body["messages"] = [
+            {"role": message.get("role"), "content": normalize_content(message.get("content", ""))}
+            for message in normalized_body["messages"]
+        ]
+    normalized_request = json.dumps([method, path, normalized_body], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(normalized_request.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    Class that represents a cassette file with recorded requests and
+    responses of the openai api (one json object per line).
+    - Identical requests may be recorded several times. They are replayed in
+    the recorded order, and the last one is repeated afterwards.
+    """
+
+    def __init__(self, file_path: str):
+        """
+        Constructor of the Cassette class.
+
+        Args:
+            file_path (str): The path of the cassette file.
+        """
+
+        self.file_path = file_path
+        self.entries = {}
+        self.replay_positions = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """
+        Loads the recorded entries of the cassette file (if it exists).
+        """
+
+        self.entries = {}
+        if not os.path.exists(self.file_path):
+            return
+        with open(self.file_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.entries.setdefault(entry["key"], []).append(entry)
+
+    def record(self, entry: dict):
+        """
+        Appends an entry to the cassette.
+
+        Args:
+            entry (dict): The entry with the key, the request, the response and
+            the duration of the call.
+        """
+
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self.lock:
+            self.entries.setdefault(entry["key"], []).append(entry)
+            with open(self.file_path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def next_entry(self, key: str) -> dict:
+        """
+        Returns the next recorded entry of a request.
+
+        Args:
+            key (str): The key of the request.
+
+        Returns:
+            dict: The entry, or None if the request was not recorded.
+        """
+
+        with self.lock:
+            entries = self.entries.get(key)
+            if not entries:
+                return None
+            position = self.replay_positions.get(key, 0)
+            self.replay_positions[key] = position + 1
+            return entries[min(position, len(entries) - 1)]
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """
+    Class that represents a transport of the http client of the openai api
+    which records the calls to a cassette or replays them from it.
+    - In record mode, the requests are sent with the wrapped transport and the
+    responses are stored with the duration of the call.
+    - In replay mode, the recorded responses are returned (optionally after
+    the recorded duration). Requests which are not in the cassette are
+    answered with a 404 error that names the request key and the cassette
+    file, so that the openai client raises immediately (without retries).
+    """
+
+    def __init__(self, cassette: Cassette, mode: str, replay_latency: bool = False,
+                 transport: httpx.BaseTransport = None):
+        """
+        Constructor of the CassetteTransport class.
+
+        Args:
+            cassette (Cassette): The cassette.
+            mode (str): "record" or "replay".
+            replay_latency (bool): Whether replayed responses are delayed by
+            the recorded duration.
+            transport (httpx.BaseTransport): The transport for recorded
+            requests (the default http transport if None).
+        """
+
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode {mode}")
+        self.cassette = cassette
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self.transport = transport if transport is not None else httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        """
+        Records or replays a request.
+
+        Args:
+            request (httpx.Request): The request of the openai client.
+
+        Returns:
+            httpx.Response: The (recorded) response.
+        """
+
+        request_body = request.read()
+        body = json.loads(request_body) if request_body else {}
+        key = request_key(request.method, request.url.path, body)
+
+        if self.mode == "replay":
+            entry = self.cassette.next_entry(key)
+            if entry is None:
+                message = (f"No recorded response for the request {key} in the cassette "
+                           f"{self.cassette.file_path} (record it with {CASSETTE_MODE_VARIABLE}=record)")
+                logger.warning(message)
+                return httpx.Response(404, json={"error": {"message": message, "type": "cassette_miss", "code": None}},
+                                      request=request)
+            if self.replay_latency:
+                time.sleep(entry["duration"])
+            response = entry["response"]
+            return httpx.Response(response["status"], headers={"content-type": response["content_type"]},
+                                  content=response["body"].encode("utf-8"), request=request)
+
+        start = time.perf_counter()
+        response = self.transport.handle_request(request)
+        response_body = response.read()
+        duration = time.perf_counter() - start
+        self.cassette.record({
+            "key": key,
+            "request": {"method": request.method, "path": request.url.path, "body": body},
+            "response": {
+                "status": response.status_code,
+                "content_type": response.headers.get("content-type", "application/json"),
+                "body": response_body.decode("utf-8"),
+            },
+            "duration": duration,
+        })
+        # The body has been decoded, so it is returned without the encoding
+        # and length headers of the upstream response (e.g. gzip)
+        headers = [(name, value) for name, value in response.headers.multi_items()
+                   if name.lower() not in DECODED_RESPONSE_EXCLUDED_HEADERS]
+        return httpx.Response(response.status_code, headers=headers, content=response_body, request=request)
+
+    def close(self):
+        self.transport.close()
+
+
+# Cassettes of the process per file path (shared by the openai clients of the
+# slot filling and the response generation)
+_cassettes = {}
+_cassettes_lock = threading.Lock()
+
+
+def get_cassette(file_path: str) -> Cassette:
+    """
+    Returns the cassette of a file (loaded once per process).
+
+    Args:
+        file_path (str): The path of the cassette file.
+
+    Returns:
+        Cassette: The cassette.
+    """
+
+    file_path = os.path.abspath(file_path)
+    with _cassettes_lock:
+        if file_path not in _cassettes:
+            _cassettes[file_path] = Cassette(file_path)
+        return _cassettes[file_path]
+
+
+def client_options() -> dict:
+    """
+    Returns the additional options of an openai client for the cassette
+    configured by the environment variables LLM_CASSETTE_MODE (off, record or
+    replay), LLM_CASSETTE_PATH and LLM_CASSETTE_REPLAY_LATENCY (1 to replay
+    the recorded durations).
+
+    Returns:
+        dict: The keyword arguments for the openai client (empty if the
+        cassette is off).
+    """
+
+    mode = os.getenv(CASSETTE_MODE_VARIABLE, "off").lower()
+    if mode == "off":
+        return {}
+    if mode not in CASSETTE_MODES:
+        raise ValueError(f"{CASSETTE_MODE_VARIABLE} must be one of {', '.join(CASSETTE_MODES)}")
+
+    cassette = get_cassette(os.getenv(CASSETTE_PATH_VARIABLE, "llm_cassette.jsonl"))
+    replay_latency = os.getenv(CASSETTE_REPLAY_LATENCY_VARIABLE, "0").lower() in ("1", "true", "yes")
+    options = {"http_client": httpx.Client(transport=CassetteTransport(cassette, mode, replay_latency))}
+    if mode == "replay" and not os.getenv("OPENAI_API_KEY"):
+        # Replayed calls need no valid api key
+        options["api_key"] = "cassette-replay"
+    return options
@@ -0,0 +1,62 @@
+import os
+import threading
+
+from dotenv import load_dotenv
+
+
+# Openai client shared by the slot filling and the response generation
+# (created on first use)
+_openai_client = None
+_openai_client_lock = threading.Lock()
+
+
+def get_openai_client():
+    """
+    Returns the openai client shared by the slot filling and the response
+    generation (one connection pool to the api).
+    - The openai package (and httpx for the cassette) is imported and the
+    client is created on the first call, so that importing the bot does not
+    load the openai package (most of the import time of the bot).
+    - Loads the gpt api key from the environment variables.
+    - Records the calls to or replays them from a cassette if configured by
+    the LLM_CASSETTE_* environment variables (see llm_cassette).
+
+    Returns:
+        openai.OpenAI: The openai client instance.
+    """
+
+    global _openai_client
+    if _openai_client is not None:
+        return _openai_client
+    with _openai_client_lock:
+        if _openai_client is None:
+            import openai
+            from bot import llm_cassette
+
+            load_dotenv()
+            openai.api_key = os.getenv("OPENAI_API_KEY")
+            _openai_client = openai.OpenAI(**llm_cassette.client_options())
+    return _openai_client
+
+
+def send_warm_up_request(model: str, timeout: float = None):
+    """
+    Sends a minimal chat completion (one output token) with the shared
+    client, which opens its pooled connection to the api (tls handshake)
+    ahead of the first turn. Used by the startup warm-up only if the
+    deployment opts in (warmup.llm_request in botsettings.json), as the
+    request is billed for every worker start.
+
+    Args:
+        model (str): The gpt model.
+        timeout (float): The timeout of the request in seconds (the default
+        timeout of the client if None).
+    """
+
+    request_options = {"timeout": timeout} if timeout else {}
+    get_openai_client().chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": "ping"}],
+        max_tokens=1,
+        **request_options
+    )
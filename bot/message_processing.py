@@ -1,9 +1,21 @@
 import os
 import json
+import logging
 
+from bot import instrumentation
+from bot import llm_client
+from bot.data_bundle import DataBundle
 from bot.slot_filling import SlotFilling
 from bot.dialogue_management import DialogueManagement
 from bot.response_generation import ResponseGeneration
+from bot.model_routing import ModelRouter
+
+
+logger = logging.getLogger(__name__)
+
+# Messages of the warm-up of the pipeline
+WARM_UP_BOT_MESSAGE = "Wie kann ich Ihnen helfen?"
+WARM_UP_USER_TEXT = "Ich habe ein Problem mit meiner Bestellung, der Pullover ist nicht angekommen."
 
 
 class MessageProcessing:
@@ -11,28 +23,65 @@ class MessageProcessing:
     Class that manages the processing of user messages.
     """
 
-    def __init__(self):
+    def __init__(self, data_bundle: DataBundle = None):
         """
         Constructor of the MessageProcessing class.
-        - Loads the slot_template, the state information, the edge_conditions 
-        and the rg_mapping information.
+        - Loads the slot_template, the state information, the initial state, 
+        the edge_conditions, the rg_mapping information and the model routing 
+        table (from the data bundle if provided, otherwise from the data 
+        files).
         - Initializes instances of the SlotFilling class, the DialogueManagement
         class, and the Response Generation class. 
+
+        Args:
+            data_bundle (DataBundle): The precompiled data files of the bot 
+            (see bot.data_bundle), or None to read the data files.
         """
 
         root_path = os.path.join(os.path.dirname(__file__))
+        self.data_bundle = data_bundle
         self.slot_template = self.load_slot_template(root_path)
         state_info = self.load_state_info(root_path)
         self.state_info = state_info["states"]
         self.final_state = state_info["final_state"]
+        self.initial_dialogue_state = str(self.load_data_file(
+            root_path, ["data", "dialogue_start", "initial_state.json"]).get("initial_dialogue_state", "0"))
         self.edge_conditions = self.load_edge_conditions(root_path)
         self.rg_mapping = self.load_rg_mapping(root_path)
+        self.model_router = ModelRouter(self.load_model_routing(root_path))
 
-        self.slot_filling = SlotFilling(self.slot_template, self.state_info)
+        self.slot_filling = SlotFilling(self.slot_template, self.state_info, self.model_router)
         self.dialogue_management = DialogueManagement(self.state_info, 
                                                       self.edge_conditions,
                                                       self.final_state)
-        self.response_generation = ResponseGeneration(self.rg_mapping)
+        self.response_generation = ResponseGeneration(self.rg_mapping, self.model_router)
+
+        # Fill the prompt template caches from the data bundle
+        if data_bundle is not None:
+            prompt_templates = data_bundle.get_prompt_templates(root_path)
+            self.slot_filling.prompt_templates.update(prompt_templates)
+            self.response_generation.prompt_templates.update(prompt_templates)
+
+    def load_data_file(self, root_path: str, path_suffix_parts: list):
+        """
+        Loads a json data file (from the data bundle if it contains the file).
+
+        Args: 
+            root_path (str): The path of this file. 
+            path_suffix_parts (list): The remaining file path, where the 
+            remaining parts are provided as strings in a list.
+
+        Returns:
+            The parsed json data.
+        """
+
+        if self.data_bundle is not None:
+            data = self.data_bundle.get(path_suffix_parts)
+            if data is not None:
+                return data
+        file_path = os.path.join(root_path, *path_suffix_parts)
+        with open(file_path, "r", encoding="utf-8") as f:
+            return json.load(f)
     
     def load_slot_template(self, root_path: str) -> dict:
         """
@@ -46,10 +95,7 @@ class MessageProcessing:
             dictionary. 
         """
 
-        file_path = os.path.join(root_path, "data", "slot_filling", 
-                                 "slot_template.json")
-        with open(file_path, "r", encoding="utf-8") as f:
-            slot_template = json.load(f)["slots"]
+        slot_template = self.load_data_file(root_path, ["data", "slot_filling", "slot_template.json"])["slots"]
         return slot_template
     
     def load_state_info(self, root_path: str) -> dict:
@@ -64,9 +110,7 @@ class MessageProcessing:
             dictionary. 
         """
 
-        file_path = os.path.join(root_path, "data", "states", "states.json")
-        with open(file_path, "r", encoding="utf-8") as f:
-            state_info = json.load(f)
+        state_info = self.load_data_file(root_path, ["data", "states", "states.json"])
         return state_info
     
     def load_edge_conditions(self, root_path: str) -> dict:
@@ -81,9 +125,7 @@ class MessageProcessing:
             dictionary.
         """
 
-        file_path = os.path.join(root_path, "data", "states", "edge_conditions.json")
-        with open(file_path, "r", encoding="utf-8") as f:
-            edge_conditions = json.load(f)["edge_conditions"]
+        edge_conditions = self.load_data_file(root_path, ["data", "states", "edge_conditions.json"])["edge_conditions"]
         return edge_conditions
     
     def load_rg_mapping(self, root_path: str) -> dict:
@@ -97,23 +139,97 @@ class MessageProcessing:
             dict: The information from the rg_mapping.json file as a dictionary.
         """
 
-        file_path = os.path.join(root_path, "data", "rg_mapping", 
-                                 "rg_mapping.json")
-        with open(file_path, "r", encoding="utf-8") as f:
-            rg_mapping = json.load(f)["rg_mapping"]
+        rg_mapping = self.load_data_file(root_path, ["data", "rg_mapping", "rg_mapping.json"])["rg_mapping"]
         return rg_mapping
 
+    def load_model_routing(self, root_path: str) -> dict:
+        """
+        Loads the model_routing.json file.
+        
+        Args: 
+            root_path (str): The path of this file. 
+        
+        Returns:
+            dict: The model routing table from the model_routing.json file as a 
+            dictionary.
+        """
+
+        model_routing = self.load_data_file(root_path, ["data", "model_routing", "model_routing.json"])["model_routing"]
+        return model_routing
+
+    def preload_prompt_templates(self):
+        """
+        Loads all prompt templates of the slot filling and the response 
+        generation into memory (e.g. before the server forks its workers).
+        """
+
+        self.slot_filling.preload_prompt_templates()
+        self.response_generation.preload_prompt_templates()
+
+    def preload_openai_client(self):
+        """
+        Creates the openai client of the slot filling and the response 
+        generation, which is otherwise created (and the openai package 
+        imported) by the first gpt api call. Also loads the tokenizer of the 
+        conversation history window, whose encoding is otherwise loaded (and 
+        possibly downloaded) by the first response generation.
+        """
+
+        self.slot_filling.openai_client
+        self.response_generation.openai_client
+        self.response_generation.token_counter.load()
+
+    def send_warm_up_request(self, timeout: float = None):
+        """
+        Sends a minimal gpt api request with the model of the default slot 
+        filling route, which opens the connection of the openai client ahead 
+        of the first turn (see llm_client.send_warm_up_request). Records no 
+        llm metrics.
+
+        Args:
+            timeout (float): The timeout of the request in seconds.
+        """
+
+        llm_client.send_warm_up_request(self.model_router.default_slot_filling_route.model, timeout)
+
+    def warm_up(self):
+        """
+        Runs the parts of the pipeline which do not call the gpt api once for 
+        each dialogue state and action (prompt building, pattern slot filling, 
+        dialogue management and canned responses), so that the first turns 
+        do not pay for cold caches and first-use code paths. Records no stage 
+        metrics.
+        """
+
+        self.preload_prompt_templates()
+        self.slot_filling.warm_up(WARM_UP_BOT_MESSAGE, WARM_UP_USER_TEXT)
+        for dialogue_state in self.state_info:
+            self.dialogue_management.run_fallback(dialogue_state)
+            try:
+                self.dialogue_management.run(dialogue_state, {}, {})
+            except Exception:
+                continue
+        self.response_generation.warm_up(
+            WARM_UP_USER_TEXT, [("bot", WARM_UP_BOT_MESSAGE), ("user", WARM_UP_USER_TEXT)])
+
     def process_message(
         self,
         user_text: str,
         treatment_group: int,
         conversation_history: list,
         dialogue_state_history: list,
-        slot_filling: dict
+        slot_filling: dict,
+        use_fallbacks: bool = False,
+        conversation_history_tokens: list = None
     ) -> tuple[str, str, bool, dict]:
         """
         Manages the processing of user messages.
         This function contains the pipeline for processing user messages. 
+        - If use_fallbacks is set (e.g. because the bot is overloaded), the 
+        slot filling and the response generation directly use their fallbacks 
+        instead of the gpt api.
+        - The slot filling uses the local slot classifier first (if one is 
+        configured), also if use_fallbacks is set.
 
         Args:
             user_text (str): The user message to process.
@@ -121,6 +237,10 @@ class MessageProcessing:
             conversation_history (list): The conversation history.
             dialogue_state_histpry (list): The dialogue state history.
             slot_filling (dict): The slot filling dictionary. 
+            use_fallbacks (bool): Flag whether to skip the gpt api calls.
+            conversation_history_tokens (list): The cached token counts of the 
+            messages of the conversation history for the response generation 
+            (updated in place), or None.
 
         Returns:
             tuple[str, str, bool, dict]: A tuple with the bot's response, the 
@@ -128,21 +248,50 @@ class MessageProcessing:
             and the updated slot filling dictionary. 
         """
 
-        # Extract the current dialogue state
-        current_dialogue_state = dialogue_state_history[-1] 
+        # Extract the current dialogue state (the initial state if the 
+        # conversation has not been started, e.g. the message has been 
+        # processed before the conversation update)
+        if dialogue_state_history:
+            current_dialogue_state = dialogue_state_history[-1]
+        else:
+            current_dialogue_state = self.initial_dialogue_state
+
+        # Label the gpt api calls of this turn for the token usage metrics
+        instrumentation.set_turn_labels(
+            dialogue_state=current_dialogue_state,
+            treatment_group=treatment_group,
+            rg_action=""
+        )
 
-        # Perform the slot filling
-        try:
-            newly_filled_slots = self.slot_filling.run(
-                user_text=user_text,
-                current_dialogue_state=current_dialogue_state,
-                conversation_history=conversation_history
-            )
-        except:
-            newly_filled_slots = self.slot_filling.run_fallback(
-                user_text=user_text,
-                current_dialogue_state=current_dialogue_state
-            )
+        # Perform the slot filling (with the local slot classifier if it is 
+        # confident, otherwise with the gpt api or the fallback)
+        with instrumentation.stage("slot_filling", variant="llm") as slot_filling_stage:
+            try:
+                newly_filled_slots = self.slot_filling.run_classifier(
+                    user_text=user_text,
+                    current_dialogue_state=current_dialogue_state,
+                    conversation_history=conversation_history
+                )
+            except Exception as e:
+                logger.warning("Slot classifier failed, the slots are classified with the gpt api: %r", e)
+                newly_filled_slots = None
+            if newly_filled_slots is not None:
+                slot_filling_stage.variant = "classifier"
+            else:
+                try:
+                    if use_fallbacks:
+                        raise RuntimeError("Slot filling with the gpt api skipped")
+                    newly_filled_slots = self.slot_filling.run(
+                        user_text=user_text,
+                        current_dialogue_state=current_dialogue_state,
+                        conversation_history=conversation_history
+                    )
+                except:
+                    slot_filling_stage.variant = "fallback"
+                    newly_filled_slots = self.slot_filling.run_fallback(
+                        user_text=user_text,
+                        current_dialogue_state=current_dialogue_state
+                    )
 
         # Update the slot filling dictionary
         for slot, value in newly_filled_slots.items():
@@ -150,29 +299,37 @@ class MessageProcessing:
                 slot_filling[slot] = value
         
         # Perform the dialogue management
-        try:
-            new_dialogue_state, rg_action, final_state = self.dialogue_management.run(
-                current_dialogue_state=current_dialogue_state,
-                slot_filling=slot_filling,
-                newly_filled_slots=newly_filled_slots
-            )
-        except:
-            new_dialogue_state, rg_action, final_state = self.dialogue_management.run_fallback(
-                current_dialogue_state=current_dialogue_state
-            )
+        with instrumentation.stage("dialogue_management") as dialogue_management_stage:
+            try:
+                new_dialogue_state, rg_action, final_state = self.dialogue_management.run(
+                    current_dialogue_state=current_dialogue_state,
+                    slot_filling=slot_filling,
+                    newly_filled_slots=newly_filled_slots
+                )
+            except:
+                dialogue_management_stage.variant = "fallback"
+                new_dialogue_state, rg_action, final_state = self.dialogue_management.run_fallback(
+                    current_dialogue_state=current_dialogue_state
+                )
+        instrumentation.set_turn_labels(rg_action=rg_action)
 
         # Perform the response generation
-        try:
-            bot_response = self.response_generation.run(
-                user_text=user_text,
-                rg_action=rg_action,
-                treatment_group=treatment_group,
-                conversation_history=conversation_history,
-            )
-        except:
-            bot_response = self.response_generation.run_fallback(
-                rg_action=rg_action,
-                treatment_group=treatment_group,
-            )
+        with instrumentation.stage("response_generation", variant="llm") as response_generation_stage:
+            try:
+                if use_fallbacks:
+                    raise RuntimeError("Response generation with the gpt api skipped")
+                bot_response = self.response_generation.run(
+                    user_text=user_text,
+                    rg_action=rg_action,
+                    treatment_group=treatment_group,
+                    conversation_history=conversation_history,
+                    conversation_history_tokens=conversation_history_tokens,
+                )
+            except:
+                response_generation_stage.variant = "fallback"
+                bot_response = self.response_generation.run_fallback(
+                    rg_action=rg_action,
+                    treatment_group=treatment_group,
+                )
 
         return bot_response, new_dialogue_state, final_state, slot_filling
@@ -0,0 +1,293 @@
+import bisect
+import threading
+
+
+# Default histogram buckets in seconds (from cache lookups to slow gpt calls)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(label_names: tuple, label_values: tuple, extra: str = "") -> str:
+    """
+    Formats the labels of a series in the Prometheus text format.
+
+    Args:
+        label_names (tuple): The names of the labels.
+        label_values (tuple): The values of the labels.
+        extra (str): An additional, already formatted label (e.g. le="0.5").
+
+    Returns:
+        str: The formatted labels including the braces, or an empty string.
+    """
+
+    parts = []
+    for name, value in zip(label_names, label_values):
+        escaped_value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{name}="{escaped_value}"')
+    if extra:
+        parts.append(extra)
+    if not parts:
+        return ""
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_value(value: float) -> str:
+    """
+    Formats a sample value in the Prometheus text format.
+
+    Args:
+        value (float): The value.
+
+    Returns:
+        str: The formatted value.
+    """
+
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """
+    Class that represents a monotonically increasing counter with labels.
+    """
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        """
+        Constructor of the Counter class.
+
+        Args:
+            name (str): The name of the metric.
+            documentation (str): The help text of the metric.
+            label_names (tuple): The names of the labels.
+        """
+
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        """
+        Increments the counter of a label combination.
+
+        Args:
+            amount (float): The amount to add.
+            **labels: The label values.
+        """
+
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def render(self) -> list:
+        """
+        Renders the counter in the Prometheus text format.
+
+        Returns:
+            list: The lines of the metric.
+        """
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            values = sorted(self.values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    Class that represents a histogram (e.g. of stage durations) with labels.
+    """
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        """
+        Constructor of the Histogram class.
+
+        Args:
+            name (str): The name of the metric.
+            documentation (str): The help text of the metric.
+            label_names (tuple): The names of the labels.
+            buckets (tuple): The upper bounds of the buckets in ascending order
+            (the +Inf bucket is added automatically).
+        """
+
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        """
+        Records an observation for a label combination.
+
+        Args:
+            value (float): The observed value.
+            **labels: The label values.
+        """
+
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        bucket_index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                # Counts per bucket (non-cumulative, the last one is +Inf), sum
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bucket_index] += 1
+            series[1] += value
+
+    def render(self) -> list:
+        """
+        Renders the histogram in the Prometheus text format.
+
+        Returns:
+            list: The lines of the metric.
+        """
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = sorted((key, (list(counts), total)) for key, (counts, total) in self.series.items())
+        for key, (counts, total) in series:
+            cumulative_count = 0
+            for upper_bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative_count += count
+                labels = _format_labels(self.label_names, key, f'le="{_format_value(upper_bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative_count}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative_count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Class that holds all metrics of the process and renders them for the
+    /metrics route.
+    """
+
+    def __init__(self):
+        """
+        Constructor of the MetricsRegistry class.
+        """
+
+        self.metrics = {}
+
+    def counter(self, name: str, documentation: str, label_names: tuple = ()) -> Counter:
+        """
+        Creates (or returns the already registered) counter.
+
+        Args:
+            name (str): The name of the metric.
+            documentation (str): The help text of the metric.
+            label_names (tuple): The names of the labels.
+
+        Returns:
+            Counter: The counter.
+        """
+
+        if name not in self.metrics:
+            self.metrics[name] = Counter(name, documentation, label_names)
+        return self.metrics[name]
+
+    def histogram(self, name: str, documentation: str, label_names: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        """
+        Creates (or returns the already registered) histogram.
+
+        Args:
+            name (str): The name of the metric.
+            documentation (str): The help text of the metric.
+            label_names (tuple): The names of the labels.
+            buckets (tuple): The upper bounds of the buckets.
+
+        Returns:
+            Histogram: The histogram.
+        """
+
+        if name not in self.metrics:
+            self.metrics[name] = Histogram(name, documentation, label_names, buckets)
+        return self.metrics[name]
+
+    def render(self) -> str:
+        """
+        Renders all metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics as text.
+        """
+
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Registry of the process
+registry = MetricsRegistry()
+
+# Metrics of the message pipeline
+STAGE_DURATION = registry.histogram(
+    "bot_stage_duration_seconds",
+    "Duration of the stages of a turn.",
+    ("stage", "variant")
+)
+LLM_CALL_DURATION = registry.histogram(
+    "bot_llm_call_duration_seconds",
+    "Duration of the gpt api calls.",
+    ("component", "model")
+)
+LLM_TOKENS = registry.counter(
+    "bot_llm_tokens_total",
+    "Tokens used by the gpt api calls (kind is prompt, completion or cached).",
+    ("component", "model", "kind", "dialogue_state", "rg_action", "treatment_group")
+)
+
+# Metrics of the model routes of the gpt api calls
+LLM_ROUTE_CALL_DURATION = registry.histogram(
+    "bot_llm_route_call_duration_seconds",
+    "Duration of the gpt api calls per model route.",
+    ("component", "route", "model")
+)
+LLM_ROUTE_COST = registry.counter(
+    "bot_llm_route_cost_usd_total",
+    "Cost of the gpt api calls per model route in USD (from the prices of the routing table).",
+    ("component", "route", "model")
+)
+LLM_ROUTE_VALIDATIONS = registry.counter(
+    "bot_llm_route_validations_total",
+    "Validation results of the gpt api responses per model route (result is valid or invalid).",
+    ("component", "route", "model", "result")
+)
+
+# Metrics of the output length of the gpt api calls (e.g. to tune the output
+# budgets per rg_action)
+LLM_COMPLETION_TOKENS = registry.histogram(
+    "bot_llm_completion_tokens",
+    "Generated tokens per gpt api call.",
+    ("component", "dialogue_state", "rg_action"),
+    buckets=(8, 16, 32, 48, 64, 96, 128, 160, 192, 256, 320, 384, 512, 1024)
+)
+LLM_TRUNCATIONS = registry.counter(
+    "bot_llm_truncations_total",
+    "Gpt api calls whose output was cut by the output budget (max_tokens).",
+    ("component", "dialogue_state", "rg_action")
+)
+
+# Metrics of the micro-batching of the slot filling (result is batched,
+# fallback, single or timeout)
+SLOT_FILLING_BATCH_SIZE = registry.histogram(
+    "bot_slot_filling_batch_size",
+    "Turns per slot filling batch.",
+    ("dialogue_state",),
+    buckets=(1, 2, 4, 8, 16, 32)
+)
+SLOT_FILLING_BATCH_ITEMS = registry.counter(
+    "bot_slot_filling_batch_items_total",
+    "Turns of the slot filling batches by result (fallback and timeout turns are sent as single requests).",
+    ("dialogue_state", "result")
+)
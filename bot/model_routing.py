@@ -0,0 +1,219 @@
+from fnmatch import fnmatchcase
+
+from bot.metrics import LLM_ROUTE_VALIDATIONS
+from bot.slot_output_format import OUTPUT_MODES
+
+
+# Routes of the gpt api calls if no routing table is configured (the models
+# used by every turn before the routing table existed)
+DEFAULT_MODEL_ROUTING = {
+    "prices": {},
+    "slot_filling": {"default": {"model": "gpt-4.1", "temperature": 0.0, "timeout": None, "output_mode": "json"}},
+    "response_generation": {"default": {"model": "gpt-4o", "temperature": 1, "timeout": None}},
+}
+
+ROUTE_PARAMETERS = ("model", "temperature", "timeout", "escalation_model", "output_mode")
+
+
+class ModelRoute:
+    """
+    Class that represents a route of the gpt api calls (the model, the
+    temperature and the timeout of the calls of a dialogue state or an
+    rg_action).
+    - If an escalation model is set, a call whose response fails the
+    validation is repeated once with the escalation model.
+    - The output mode only applies to the slot filling (see
+    slot_output_format).
+    """
+
+    def __init__(self, name: str, model: str, temperature: float, timeout: float = None,
+                 escalation_model: str = None, output_mode: str = "json", prices: dict = None):
+        """
+        Constructor of the ModelRoute class.
+
+        Args:
+            name (str): The name of the route (e.g. "state:0" or
+            "action:*_repeat"), used as label of the metrics.
+            model (str): The gpt model.
+            temperature (float): The temperature of the calls.
+            timeout (float): The timeout of a call in seconds (the timeout of
+            the openai client if None).
+            escalation_model (str): The model for calls whose response fails
+            the validation, or None.
+            output_mode (str): The output mode of the slot filling ("json",
+            "schema" or "compact").
+            prices (dict): The prices in USD per million tokens per model
+            ("prompt", "cached" and "completion").
+        """
+
+        self.name = name
+        self.model = model
+        self.temperature = temperature
+        self.timeout = timeout
+        self.escalation_model = escalation_model
+        if output_mode not in OUTPUT_MODES:
+            raise ValueError(f"Unknown slot filling output mode {output_mode}")
+        self.output_mode = output_mode
+        self.prices = prices or {}
+
+    def escalate(self) -> "ModelRoute":
+        """
+        Returns the route of the escalated call (same name and parameters, but
+        the escalation model and no further escalation).
+
+        Returns:
+            ModelRoute: The escalated route, or None if the route has no
+            escalation model.
+        """
+
+        if not self.escalation_model:
+            return None
+        return ModelRoute(self.name, self.escalation_model, self.temperature, self.timeout,
+                          output_mode=self.output_mode, prices=self.prices)
+
+    def cost(self, tokens: dict) -> float:
+        """
+        Computes the cost of a call of this route.
+
+        Args:
+            tokens (dict): The prompt, completion and cached tokens of the
+            call.
+
+        Returns:
+            float: The cost in USD (0 if the model has no prices).
+        """
+
+        prices = self.prices.get(self.model)
+        if not prices or not tokens:
+            return 0.0
+        cached_tokens = tokens.get("cached_tokens", 0)
+        uncached_tokens = tokens.get("prompt_tokens", 0) - cached_tokens
+        return (uncached_tokens * prices.get("prompt", 0.0)
+                + cached_tokens * prices.get("cached", prices.get("prompt", 0.0))
+                + tokens.get("completion_tokens", 0) * prices.get("completion", 0.0)) / 1e6
+
+
+class ModelRouter:
+    """
+    Class that picks the route of the gpt api calls of the slot filling (per
+    dialogue state) and of the response generation (per rg_action) from the
+    model routing table.
+    - Routes only need to contain the parameters which differ from the
+    default route of the component.
+    - Keys of the states and actions may be patterns (e.g. "*_repeat"). Exact
+    keys take precedence, then the first matching pattern is used.
+    """
+
+    def __init__(self, model_routing: dict = None):
+        """
+        Constructor of the ModelRouter class.
+
+        Args:
+            model_routing (dict): The model routing table (the default routes
+            if None).
+        """
+
+        model_routing = model_routing or DEFAULT_MODEL_ROUTING
+        self.prices = model_routing.get("prices", {})
+        self.default_slot_filling_route, self.slot_filling_routes = self._build_routes(
+            model_routing.get("slot_filling", {}), "states", "state",
+            DEFAULT_MODEL_ROUTING["slot_filling"]["default"])
+        self.default_response_generation_route, self.response_generation_routes = self._build_routes(
+            model_routing.get("response_generation", {}), "actions", "action",
+            DEFAULT_MODEL_ROUTING["response_generation"]["default"])
+
+    def _build_routes(self, component_routing: dict, routes_key: str, name_prefix: str,
+                      fallback_default: dict) -> tuple:
+        """
+        Builds the routes of a component.
+
+        Args:
+            component_routing (dict): The routing table of the component.
+            routes_key (str): The key of the routes ("states" or "actions").
+            name_prefix (str): The prefix of the route names.
+            fallback_default (dict): The default parameters if the table has
+            no default route.
+
+        Returns:
+            tuple: The default route and the routes per key (in the order of
+            the table).
+        """
+
+        default_parameters = {**fallback_default, **component_routing.get("default", {})}
+        unknown_parameters = set(default_parameters) - set(ROUTE_PARAMETERS)
+        if unknown_parameters:
+            raise ValueError(f"Unknown model routing parameters: {', '.join(sorted(unknown_parameters))}")
+        default_route = ModelRoute("default", prices=self.prices, **default_parameters)
+
+        routes = {}
+        for key, parameters in component_routing.get(routes_key, {}).items():
+            unknown_parameters = set(parameters) - set(ROUTE_PARAMETERS)
+            if unknown_parameters:
+                raise ValueError(f"Unknown model routing parameters: {', '.join(sorted(unknown_parameters))}")
+            routes[key] = ModelRoute(f"{name_prefix}:{key}", prices=self.prices,
+                                     **{**default_parameters, **parameters})
+        return default_route, routes
+
+    def _find_route(self, default_route: ModelRoute, key_routes: dict, key: str) -> ModelRoute:
+        """
+        Finds the route of a key.
+
+        Args:
+            default_route (ModelRoute): The default route of the component.
+            key_routes (dict): The routes of the component per key.
+            key (str): The dialogue state or the rg_action.
+
+        Returns:
+            ModelRoute: The route of the key (the default route if no route
+            matches).
+        """
+
+        route = key_routes.get(key)
+        if route is not None:
+            return route
+        for pattern, route in key_routes.items():
+            if fnmatchcase(key, pattern):
+                return route
+        return default_route
+
+    def route_slot_filling(self, dialogue_state: str) -> ModelRoute:
+        """
+        Returns the route of the slot filling in a dialogue state.
+
+        Args:
+            dialogue_state (str): The current dialogue state.
+
+        Returns:
+            ModelRoute: The route.
+        """
+
+        return self._find_route(self.default_slot_filling_route, self.slot_filling_routes, dialogue_state)
+
+    def route_response_generation(self, rg_action: str) -> ModelRoute:
+        """
+        Returns the route of the response generation of an rg_action.
+
+        Args:
+            rg_action (str): The action to be performed.
+
+        Returns:
+            ModelRoute: The route.
+        """
+
+        return self._find_route(self.default_response_generation_route, self.response_generation_routes,
+                                rg_action)
+
+
+def record_validation(component: str, route: ModelRoute, valid: bool):
+    """
+    Records the validation result of a gpt api response of a route.
+
+    Args:
+        component (str): The calling component ("slot_filling" or
+        "response_generation").
+        route (ModelRoute): The route of the call.
+        valid (bool): Whether the response passed the validation.
+    """
+
+    LLM_ROUTE_VALIDATIONS.inc(component=component, route=route.name, model=route.model,
+                              result="valid" if valid else "invalid")
@@ -1,7 +1,31 @@
 import os
-from dotenv import load_dotenv
-import openai
-from openai import OpenAI
+import re
+
+from bot import instrumentation
+from bot import llm_client
+from bot import model_routing
+from bot.model_routing import ModelRoute, ModelRouter
+from bot.token_counting import TokenCounter
+
+
+# Output budget of actions without max_tokens or stop in the rg_mapping
+DEFAULT_MAX_TOKENS = 300
+# Stop sequences which end the response before the model continues with 
+# further turns of the conversation history format
+DEFAULT_STOP_SEQUENCES = ["\nKunde:", "\nChatbot:"]
+# End of a sentence (including closing quotes or brackets)
+SENTENCE_END_PATTERN = re.compile(r"[.!?…][\"'“”»«)]*(?=\s|$)")
+
+# Window of the conversation history in the prompt: the latest messages 
+# which fit into the token budget (at most HISTORY_MAX_MESSAGES, the 4 
+# messages of the former fixed window, so that the budget only shortens 
+# long histories)
+HISTORY_TOKEN_BUDGET = 400
+HISTORY_MAX_MESSAGES = 4
+# Tokens of a message line besides its text (speaker, quotes, line break)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Minimum length of a shortened message (shorter rests are dropped)
+MIN_TRUNCATED_MESSAGE_TOKENS = 16
         
 
 class ResponseGeneration:
@@ -9,42 +33,64 @@ class ResponseGeneration:
     Class that performs the response generation.
     """
 
-    def __init__(self, rg_mapping: dict):
+    def __init__(self, rg_mapping: dict, model_router: ModelRouter = None,
+                 history_token_budget: int = HISTORY_TOKEN_BUDGET):
         """
         Constructor of the ResponseGeneration class.
         - Initializes the rg_mapping dictionary.
+        - Initializes the model router (with the default routes if None).
+        - Initializes the token counter for the conversation history window.
         - Creates a class variable for the root path of this file. 
-        - Creates an openai client instance.
+        - Initializes the cache for the prompt templates.
+        - Creates the openai client on first use (see the openai_client 
+        property).
 
         Args:
             rg_mapping (dict): The dictionary with the response generation 
             mapping.
+            model_router (ModelRouter): The router of the gpt api calls.
+            history_token_budget (int): The token budget of the conversation 
+            history in the prompt.
         """
 
         self.rg_mapping = rg_mapping
+        self.model_router = model_router if model_router is not None else ModelRouter()
+        self.history_token_budget = history_token_budget
+        self.token_counter = TokenCounter()
         self.root_path = os.path.join(os.path.dirname(__file__))
-        self.openai_client = self.create_openai_client()
+        self.prompt_templates = {}
+        self._openai_client = None
     
-    def create_openai_client(self) -> OpenAI:
+    @property
+    def openai_client(self):
+        """
+        The openai client (created on first use, see create_openai_client).
+        """
+
+        if self._openai_client is None:
+            self._openai_client = self.create_openai_client()
+        return self._openai_client
+
+    def create_openai_client(self) -> "openai.OpenAI":
         """
         Creates an openai api client.
-        - Loads the gpt api key from the environment variables and initializes an openai client. 
+        - Returns the openai client shared with the other components, which is 
+        created and configured on first use (see llm_client).
         
         Returns:
-            OpenAI: The openai client instance.
+            OpenAI: The openai client instance, or None if it cannot be created.
         """
-        
+
         try: 
-            load_dotenv()
-            openai.api_key = os.getenv("OPENAI_API_KEY")
-            openai_client = openai.OpenAI()
-            return openai_client
+            return llm_client.get_openai_client()
         except: 
             return None
     
     def load_prompt_template(self, root_path: str, path_suffix_parts: list) -> str:
         """
         Loads a prompt template in .txt format.
+        - Keeps the loaded prompt templates in memory, so that each file is 
+        only read once.
         
         Args: 
             root_path (str): The root file path.
@@ -56,11 +102,62 @@ class ResponseGeneration:
         """
 
         file_path = os.path.join(root_path, *path_suffix_parts)
-        with open(file_path, "r", encoding="utf-8") as f:
-            prompt_template = f.read()
+        prompt_template = self.prompt_templates.get(file_path)
+        if prompt_template is None:
+            with open(file_path, "r", encoding="utf-8") as f:
+                prompt_template = f.read()
+            self.prompt_templates[file_path] = prompt_template
         return prompt_template
 
-    def run(self, user_text: str, rg_action: str, treatment_group: int, conversation_history: list) -> str:
+    def preload_prompt_templates(self):
+        """
+        Loads all prompt templates and canned responses for the response 
+        generation into memory.
+        - Skips files referenced in the rg_mapping which do not exist.
+        - Loads the tokenizer for the conversation history window.
+        """
+
+        self.token_counter.load()
+
+        path_suffixes = []
+        for treatment in ["empathetic", "neutral"]:
+            path_suffixes.append(["data", "rg_prompts", f"developer_prompt_{treatment}.txt"])
+            path_suffixes.append(["data", "rg_prompts", f"user_prompt_{treatment}.txt"])
+        for action_info in self.rg_mapping.values():
+            path_suffixes.append(["data", "rg_prompts", "dev_variants", action_info["dev_prompt_variable"]])
+            path_suffixes.append(["data", "rg_prompts", "user_contents", action_info["user_prompt_content"]])
+            for treatment in ["empathetic", "neutral"]:
+                path_suffixes.append(["data", "canned_responses", treatment, action_info["user_prompt_content"]])
+
+        for path_suffix_parts in path_suffixes:
+            try:
+                self.load_prompt_template(self.root_path, path_suffix_parts)
+            except FileNotFoundError:
+                continue
+
+    def warm_up(self, user_text: str, conversation_history: list):
+        """
+        Builds the prompts and loads the canned response of each action for 
+        both treatment groups once (without gpt api calls), so that the first 
+        turns find the prompt templates cached and the code paths warm.
+        - Skips actions whose files do not exist.
+
+        Args:
+            user_text (str): A user message for the prompts.
+            conversation_history (list): A conversation history for the 
+            prompts.
+        """
+
+        for rg_action in self.rg_mapping:
+            for treatment_group in (0, 1):
+                try:
+                    self._get_rg_prompts(user_text, rg_action, treatment_group, conversation_history)
+                    self.run_fallback(rg_action, treatment_group)
+                except FileNotFoundError:
+                    continue
+
+    def run(self, user_text: str, rg_action: str, treatment_group: int, conversation_history: list,
+            conversation_history_tokens: list = None) -> str:
         """
         Performs the response generation.
         - Generates a developer prompt and a user prompt for the gpt api. 
@@ -68,22 +165,114 @@ class ResponseGeneration:
         rg_prompts folder and fills the variables (expecially the contents for 
         the bot's responses and the conversation history) with the respective
         values, taking into account the rg_action and the conversation history.
-        - Uses the prompts to generate the bot's response using the gpt api.
+        - Uses the prompts to generate the bot's response using the gpt model 
+        of the route of the rg_action and the output budget of the rg_action. 
+        If the response is empty, repeats the call with the escalation model 
+        of the route (if any).
+        - Raises a ValueError if the response is still empty (so that the 
+        fallback is used).
+        - Cuts a response which exceeded the output budget at the end of its 
+        last complete sentence.
         
         Args: 
             user_text (str): The user message to be answered.
             rg_action (str): The action to be performed.
             treatment_group (int): The treatment group value.
             conversation_history (list): The conversation history. 
+            conversation_history_tokens (list): The cached token counts of the 
+            messages of the conversation history (updated in place), or None.
             
         Returns:
             str: The bot's response.
         """
 
-        # Transform the conversation history in a suitable format for the 
-        # prompt
+        # Call the gpt api to perform the response generation task (escalate 
+        # to the larger model of the route if the response is invalid)
+        route = self.model_router.route_response_generation(rg_action)
+        gpt_response, truncated = self._send_gpt_request(self.build_request(
+            user_text, rg_action, treatment_group, conversation_history, conversation_history_tokens, route), route)
+        bot_response = self.parse_response(gpt_response, truncated)
+        model_routing.record_validation("response_generation", route, bot_response is not None)
+        escalated_route = route.escalate()
+        if bot_response is None and escalated_route is not None:
+            gpt_response, truncated = self._send_gpt_request(self.build_request(
+                user_text, rg_action, treatment_group, conversation_history, conversation_history_tokens,
+                escalated_route), escalated_route)
+            bot_response = self.parse_response(gpt_response, truncated)
+            model_routing.record_validation("response_generation", escalated_route, bot_response is not None)
+
+        # Use the fallback if the response is still invalid
+        if bot_response is None:
+            raise ValueError("Response generation returned no valid response")
+
+        return bot_response
+
+    def build_request(self, user_text: str, rg_action: str, treatment_group: int, conversation_history: list,
+                      conversation_history_tokens: list = None, route: ModelRoute = None) -> dict:
+        """
+        Builds the chat completion request of the response generation of a 
+        turn, as sent by run (also used for the requests of the batch api).
+
+        Args:
+            user_text (str): The user message to be answered.
+            rg_action (str): The action to be performed.
+            treatment_group (int): The treatment group value.
+            conversation_history (list): The conversation history. 
+            conversation_history_tokens (list): The cached token counts of the 
+            messages of the conversation history (updated in place), or None.
+            route (ModelRoute): The model route of the call (the route of the 
+            rg_action if None, e.g. its escalated route for a repeated call).
+
+        Returns:
+            dict: The parameters of the chat completion request.
+        """
+
+        rg_dev_prompt, rg_user_prompt = self._get_rg_prompts(
+            user_text, rg_action, treatment_group, conversation_history, conversation_history_tokens)
+        if route is None:
+            route = self.model_router.route_response_generation(rg_action)
+        return self._build_gpt_request(rg_dev_prompt, rg_user_prompt, route, rg_action)
+
+    def parse_response(self, gpt_response: str, truncated: bool = False) -> str:
+        """
+        Parses the gpt response of a request built by build_request.
+
+        Args:
+            gpt_response (str): The gpt api response.
+            truncated (bool): Whether the response was cut by the output 
+            budget.
+
+        Returns:
+            str: The response for the chatbot message, or None if the response 
+            is not valid (e.g. empty).
+        """
+
+        if not self._is_valid_gpt_response(gpt_response):
+            return None
+        return self._verify_gpt_response(gpt_response, truncated)
+    
+    def _get_rg_prompts(self, user_text: str, rg_action: str, treatment_group: int, conversation_history: list,
+                        conversation_history_tokens: list = None) -> tuple[str, str]:
+        """
+        Builds the gpt prompts for the response generation.
+
+        Args: 
+            user_text (str): The user message to be answered.
+            rg_action (str): The action to be performed.
+            treatment_group (int): The treatment group value.
+            conversation_history (list): The conversation history. 
+            conversation_history_tokens (list): The cached token counts of the 
+            messages of the conversation history (updated in place), or None.
+
+        Returns: 
+            tuple[str, str]: The developer prompt and the user prompt. 
+        """
+
+        # Transform the latest messages of the conversation history which fit 
+        # into the token budget in a suitable format for the prompt
         conv_hist_for_prompt = self._get_conv_hist_for_prompt(
-            conversation_history, user_text, lastx=4)
+            conversation_history, user_text, lastx=HISTORY_MAX_MESSAGES,
+            token_budget=self.history_token_budget, history_tokens=conversation_history_tokens)
 
         # Complie the developer prompt
         rg_dev_prompt = self._get_rg_dev_prompt(rg_action, treatment_group)
@@ -92,15 +281,10 @@ class ResponseGeneration:
         rg_user_prompt = self._get_rg_user_prompt(rg_action, treatment_group, 
                                                  conv_hist_for_prompt)
 
-        # Call the gpt api to perform the response generation task
-        gpt_response = self._call_gpt_api(rg_dev_prompt, rg_user_prompt)
+        return rg_dev_prompt, rg_user_prompt
 
-        # Prepare the gpt api results to be outputted as a chatbot message
-        bot_response = self._verify_gpt_response(gpt_response)
-
-        return bot_response
-    
-    def _get_conv_hist_for_prompt(self, conversation_history: dict, user_text: str, lastx: int=None) -> str:
+    def _get_conv_hist_for_prompt(self, conversation_history: dict, user_text: str, lastx: int=None,
+                                  token_budget: int=None, history_tokens: list=None) -> str:
         """
         Converts the conversation history to a format suitable for the prompt.
 
@@ -109,6 +293,10 @@ class ResponseGeneration:
             user_text (str): The user message to be answered.
             lastx (int/None): How many messages to consider when preparing the 
             conversation history: Only the last x messages are considered.
+            token_budget (int/None): The maximum number of tokens of the 
+            considered messages (see _get_history_window).
+            history_tokens (list/None): The cached token counts of the 
+            messages of the conversation history (updated in place).
 
         Returns: 
             str: The conversation history in a suitable format for the prompt. 
@@ -116,9 +304,13 @@ class ResponseGeneration:
 
         # Extract onlx the messages from the conversation history to be 
         # considered
-        conversation_history = conversation_history + [("user", user_text)]
-        if lastx is not None:
-            conversation_history = conversation_history[-lastx:]
+        if token_budget is not None:
+            conversation_history = self._get_history_window(
+                conversation_history, user_text, token_budget, lastx, history_tokens)
+        else:
+            conversation_history = conversation_history + [("user", user_text)]
+            if lastx is not None:
+                conversation_history = conversation_history[-lastx:]
 
         # Transform the conversation history to a suitable string format
         lines = []
@@ -129,6 +321,68 @@ class ResponseGeneration:
 
         return conv_hist_string
     
+    def _get_history_window(self, conversation_history: list, user_text: str, token_budget: int,
+                            max_messages: int = None, history_tokens: list = None) -> list:
+        """
+        Selects the latest messages (including the user message to be 
+        answered) which fit into the token budget.
+        - Adds the messages from the newest to the oldest. The first message 
+        which does not fit is shortened to its end (if a useful rest of the 
+        budget is left) and ends the window. The user message to be answered 
+        is always included (shortened if it exceeds the budget on its own).
+        - Counts the tokens of a message only once: The counts are cached in 
+        history_tokens, which is aligned with the conversation history (None 
+        for messages which were not counted yet).
+
+        Args: 
+            conversation_history (list): The conversation history. 
+            user_text (str): The user message to be answered.
+            token_budget (int): The maximum number of tokens of the window.
+            max_messages (int/None): The maximum number of messages.
+            history_tokens (list/None): The cached token counts (updated in 
+            place).
+
+        Returns: 
+            list: The messages of the window (oldest first).
+        """
+
+        # Align the cache with the conversation history
+        if history_tokens is not None:
+            if len(history_tokens) > len(conversation_history):
+                history_tokens.clear()
+            history_tokens.extend([None] * (len(conversation_history) - len(history_tokens)))
+
+        messages = conversation_history + [("user", user_text)]
+        window = []
+        remaining_tokens = token_budget
+        for index in range(len(messages) - 1, -1, -1):
+            if max_messages is not None and len(window) >= max_messages:
+                break
+            role, text = messages[index]
+
+            # Count the tokens of the message (or use the cached count)
+            in_cache = history_tokens is not None and index < len(history_tokens)
+            tokens = history_tokens[index] if in_cache else None
+            if tokens is None:
+                tokens = self.token_counter.count(text)
+                if in_cache:
+                    history_tokens[index] = tokens
+
+            if tokens + MESSAGE_OVERHEAD_TOKENS <= remaining_tokens:
+                window.append((role, text))
+                remaining_tokens -= tokens + MESSAGE_OVERHEAD_TOKENS
+                continue
+
+            # Shorten the first message which does not fit and end the window
+            available_tokens = remaining_tokens - MESSAGE_OVERHEAD_TOKENS
+            if not window or available_tokens >= MIN_TRUNCATED_MESSAGE_TOKENS:
+                available_tokens = max(available_tokens, MIN_TRUNCATED_MESSAGE_TOKENS)
+                window.append((role, "…" + self.token_counter.truncate_start(text, available_tokens).lstrip()))
+            break
+
+        window.reverse()
+        return window
+
     def _get_rg_dev_prompt(self, action: str, treatment_group: str) -> str:
         """
         Complies the developer prompt for the gpt api.
@@ -196,48 +450,124 @@ class ResponseGeneration:
 
         return rg_dev_prompt
     
-    def _call_gpt_api(self, developer_prompt: str, user_prompt: str, model: str = "gpt-4o") -> str:
-        """ 
-        Calls the gpt api.
-        - Usees the developer prompt and the user_prompt strings.
-        - Returns the api response.
+    def _get_output_budget(self, rg_action: str) -> tuple[int, list]:
+        """
+        Determines the output budget of an action from the rg_mapping.
+
+        Args:
+            rg_action (str): The action to be performed (or None).
+
+        Returns:
+            tuple[int, list]: The maximum number of generated tokens and the 
+            stop sequences.
+        """
+
+        action_info = self.rg_mapping.get(rg_action, {}) if rg_action else {}
+        max_tokens = action_info.get("max_tokens", DEFAULT_MAX_TOKENS)
+        stop_sequences = action_info.get("stop", DEFAULT_STOP_SEQUENCES)
+        return max_tokens, stop_sequences
+
+    def _build_gpt_request(self, developer_prompt: str, user_prompt: str, route: ModelRoute = None,
+                           rg_action: str = None) -> dict:
+        """
+        Builds the parameters of the chat completion request of the response 
+        generation (also used for the requests of the batch api).
 
         Args:
             developer_prompt (str): The developer prompt for the gpt api.
             user_prompt (str): The user prompt for the gpt api. 
-            model (str): The gpt model to use. 
+            route (ModelRoute): The model route of the call (the default route 
+            if None).
+            rg_action (str): The action to be performed, which determines the 
+            output budget (the default budget if None).
 
         Returns:
-            str: The gpt api response.
+            dict: The parameters of the chat completion request.
         """
 
-        # Perform the gpt api call
-        completion = self.openai_client.chat.completions.create(
-            model=model, 
-            messages=[
+        if route is None:
+            route = self.model_router.default_response_generation_route
+        max_tokens, stop_sequences = self._get_output_budget(rg_action)
+        gpt_request = {
+            "model": route.model,
+            "messages": [
                 {"role": "developer", "content": developer_prompt},
                 {"role": "user", "content": user_prompt}
             ],
-            temperature=1,
-            #max_tokens=300,
-        )
+            "temperature": route.temperature,
+            "max_tokens": max_tokens,
+        }
+        if stop_sequences:
+            gpt_request["stop"] = stop_sequences
+        return gpt_request
+
+    def _send_gpt_request(self, gpt_request: dict, route: ModelRoute) -> tuple[str, bool]:
+        """
+        Sends a chat completion request of the response generation to the gpt 
+        api (with the timeout of the route).
+
+        Args:
+            gpt_request (dict): The parameters of the chat completion request.
+            route (ModelRoute): The model route of the call.
+
+        Returns:
+            tuple[str, bool]: The gpt api response and a flag whether it was 
+            truncated.
+        """
+
+        request_options = {"timeout": route.timeout} if route.timeout else {}
+        with instrumentation.llm_call("response_generation", route.model, route) as llm_call:
+            llm_call.completion = self.openai_client.chat.completions.create(**gpt_request, **request_options)
+        completion = llm_call.completion
 
         # Extract api response
-        response = completion.choices[0].message.content
-        return response
+        choice = completion.choices[0]
+        response = choice.message.content
+        truncated = choice.finish_reason == "length"
+        return response, truncated
 
-    def _verify_gpt_response(self, gpt_response: str) -> str:
+    def _is_valid_gpt_response(self, gpt_response: str) -> bool:
+        """
+        Checks whether the gpt response can be used as chatbot message (a 
+        non-empty text).
+
+        Args:
+            gpt_response (str): The gpt api response.
+
+        Returns:
+            bool: Whether the response is valid.
+        """
+
+        return isinstance(gpt_response, str) and bool(gpt_response.strip())
+
+    def _verify_gpt_response(self, gpt_response: str, truncated: bool = False) -> str:
         """
         Verifies that the gpt_response is in a chatbot message format.
+        - Removes surrounding whitespace (e.g. before a stop sequence).
+        - If the response was cut by the output budget, removes the incomplete 
+        last sentence, so that the message ends on a sentence boundary (unless 
+        the response has no complete sentence).
         
         Args:
             gpt_response (str): The gpt api response.
+            truncated (bool): Whether the response was cut by the output 
+            budget.
         
         Returns:
             str: The response for the chatbot message.
         """
-        
-        return gpt_response
+
+        if not isinstance(gpt_response, str):
+            raise ValueError(f"Response generation returned a {type(gpt_response).__name__} instead of a text")
+        bot_response = gpt_response.strip()
+
+        # Cut the response after the last complete sentence
+        if truncated:
+            sentence_ends = list(SENTENCE_END_PATTERN.finditer(bot_response))
+            if sentence_ends:
+                bot_response = bot_response[:sentence_ends[-1].end()]
+
+        return bot_response
     
     def run_fallback(self, rg_action: str, treatment_group: int) -> str:
         """
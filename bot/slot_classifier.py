@@ -0,0 +1,246 @@
+import json
+import math
+import re
+import zlib
+
+
+# Version of the features (a model file trained with other features is
+# rejected)
+FEATURE_VERSION = 1
+
+# Number of bits of the hashed feature indices
+DEFAULT_HASH_BITS = 18
+
+# Lengths of the character n-grams of the user message
+CHARACTER_NGRAM_LENGTHS = (3, 4)
+
+# Confidence (probability of the predicted value) needed for each slot to
+# check, otherwise the turn is classified with the gpt api
+DEFAULT_CONFIDENCE_THRESHOLD = 0.95
+
+# Longer user messages are left to the gpt api (they are rare, and the
+# features grow with the length)
+MAX_USER_TEXT_LENGTH = 250
+
+WORD_PATTERN = re.compile(r"\w+")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# Cache of the hashes of the feature strings (most n-grams and words recur,
+# so that most features are hashed once per process)
+MAX_FEATURE_HASH_CACHE_SIZE = 200000
+_ngram_hashes = {}
+_feature_hashes = {}
+
+
+def extract_features(dialogue_state: str, last_bot_message: str, user_text: str,
+                     hash_bits: int = DEFAULT_HASH_BITS) -> list:
+    """
+    Extracts the hashed features of a turn for the slot classifier (used for
+    the training and the inference, so that both see the same features).
+    - Character n-grams of the user message.
+    - Words of the user message (also combined with the dialogue state) and
+    the shapes of numbers (e.g. the length of an order number).
+    - Words of the last bot message (the question the user answers).
+    - The dialogue state.
+
+    Args:
+        dialogue_state (str): The dialogue state of the turn.
+        last_bot_message (str): The last bot message (None counts as empty).
+        user_text (str): The user message.
+        hash_bits (int): The number of bits of the feature indices.
+
+    Returns:
+        list: The indices of the features (without duplicates).
+    """
+
+    # Character n-grams of the normalized user message
+    normalized_text = f" {WHITESPACE_PATTERN.sub(' ', user_text.lower()).strip()} "
+    ngrams = {
+        normalized_text[start:start + length]
+        for length in CHARACTER_NGRAM_LENGTHS
+        for start in range(len(normalized_text) - length + 1)
+    }
+
+    # Words of the user message and of the last bot message
+    features = {f"s:{dialogue_state}"}
+    for word in WORD_PATTERN.findall(normalized_text):
+        features.add(f"w:{word}")
+        features.add(f"s:{dialogue_state}:w:{word}")
+        if word.isdigit():
+            features.add(f"n:{len(word)}")
+    for word in WORD_PATTERN.findall((last_bot_message or "").lower()):
+        features.add(f"b:{word}")
+
+    mask = (1 << hash_bits) - 1
+    hashes = _hash_features(ngrams, "c:", _ngram_hashes) + _hash_features(features, "", _feature_hashes)
+    return list({feature_hash & mask for feature_hash in hashes})
+
+
+def _hash_features(features: set, prefix: str, cache: dict) -> list:
+    """
+    Hashes feature strings (with the cached hashes).
+
+    Args:
+        features (set): The feature strings (without the prefix).
+        prefix (str): The prefix of the feature strings.
+        cache (dict): The cache of the hashes of the feature strings.
+
+    Returns:
+        list: The hashes (crc32 of the prefixed feature strings).
+    """
+
+    if len(cache) > MAX_FEATURE_HASH_CACHE_SIZE:
+        cache.clear()
+    hashes = list(map(cache.get, features))
+    if None in hashes:
+        hashes = [
+            feature_hash if feature_hash is not None
+            else cache.setdefault(feature, zlib.crc32(f"{prefix}{feature}".encode("utf-8")))
+            for feature, feature_hash in zip(features, hashes)
+        ]
+    return hashes
+
+
+class SlotClassifier:
+    """
+    Class that classifies the slots of a turn locally (without the gpt api)
+    with a logistic regression per slot over hashed features, which is
+    trained on the slot labels of the gpt api (see tools.train_slot_classifier).
+    - The scores are calibrated per slot (Platt scaling on held-out labels),
+    so that the confidence threshold is a probability.
+    - A turn is only classified if every slot to check has a model and
+    reaches the confidence threshold, and the user message is not longer
+    than MAX_USER_TEXT_LENGTH.
+    - Inference is pure python (one dictionary lookup per feature of the
+    turn), so the bot does not need numpy.
+    """
+
+    def __init__(self, slot_models: dict, hash_bits: int = DEFAULT_HASH_BITS,
+                 confidence_threshold: float = DEFAULT_CONFIDENCE_THRESHOLD):
+        """
+        Constructor of the SlotClassifier class.
+
+        Args:
+            slot_models (dict): The model per slot with the bias, the sparse
+            weights (feature index to weight) and the calibration (scale and
+            offset of the score).
+            hash_bits (int): The number of bits of the feature indices.
+            confidence_threshold (float): The confidence needed per slot.
+        """
+
+        self.hash_bits = hash_bits
+        self.confidence_threshold = confidence_threshold
+        self.slot_positions = {slot_id: position for position, slot_id in enumerate(slot_models)}
+        self.biases = [float(slot_model["bias"]) for slot_model in slot_models.values()]
+        self.calibrations = [
+            tuple(float(value) for value in slot_model.get("calibration", (1.0, 0.0)))
+            for slot_model in slot_models.values()
+        ]
+
+        # Weights of all slots per feature (so that a turn needs one lookup
+        # per feature)
+        feature_weights = {}
+        for position, slot_model in enumerate(slot_models.values()):
+            for index, weight in slot_model["weights"].items():
+                feature_weights.setdefault(int(index), [0.0] * len(slot_models))[position] = float(weight)
+        self.feature_weights = {index: tuple(weights) for index, weights in feature_weights.items()}
+
+    @classmethod
+    def load(cls, file_path: str, confidence_threshold: float = None) -> "SlotClassifier":
+        """
+        Loads a slot classifier from a model file.
+
+        Args:
+            file_path (str): The path of the model file.
+            confidence_threshold (float): The confidence needed per slot (the
+            threshold of the model file if None).
+
+        Returns:
+            SlotClassifier: The slot classifier.
+        """
+
+        with open(file_path, "r", encoding="utf-8") as f:
+            model = json.load(f)["slot_classifier"]
+        if model.get("feature_version") != FEATURE_VERSION:
+            raise ValueError(f"Slot classifier {file_path} was trained with feature version "
+                             f"{model.get('feature_version')}, expected {FEATURE_VERSION}")
+        if confidence_threshold is None:
+            confidence_threshold = model.get("confidence_threshold", DEFAULT_CONFIDENCE_THRESHOLD)
+        return cls(model["slots"], model.get("hash_bits", DEFAULT_HASH_BITS), confidence_threshold)
+
+    def predict_probabilities(self, dialogue_state: str, last_bot_message: str, user_text: str,
+                              slots_to_check: list) -> dict:
+        """
+        Predicts the calibrated probability that each slot is filled.
+
+        Args:
+            dialogue_state (str): The current dialogue state.
+            last_bot_message (str): The last bot message.
+            user_text (str): The user message.
+            slots_to_check (list): The slots to check.
+
+        Returns:
+            dict: The probability per slot (None for slots without a model).
+        """
+
+        features = extract_features(dialogue_state, last_bot_message, user_text, self.hash_bits)
+        scale = 1.0 / math.sqrt(len(features))
+
+        # Sum the weights of the features per slot
+        feature_weights = [weights for weights in map(self.feature_weights.get, features) if weights is not None]
+        weight_sums = [sum(slot_weights) for slot_weights in zip(*feature_weights)] or [0.0] * len(self.biases)
+
+        probabilities = {}
+        for slot_id in slots_to_check:
+            position = self.slot_positions.get(slot_id)
+            if position is None:
+                probabilities[slot_id] = None
+                continue
+            calibration_scale, calibration_offset = self.calibrations[position]
+            score = self.biases[position] + scale * weight_sums[position]
+            probabilities[slot_id] = _sigmoid(calibration_scale * score + calibration_offset)
+        return probabilities
+
+    def classify(self, dialogue_state: str, last_bot_message: str, user_text: str, slots_to_check: list) -> dict:
+        """
+        Classifies the slots to check if the classifier is confident for all
+        of them.
+
+        Args:
+            dialogue_state (str): The current dialogue state.
+            last_bot_message (str): The last bot message.
+            user_text (str): The user message.
+            slots_to_check (list): The slots to check.
+
+        Returns:
+            dict: The mapping of 0 or 1 for each slot to check, or None if a
+            slot has no model or does not reach the confidence threshold (or
+            the user message is too long).
+        """
+
+        if not slots_to_check or len(user_text) > MAX_USER_TEXT_LENGTH:
+            return None
+        probabilities = self.predict_probabilities(dialogue_state, last_bot_message, user_text, slots_to_check)
+        classification_result = {}
+        for slot_id, probability in probabilities.items():
+            if probability is None or max(probability, 1.0 - probability) < self.confidence_threshold:
+                return None
+            classification_result[slot_id] = int(probability >= 0.5)
+        return classification_result
+
+
+def _sigmoid(value: float) -> float:
+    """
+    Computes the logistic function (without overflow for large scores).
+
+    Args:
+        value (float): The score.
+
+    Returns:
+        float: The probability.
+    """
+
+    if value >= 0:
+        return 1.0 / (1.0 + math.exp(-value))
+    exp_value = math.exp(value)
+    return exp_value / (1.0 + exp_value)
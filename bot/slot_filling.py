@@ -2,9 +2,32 @@ import random
 import os
 import json
 import re
-from dotenv import load_dotenv
-import openai
-from openai import OpenAI
+
+from bot import instrumentation
+from bot import llm_client
+from bot import model_routing
+from bot.model_routing import ModelRoute, ModelRouter
+from bot.slot_classifier import SlotClassifier
+from bot.slot_filling_batcher import SlotFillingBatcher
+from bot.slot_label_log import SlotLabelLog
+from bot.slot_output_format import OUTPUT_MODES, SlotBatchOutputFormat, SlotOutputFormat
+
+
+# Output budget of the slot filling (the json classification needs a few 
+# tokens per slot, e.g. '"c_val": 0, ')
+MAX_TOKENS_BASE = 8
+MAX_TOKENS_PER_SLOT = 8
+
+# Additional output budget per turn of a batch (the id of the turn)
+MAX_TOKENS_PER_BATCH_ITEM = 8
+
+# Output instructions of the items of a batch per output mode
+BATCH_ITEM_FORMATS = {
+    "json": "Jeder Eintrag enthält die id und für jede slot_id den Wert 1 (erfüllt) oder 0 (nicht erfüllt).",
+    "schema": "Jeder Eintrag enthält die id und für jede slot_id den Wert 1 (erfüllt) oder 0 (nicht erfüllt).",
+    "compact": ('Jeder Eintrag enthält die id und unter "filled_slots" die Liste der slot_ids der erfüllten Slots '
+                '(eine leere Liste, wenn kein Slot erfüllt ist).'),
+}
 
 
 class SlotFilling:
@@ -12,44 +35,74 @@ class SlotFilling:
     Class to perform the slot filling.
     """
 
-    def __init__(self, slot_template: dict, state_info: dict):
+    def __init__(self, slot_template: dict, state_info: dict, model_router: ModelRouter = None):
         """
         Constructor of the SlotFilling class.
         - Initializes the slot_template dictionary and the state_info dictionary. 
-        - Creates an openai client instance.
+        - Initializes the model router (with the default routes if None).
+        - Initializes the cache for the prompt templates.
+        - Creates the openai client on first use (see the openai_client 
+        property).
         - Complies the patterns from the slot_template dictionary to regex 
         patterns using the compile_regex_patterns method.
+        - Prepares the output formats (json schemas and validators) of the 
+        slots to check of each dialogue state.
+        - The local slot classifier, the slot label log and the batching are 
+        disabled until they are configured (see configure_slot_classifier and 
+        configure_batching).
 
         Args:
             slot_template (dict): The dictionary with the slot template.
             state_info (dict): The dictionary with the state information. 
+            model_router (ModelRouter): The router of the gpt api calls.
         """
 
         self.slot_template = slot_template
         self.state_info = state_info
-        self.openai_client = self.create_openai_client()
+        self.model_router = model_router if model_router is not None else ModelRouter()
+        self.prompt_templates = {}
+        self._openai_client = None
         self.slot_patterns = self.compile_regex_patterns()
+        self.output_formats = {}
+        self.batch_output_formats = {}
+        for dialogue_state in self.state_info:
+            for output_mode in OUTPUT_MODES:
+                self._get_output_format(self._get_slots_to_check(dialogue_state), output_mode)
+        self.slot_classifier = None
+        self.slot_classifier_audit_rate = 0.0
+        self.slot_label_log = None
+        self.batcher = None
     
-    def create_openai_client(self) -> OpenAI:
+    @property
+    def openai_client(self):
+        """
+        The openai client (created on first use, see create_openai_client).
+        """
+
+        if self._openai_client is None:
+            self._openai_client = self.create_openai_client()
+        return self._openai_client
+
+    def create_openai_client(self) -> "openai.OpenAI":
         """
         Creates an openai api client.
-        - Loads the gpt api key from the environment variables and initializes an openai client. 
+        - Returns the openai client shared with the other components, which is 
+        created and configured on first use (see llm_client).
         
         Returns:
-            OpenAI: The openai client instance.
+            OpenAI: The openai client instance, or None if it cannot be created.
         """
 
         try: 
-            load_dotenv()
-            openai.api_key = os.getenv("OPENAI_API_KEY")
-            openai_client = openai.OpenAI()
-            return openai_client
+            return llm_client.get_openai_client()
         except: 
             return None
     
     def load_prompt_template(self, root_path: str, path_suffix_parts: list) -> str:
         """
         Loads a prompt template in .txt format.
+        - Keeps the loaded prompt templates in memory, so that each file is 
+        only read once.
         
         Args: 
             root_path (str): The root file path.
@@ -61,10 +114,42 @@ class SlotFilling:
         """
 
         file_path = os.path.join(root_path, *path_suffix_parts)
-        with open(file_path, "r", encoding="utf-8") as f:
-            prompt_template = f.read()
+        prompt_template = self.prompt_templates.get(file_path)
+        if prompt_template is None:
+            with open(file_path, "r", encoding="utf-8") as f:
+                prompt_template = f.read()
+            self.prompt_templates[file_path] = prompt_template
         return prompt_template
 
+    def preload_prompt_templates(self):
+        """
+        Loads all prompt templates for the slot filling into memory.
+        """
+
+        root_path = os.path.join(os.path.dirname(__file__))
+        self.load_prompt_template(root_path, ["data", "slot_filling", "developer_prompt.txt"])
+        self.load_prompt_template(root_path, ["data", "slot_filling", "user_prompt_template.txt"])
+        self.load_prompt_template(root_path, ["data", "slot_filling", "user_prompt_template_compact.txt"])
+        self.load_prompt_template(root_path, ["data", "slot_filling", "user_prompt_template_batch.txt"])
+
+    def warm_up(self, last_bot_message: str, user_text: str):
+        """
+        Builds the prompts of each dialogue state in each output mode and runs 
+        the pattern matching of each dialogue state once (without gpt api 
+        calls), so that the first turns find the prompt templates cached and 
+        the code paths warm.
+
+        Args:
+            last_bot_message (str): A bot message for the prompts.
+            user_text (str): A user message for the prompts.
+        """
+
+        for dialogue_state in self.state_info:
+            slots_to_check = self._get_slots_to_check(dialogue_state)
+            for output_mode in OUTPUT_MODES:
+                self._get_slot_filling_prompts(last_bot_message, user_text, slots_to_check, output_mode)
+            self.run_fallback(user_text, dialogue_state)
+
     def run(self, user_text: str, current_dialogue_state: str, conversation_history: list) -> dict:
         """
         Performs the slot filling task.
@@ -75,7 +160,19 @@ class SlotFilling:
         the user message to analyze and the slots with their descriptions which 
         are relevant in the current dialogue state. 
         - Performs the classification task for each relevant slot using the gpt
-        model.
+        model of the route of the current dialogue state, in the output mode of 
+        the route. If the response is not a valid classification, repeats the 
+        call with the escalation model of the route (if any).
+        - Raises a ValueError if the response is still invalid in the schema or 
+        compact output mode (so that the fallback is used).
+        - Returns no filled slots without a gpt api call in a dialogue state 
+        without slots to check (the structured outputs of the gpt api reject 
+        the empty output format).
+        - If batching is enabled, first classifies the turn in a batch with the 
+        concurrent turns of the same dialogue state (single request if the 
+        batch has no valid result for the turn).
+        - Logs the classification as training data of the local slot 
+        classifier (if a slot label log is set).
         - Prepares the gpt response for the output format.
         
         Args:
@@ -88,29 +185,235 @@ class SlotFilling:
             the filled slots, values are 1. 
         """
 
-        # Get the relevant slots to analyze based on the current dialogue state
-        slots_to_check = self._get_slots_to_check(current_dialogue_state)
+        # Nothing to classify in a dialogue state without slots to check (e.g. 
+        # the final state)
+        if not self._get_slots_to_check(current_dialogue_state):
+            return {}
+
+        # Get the model route of the current dialogue state
+        route = self.model_router.route_slot_filling(current_dialogue_state)
 
         # Extract the last bot message from the conversation history
         last_bot_message = self._get_last_bot_message(conversation_history)
 
-        # Create the prompts for the gpt model
+        # Classify the slots in a batch with the concurrent turns of the 
+        # dialogue state (if batching is enabled). Without a batch result, 
+        # classify them with a single request.
+        classification_result = None
+        label_model = route.model
+        if self.batcher is not None:
+            classification_result = self.batcher.classify(
+                current_dialogue_state, last_bot_message, user_text, route.timeout)
+        if classification_result is None:
+            classification_result, label_model = self._run_single_request(
+                user_text, current_dialogue_state, conversation_history, route)
+
+        # Log the labels as training data of the local slot classifier
+        if self.slot_label_log is not None:
+            self.slot_label_log.record(current_dialogue_state, last_bot_message, user_text,
+                                       dict(classification_result), label_model)
+
+        # Prepare the classification results for the output format
+        filled_slots = self.prepare_result(classification_result)
+
+        return filled_slots
+
+    def build_request(self, user_text: str, current_dialogue_state: str, conversation_history: list,
+                      route: ModelRoute = None) -> dict:
+        """
+        Builds the chat completion request of the slot filling of a turn, as 
+        sent by run (also used for the requests of the batch api).
+
+        Args:
+            user_text (str): The user message.
+            current_dialogue_state (str): The current dialogue state.
+            conversation_history (list): The conversation history.
+            route (ModelRoute): The model route of the call (the route of the 
+            dialogue state if None, e.g. its escalated route for a repeated 
+            call).
+
+        Returns:
+            dict: The parameters of the chat completion request, or None in a 
+            dialogue state without slots to check (no request is sent, no 
+            slots are filled).
+        """
+
+        slots_to_check = self._get_slots_to_check(current_dialogue_state)
+        if not slots_to_check:
+            return None
+        if route is None:
+            route = self.model_router.route_slot_filling(current_dialogue_state)
         developer_prompt, user_prompt = self._get_slot_filling_prompts(
-            last_bot_message=last_bot_message,
+            last_bot_message=self._get_last_bot_message(conversation_history),
             user_text=user_text,
-            slots_to_check=slots_to_check
+            slots_to_check=slots_to_check,
+            output_mode=route.output_mode
         )
+        return self._build_gpt_request(developer_prompt, user_prompt, route, slots_to_check)
 
-        # Call the gpt api to perform the slot filling task
-        gpt_response = self._call_gpt_api(developer_prompt, user_prompt)
+    def parse_response(self, gpt_response: str, current_dialogue_state: str, route: ModelRoute = None,
+                       lenient: bool = False) -> dict:
+        """
+        Parses the gpt response of a request built by build_request.
 
-        # Extract the classification results from the gpt response
-        classification_result = self._extract_gpt_response(gpt_response, slots_to_check)
+        Args:
+            gpt_response (str): The gpt response.
+            current_dialogue_state (str): The current dialogue state.
+            route (ModelRoute): The model route of the call (the route of the 
+            dialogue state if None).
+            lenient (bool): Whether to extract the slots leniently from a 
+            response which does not match the output format in the json output 
+            mode (as for the last call of a turn).
 
-        # Prepare the classification results for the output format
-        filled_slots = self._prepare_result(classification_result)
+        Returns:
+            dict: The mapping of 0 or 1 for each slot to check, or None if the 
+            response is not a valid classification.
+        """
 
-        return filled_slots
+        slots_to_check = self._get_slots_to_check(current_dialogue_state)
+        if route is None:
+            route = self.model_router.route_slot_filling(current_dialogue_state)
+        classification_result = self._get_output_format(slots_to_check, route.output_mode).parse(gpt_response)
+        if classification_result is None and lenient and route.output_mode == "json":
+            classification_result = self._extract_gpt_response(gpt_response, slots_to_check)
+        return classification_result
+
+    def _run_single_request(self, user_text: str, current_dialogue_state: str, conversation_history: list,
+                            route: ModelRoute) -> tuple[dict, str]:
+        """
+        Classifies the slots of a turn with a single gpt api request.
+        - Escalates to the escalation model of the route if the response is 
+        not a valid classification.
+        - Raises a ValueError if the response is still invalid in the schema or 
+        compact output mode.
+
+        Args:
+            user_text (str): The user message.
+            current_dialogue_state (str): The current dialogue state.
+            conversation_history (list): The conversation history.
+            route (ModelRoute): The model route of the dialogue state.
+
+        Returns:
+            tuple[dict, str]: The mapping of 0 or 1 for each slot to check and 
+            the model which produced it.
+        """
+
+        # Call the gpt api to perform the slot filling task (escalate to the 
+        # larger model of the route if the response is invalid)
+        gpt_response = self._send_gpt_request(
+            self.build_request(user_text, current_dialogue_state, conversation_history, route), route)
+        classification_result = self.parse_response(gpt_response, current_dialogue_state, route)
+        model_routing.record_validation("slot_filling", route, classification_result is not None)
+        label_model = route.model
+        escalated_route = route.escalate()
+        if classification_result is None and escalated_route is not None:
+            label_model = escalated_route.model
+            gpt_response = self._send_gpt_request(
+                self.build_request(user_text, current_dialogue_state, conversation_history, escalated_route),
+                escalated_route)
+            classification_result = self.parse_response(gpt_response, current_dialogue_state, escalated_route)
+            model_routing.record_validation("slot_filling", escalated_route, classification_result is not None)
+
+        # Extract the classification results from the gpt response (leniently 
+        # in the json mode)
+        if classification_result is None:
+            classification_result = self.parse_response(gpt_response, current_dialogue_state, route, lenient=True)
+            if classification_result is None:
+                raise ValueError(f"Slot filling response does not match the {route.output_mode} output format")
+
+        return classification_result, label_model
+
+    def classify_batch(self, current_dialogue_state: str, items: list) -> dict:
+        """
+        Classifies the slots of a batch of turns in the same dialogue state 
+        with one gpt api request (see SlotFillingBatcher).
+        - Uses the route of the dialogue state without escalation (turns 
+        without a valid result are classified with single requests, which 
+        escalate).
+
+        Args:
+            current_dialogue_state (str): The dialogue state of the turns.
+            items (list): The turns as tuples of the item id, the last bot 
+            message and the user message.
+
+        Returns:
+            dict: The mapping of 0 or 1 for each slot to check per item id 
+            (only the items with a valid result).
+        """
+
+        slots_to_check = self._get_slots_to_check(current_dialogue_state)
+        route = self.model_router.route_slot_filling(current_dialogue_state)
+        developer_prompt, user_prompt = self._get_batch_slot_filling_prompts(
+            items, slots_to_check, route.output_mode)
+        gpt_response = self._call_gpt_api(developer_prompt, user_prompt, route, slots_to_check, len(items))
+        results = self._get_batch_output_format(slots_to_check, route.output_mode).parse(
+            gpt_response, [item_id for item_id, _, _ in items])
+        model_routing.record_validation("slot_filling", route, len(results) == len(items))
+        return results
+
+    def configure_batching(self, window: float = 0.005, max_batch_size: int = 8):
+        """
+        Enables the micro-batching of the slot filling requests of concurrent 
+        turns in the same dialogue state.
+
+        Args:
+            window (float): The time in seconds the first turn of a batch waits 
+            for further turns.
+            max_batch_size (int): The maximum number of turns per batch.
+        """
+
+        self.batcher = SlotFillingBatcher(self, window, max_batch_size)
+
+    def run_classifier(self, user_text: str, current_dialogue_state: str, conversation_history: list) -> dict:
+        """
+        Performs the slot filling with the local slot classifier (without the 
+        gpt api).
+        - Only classifies the turn if the classifier is confident for every 
+        slot to check, so that uncertain turns are classified by the gpt api.
+        - Leaves a random sample of the turns (the audit rate) to the gpt api, 
+        so that the slot label log keeps covering the turns the classifier is 
+        confident for.
+
+        Args:
+            user_text (str): The user message.
+            current_dialogue_state (str): The current dialogue state.
+            conversation_history (list): The conversation history.
+
+        Returns:
+            dict: The filled slots from the user message (keys are the ids of 
+            the filled slots, values are 1), or None if no classifier is set 
+            or it is not confident.
+        """
+
+        if self.slot_classifier is None or random.random() < self.slot_classifier_audit_rate:
+            return None
+        slots_to_check = self._get_slots_to_check(current_dialogue_state)
+        last_bot_message = self._get_last_bot_message(conversation_history)
+        classification_result = self.slot_classifier.classify(
+            current_dialogue_state, last_bot_message, user_text, slots_to_check)
+        if classification_result is None:
+            return None
+        return self.prepare_result(classification_result)
+
+    def configure_slot_classifier(self, model_path: str = None, confidence_threshold: float = None,
+                                  audit_rate: float = 0.0, label_log_path: str = None):
+        """
+        Configures the local slot classifier and the slot label log.
+
+        Args:
+            model_path (str): The path of the model file of the slot 
+            classifier (no classifier if None).
+            confidence_threshold (float): The confidence needed per slot (the 
+            threshold of the model file if None).
+            audit_rate (float): The share of the turns which are classified 
+            with the gpt api although a classifier is set.
+            label_log_path (str): The path of the json lines file for the slot 
+            labels of the gpt api (no label log if None).
+        """
+
+        self.slot_classifier = SlotClassifier.load(model_path, confidence_threshold) if model_path else None
+        self.slot_classifier_audit_rate = audit_rate
+        self.slot_label_log = SlotLabelLog(label_log_path) if label_log_path else None
     
     def _get_slots_to_check(self, current_dialogue_state: str) -> list:
         """
@@ -158,7 +461,48 @@ class SlotFilling:
                 break
         return last_bot_message
     
-    def _get_slot_filling_prompts(self, last_bot_message: str, user_text: str, slots_to_check: list) -> tuple[str, str]:
+    def _get_output_format(self, slots_to_check: list, output_mode: str) -> SlotOutputFormat:
+        """
+        Returns the output format of the slots to check in an output mode.
+        - The formats are prepared once per combination of slots (i.e. per 
+        dialogue state) and output mode.
+
+        Args:
+            slots_to_check (list): A list with the slots to check.
+            output_mode (str): The output mode ("json", "schema" or "compact").
+
+        Returns:
+            SlotOutputFormat: The output format.
+        """
+
+        key = (tuple(slots_to_check), output_mode)
+        output_format = self.output_formats.get(key)
+        if output_format is None:
+            output_format = self.output_formats[key] = SlotOutputFormat(slots_to_check, output_mode)
+        return output_format
+
+    def _get_batch_output_format(self, slots_to_check: list, output_mode: str) -> SlotBatchOutputFormat:
+        """
+        Returns the output format of a batch of turns with the slots to check 
+        in an output mode (prepared once per combination).
+
+        Args:
+            slots_to_check (list): A list with the slots to check.
+            output_mode (str): The output mode ("json", "schema" or "compact").
+
+        Returns:
+            SlotBatchOutputFormat: The output format of the batch.
+        """
+
+        key = (tuple(slots_to_check), output_mode)
+        batch_output_format = self.batch_output_formats.get(key)
+        if batch_output_format is None:
+            batch_output_format = self.batch_output_formats[key] = SlotBatchOutputFormat(
+                self._get_output_format(slots_to_check, output_mode))
+        return batch_output_format
+
+    def _get_slot_filling_prompts(self, last_bot_message: str, user_text: str, slots_to_check: list,
+                                  output_mode: str = "json") -> tuple[str, str]:
         """
         Builds the gpt prompts for the slot filling task.
         - Loads the developer prompt and the user prompt template.
@@ -176,6 +520,8 @@ class SlotFilling:
             user_text (str): The user message to classify.
             slots_to_check (list): A list with the slots to check, containing 
             the slot_id values.
+            output_mode (str): The output mode. The compact output mode uses 
+            its own user prompt template and output example.
 
         Returns: 
             tuple[str, str]: The developer prompt and the user prompt. 
@@ -184,10 +530,45 @@ class SlotFilling:
         # Load prompt templates
         root_path = os.path.join(os.path.dirname(__file__))
         dev_path_suffix = ["data", "slot_filling", "developer_prompt.txt"]
-        user_path_suffix = ["data", "slot_filling", "user_prompt_template.txt"]
+        user_template_name = "user_prompt_template_compact.txt" if output_mode == "compact" else "user_prompt_template.txt"
+        user_path_suffix = ["data", "slot_filling", user_template_name]
         developer_prompt = self.load_prompt_template(root_path, dev_path_suffix)
         user_prompt_template = self.load_prompt_template(root_path, user_path_suffix)
 
+        # Prepare the relevant slots with the description and the validation 
+        # slot notes
+        slots_as_string, validation_slot_notes = self._get_slots_section(slots_to_check)
+
+        # Prepare an output example
+        output_example_as_string = self.prepare_output_example(slots_to_check)
+        if output_mode == "compact":
+            output_format = self._get_output_format(slots_to_check, output_mode)
+            output_example_as_string = output_format.format_example(json.loads(output_example_as_string))
+
+        # Complete the user prompt by filling the variables
+        user_prompt = user_prompt_template.format(
+            last_bot_message=last_bot_message,
+            user_text=user_text,
+            slots=slots_as_string,
+            validation_slot_notes=validation_slot_notes,
+            output_example=output_example_as_string
+        )
+
+        return developer_prompt, user_prompt
+
+    def _get_slots_section(self, slots_to_check: list) -> tuple[str, str]:
+        """
+        Prepares the slots section and the validation slot notes of the slot 
+        filling prompts.
+
+        Args:
+            slots_to_check (list): A list with the slots to check.
+
+        Returns:
+            tuple[str, str]: The slots with their descriptions as json string 
+            and the validation slot notes.
+        """
+
         # Prepare the relevant slots with the description
         slots_section = []
         for slot_id in slots_to_check:
@@ -204,15 +585,50 @@ class SlotFilling:
                 note = f'\n    - Hinweis: Falls Slot {corresponding_slot} 0 ist, muss Slot "{slot_id}" auch 0 sein.'
                 validation_slot_notes += note
 
-        # Prepare an output example
-        output_example_as_string = self.prepare_output_example(slots_to_check)
+        return slots_as_string, validation_slot_notes
+
+    def _get_batch_slot_filling_prompts(self, items: list, slots_to_check: list,
+                                        output_mode: str = "json") -> tuple[str, str]:
+        """
+        Builds the gpt prompts for the slot filling of a batch of turns in the 
+        same dialogue state.
+        - The instructions and the slots come first, so that they are a 
+        common prefix of the prompts of all batches of the state.
+        - The turns are listed as one json object per line with their ids.
+
+        Args:
+            items (list): The turns as tuples of the item id, the last bot 
+            message and the user message.
+            slots_to_check (list): A list with the slots to check.
+            output_mode (str): The output mode.
+
+        Returns: 
+            tuple[str, str]: The developer prompt and the user prompt. 
+        """
+
+        # Load prompt templates
+        root_path = os.path.join(os.path.dirname(__file__))
+        developer_prompt = self.load_prompt_template(root_path, ["data", "slot_filling", "developer_prompt.txt"])
+        user_prompt_template = self.load_prompt_template(
+            root_path, ["data", "slot_filling", "user_prompt_template_batch.txt"])
+
+        slots_as_string, validation_slot_notes = self._get_slots_section(slots_to_check)
+        items_as_string = "\n".join(
+            json.dumps({"id": item_id, "chatbot": last_bot_message, "nutzer": user_text}, ensure_ascii=False)
+            for item_id, last_bot_message, user_text in items
+        )
+
+        # Prepare an output example with an example classification per item
+        batch_output_format = self._get_batch_output_format(slots_to_check, output_mode)
+        output_example_as_string = batch_output_format.format_example({
+            item_id: json.loads(self.prepare_output_example(slots_to_check)) for item_id, _, _ in items
+        })
 
-        # Complete the user prompt by filling the variables
         user_prompt = user_prompt_template.format(
-            last_bot_message=last_bot_message,
-            user_text=user_text,
             slots=slots_as_string,
+            items=items_as_string,
             validation_slot_notes=validation_slot_notes,
+            item_format=BATCH_ITEM_FORMATS[output_mode],
             output_example=output_example_as_string
         )
 
@@ -261,31 +677,115 @@ class SlotFilling:
         output_example_as_string = json.dumps(output_example)
         return output_example_as_string
     
-    def _call_gpt_api(self, developer_prompt: str, user_prompt: str, model: str = "gpt-4.1") -> str:
+    def _get_max_tokens(self, slots_to_check: list = None, item_count: int = None) -> int:
+        """
+        Determines the output budget of the slot filling, which leaves room 
+        for the json classification of the slots to check only.
+
+        Args:
+            slots_to_check (list): A list with the slots to check (all slots of 
+            the slot template if None).
+            item_count (int): The number of turns of a batch (None for a single 
+            turn).
+
+        Returns:
+            int: The maximum number of generated tokens.
+        """
+
+        if slots_to_check is None:
+            slots_to_check = self.slot_template
+        if item_count is not None:
+            return MAX_TOKENS_BASE + item_count * (MAX_TOKENS_PER_BATCH_ITEM + MAX_TOKENS_PER_SLOT * len(slots_to_check))
+        return MAX_TOKENS_BASE + MAX_TOKENS_PER_SLOT * len(slots_to_check)
+
+    def _build_gpt_request(self, developer_prompt: str, user_prompt: str, route: ModelRoute = None,
+                           slots_to_check: list = None, item_count: int = None) -> dict:
+        """
+        Builds the parameters of the chat completion request of the slot 
+        filling (also used for the requests of the batch api).
+
+        Args:
+            developer_prompt (str): The developer prompt for the gpt api.
+            user_prompt (str): The user prompt for the gpt api. 
+            route (ModelRoute): The model route of the call (the default route 
+            if None).
+            slots_to_check (list): The slots to check, which determine the 
+            output budget.
+            item_count (int): The number of turns of a batch request (None for 
+            the request of a single turn).
+
+        Returns:
+            dict: The parameters of the chat completion request.
+        """
+
+        if route is None:
+            route = self.model_router.default_slot_filling_route
+        gpt_request = {
+            "model": route.model,
+            "messages": [
+                {"role": "developer", "content": developer_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            "temperature": route.temperature,
+            "max_tokens": self._get_max_tokens(slots_to_check, item_count),
+        }
+
+        # Constrain the output to the json schema of the output mode
+        if slots_to_check is None:
+            slots_to_check = list(self.slot_template)
+        if item_count is not None:
+            output_format = self._get_batch_output_format(slots_to_check, route.output_mode)
+        else:
+            output_format = self._get_output_format(slots_to_check, route.output_mode)
+        if output_format.response_format is not None:
+            gpt_request["response_format"] = output_format.response_format
+        return gpt_request
+
+    def _call_gpt_api(self, developer_prompt: str, user_prompt: str, route: ModelRoute = None,
+                      slots_to_check: list = None, item_count: int = None) -> str:
         """
         Calls the gpt api.
         - Usees the developer prompt and the user_prompt strings.
+        - Uses the model, the temperature and the timeout of the route and the 
+        output budget of the slots to check.
         - Returns the api response.
 
         Args:
             developer_prompt (str): The developer prompt for the gpt api.
             user_prompt (str): The user prompt for the gpt api. 
-            model (str): The gpt model to use. 
+            route (ModelRoute): The model route of the call (the default route 
+            if None).
+            slots_to_check (list): The slots to check.
+            item_count (int): The number of turns of a batch request (None for 
+            the request of a single turn).
 
         Returns:
             str: The gpt api response.
         """
 
         # Perform the gpt api call
-        completion = self.openai_client.chat.completions.create(
-            model=model, 
-            messages=[
-                {"role": "developer", "content": developer_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.0,
-            #max_tokens=300,
-        )
+        if route is None:
+            route = self.model_router.default_slot_filling_route
+        gpt_request = self._build_gpt_request(developer_prompt, user_prompt, route, slots_to_check, item_count)
+        return self._send_gpt_request(gpt_request, route)
+
+    def _send_gpt_request(self, gpt_request: dict, route: ModelRoute) -> str:
+        """
+        Sends a chat completion request of the slot filling to the gpt api 
+        (with the timeout of the route).
+
+        Args:
+            gpt_request (dict): The parameters of the chat completion request.
+            route (ModelRoute): The model route of the call.
+
+        Returns:
+            str: The gpt api response.
+        """
+
+        request_options = {"timeout": route.timeout} if route.timeout else {}
+        with instrumentation.llm_call("slot_filling", route.model, route) as llm_call:
+            llm_call.completion = self.openai_client.chat.completions.create(**gpt_request, **request_options)
+        completion = llm_call.completion
 
         # Extract api response
         response = completion.choices[0].message.content
@@ -320,7 +820,7 @@ class SlotFilling:
         except Exception:
             return {slot_id: (1 if i == 0 else 0) for i, slot_id in enumerate(slots_to_check)}  #TODO: Error Handling
     
-    def _prepare_result(self, classification_result: dict) -> dict:
+    def prepare_result(self, classification_result: dict) -> dict:
         """
         Prepares the classification result for the output format.
         - Verifies the validation slot condition: Verifies that there is no case 
@@ -381,7 +881,7 @@ class SlotFilling:
                     break
         
         # Prepare the filled slots for the output format
-        filled_slots = self._prepare_result(filled_slots)
+        filled_slots = self.prepare_result(filled_slots)
 
         return filled_slots
     
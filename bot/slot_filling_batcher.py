@@ -0,0 +1,152 @@
+import logging
+import threading
+
+from bot.metrics import SLOT_FILLING_BATCH_ITEMS, SLOT_FILLING_BATCH_SIZE
+
+
+logger = logging.getLogger(__name__)
+
+
+class SlotFillingJob:
+    """
+    Class that represents a turn waiting for the slot filling of its batch.
+    """
+
+    def __init__(self, item_id: str, last_bot_message: str, user_text: str):
+        """
+        Constructor of the SlotFillingJob class.
+
+        Args:
+            item_id (str): The id of the turn in its batch.
+            last_bot_message (str): The last bot message.
+            user_text (str): The user message.
+        """
+
+        self.item_id = item_id
+        self.last_bot_message = last_bot_message
+        self.user_text = user_text
+        self.classification_result = None
+        self.done = threading.Event()
+
+
+class SlotFillingBatch:
+    """
+    Class that represents the jobs of a dialogue state collected within the
+    batch window.
+    """
+
+    def __init__(self, dialogue_state: str):
+        """
+        Constructor of the SlotFillingBatch class.
+
+        Args:
+            dialogue_state (str): The dialogue state of the turns.
+        """
+
+        self.dialogue_state = dialogue_state
+        self.jobs = []
+        self.full = threading.Event()
+
+
+class SlotFillingBatcher:
+    """
+    Class that combines the slot filling of concurrent turns in the same
+    dialogue state into one gpt api request (fewer requests against the rate
+    limits, and the instructions and slot descriptions are sent once).
+    - The turns run in the worker threads of the message processing. The
+    first turn of a dialogue state opens a batch and waits for the batch
+    window (or until the batch is full), then sends the request of the batch
+    and hands the results to the waiting turns.
+    - A turn gets no result (None) if its batch only holds this turn, the
+    request fails or its item of the response is missing or invalid. The
+    caller then sends the single request of the turn.
+    """
+
+    def __init__(self, slot_filling, window: float = 0.005, max_batch_size: int = 8):
+        """
+        Constructor of the SlotFillingBatcher class.
+
+        Args:
+            slot_filling (SlotFilling): The slot filling, which builds and
+            sends the batch requests.
+            window (float): The time in seconds the first turn of a batch waits
+            for further turns.
+            max_batch_size (int): The maximum number of turns per batch.
+        """
+
+        self.slot_filling = slot_filling
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.open_batches = {}
+        self.lock = threading.Lock()
+
+    def classify(self, dialogue_state: str, last_bot_message: str, user_text: str, timeout: float = None) -> dict:
+        """
+        Classifies the slots of a turn in a batch with the concurrent turns of
+        the same dialogue state (blocks until the result of the batch is
+        available).
+
+        Args:
+            dialogue_state (str): The current dialogue state.
+            last_bot_message (str): The last bot message.
+            user_text (str): The user message.
+            timeout (float): The maximum time in seconds to wait for the
+            result of a batch opened by another turn (no limit if None).
+
+        Returns:
+            dict: The mapping of 0 or 1 for each slot to check, or None if the
+            turn needs a single request.
+        """
+
+        # Join the open batch of the dialogue state or open a new one
+        with self.lock:
+            batch = self.open_batches.get(dialogue_state)
+            leader = batch is None
+            if leader:
+                batch = self.open_batches[dialogue_state] = SlotFillingBatch(dialogue_state)
+            job = SlotFillingJob(str(len(batch.jobs) + 1), last_bot_message, user_text)
+            batch.jobs.append(job)
+            if len(batch.jobs) >= self.max_batch_size:
+                del self.open_batches[dialogue_state]
+                batch.full.set()
+
+        if not leader:
+            if not job.done.wait(timeout):
+                SLOT_FILLING_BATCH_ITEMS.inc(dialogue_state=dialogue_state, result="timeout")
+            return job.classification_result
+
+        # Wait for further turns and close the batch
+        batch.full.wait(self.window)
+        with self.lock:
+            if self.open_batches.get(dialogue_state) is batch:
+                del self.open_batches[dialogue_state]
+        self._run_batch(batch)
+        return job.classification_result
+
+    def _run_batch(self, batch: SlotFillingBatch):
+        """
+        Sends the request of a closed batch and hands the results to its jobs.
+
+        Args:
+            batch (SlotFillingBatch): The closed batch.
+        """
+
+        SLOT_FILLING_BATCH_SIZE.observe(len(batch.jobs), dialogue_state=batch.dialogue_state)
+        try:
+            if len(batch.jobs) > 1:
+                items = [(job.item_id, job.last_bot_message, job.user_text) for job in batch.jobs]
+                results = self.slot_filling.classify_batch(batch.dialogue_state, items)
+                for job in batch.jobs:
+                    job.classification_result = results.get(job.item_id)
+        except Exception as e:
+            logger.warning("Slot filling batch of %d turns failed: %r", len(batch.jobs), e)
+        finally:
+            for job in batch.jobs:
+                if len(batch.jobs) == 1:
+                    result = "single"
+                elif job.classification_result is None:
+                    result = "fallback"
+                else:
+                    result = "batched"
+                SLOT_FILLING_BATCH_ITEMS.inc(dialogue_state=batch.dialogue_state, result=result)
+                job.done.set()
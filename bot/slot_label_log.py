@@ -0,0 +1,77 @@
+import json
+import threading
+import time
+
+
+class SlotLabelLog:
+    """
+    Class that appends the slot labels of the gpt api to a json lines file,
+    as training data of the local slot classifier (see
+    tools.train_slot_classifier).
+    - Each line holds the dialogue state, the last bot message, the user
+    message, the model and the label (0 or 1) of each slot to check.
+    - The texts are written in full (unlike the structured logs), so the file
+    must be handled like the conversation data.
+    """
+
+    def __init__(self, file_path: str):
+        """
+        Constructor of the SlotLabelLog class.
+
+        Args:
+            file_path (str): The path of the json lines file.
+        """
+
+        self.file_path = file_path
+        self.lock = threading.Lock()
+
+    def record(self, dialogue_state: str, last_bot_message: str, user_text: str, labels: dict, model: str):
+        """
+        Appends the labels of a turn.
+
+        Args:
+            dialogue_state (str): The dialogue state of the turn.
+            last_bot_message (str): The last bot message.
+            user_text (str): The user message.
+            labels (dict): The mapping of 0 or 1 for each slot to check.
+            model (str): The gpt model which produced the labels.
+        """
+
+        line = json.dumps({
+            "time": round(time.time(), 3),
+            "dialogue_state": dialogue_state,
+            "last_bot_message": last_bot_message,
+            "user_text": user_text,
+            "labels": labels,
+            "model": model,
+        }, ensure_ascii=False) + "\n"
+        with self.lock:
+            with open(self.file_path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+def read_slot_labels(file_paths: list) -> list:
+    """
+    Reads the slot labels of one or more label files.
+
+    Args:
+        file_paths (list): The paths of the json lines files.
+
+    Returns:
+        list: The label entries (lines which are not valid json are skipped,
+        e.g. a line which was cut off by a crash).
+    """
+
+    entries = []
+    for file_path in file_paths:
+        with open(file_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(entry, dict) and isinstance(entry.get("labels"), dict):
+                    entries.append(entry)
+    return entries
@@ -0,0 +1,253 @@
+import json
+
+
+# Output modes of the slot filling:
+# - json: a json object with 0 or 1 for each slot, requested by the prompt
+# only (parsed leniently by SlotFilling._extract_gpt_response)
+# - schema: the same json object, enforced by a json schema (structured
+# outputs of the gpt api)
+# - compact: a json object with the list of the filled slots only, e.g.
+# {"filled_slots": ["a", "c"]}, enforced by a json schema
+OUTPUT_MODES = ("json", "schema", "compact")
+
+COMPACT_OUTPUT_KEY = "filled_slots"
+
+# Keys of the output of a batch of turns (see SlotBatchOutputFormat)
+BATCH_ITEMS_KEY = "items"
+BATCH_ITEM_ID_KEY = "id"
+
+
+class SlotOutputFormat:
+    """
+    Class that represents the output format of the slot filling for a list of
+    slots to check (i.e. for a dialogue state) and an output mode.
+    - Provides the json schema and the response_format parameter of the gpt
+    api request (None in the json mode).
+    - Validates and parses a gpt response in the format (with checks which
+    are prepared once, so that a response is validated without a generic
+    json schema validator).
+    """
+
+    def __init__(self, slots_to_check: list, output_mode: str = "json"):
+        """
+        Constructor of the SlotOutputFormat class.
+
+        Args:
+            slots_to_check (list): The slots to check.
+            output_mode (str): The output mode ("json", "schema" or "compact").
+        """
+
+        if output_mode not in OUTPUT_MODES:
+            raise ValueError(f"Unknown slot filling output mode {output_mode}")
+        self.slots_to_check = list(slots_to_check)
+        self.slot_set = frozenset(slots_to_check)
+        self.output_mode = output_mode
+        self.schema = self._build_schema()
+        self.response_format = None
+        if self.schema is not None:
+            self.response_format = {
+                "type": "json_schema",
+                "json_schema": {"name": f"slot_filling_{output_mode}", "strict": True, "schema": self.schema},
+            }
+
+    def _build_schema(self) -> dict:
+        """
+        Builds the json schema of the output (in the subset supported by the
+        strict structured outputs of the gpt api).
+
+        Returns:
+            dict: The json schema, or None in the json mode.
+        """
+
+        if self.output_mode == "schema":
+            return {
+                "type": "object",
+                "properties": {slot_id: {"type": "integer", "enum": [0, 1]} for slot_id in self.slots_to_check},
+                "required": list(self.slots_to_check),
+                "additionalProperties": False,
+            }
+        if self.output_mode == "compact":
+            return {
+                "type": "object",
+                "properties": {
+                    COMPACT_OUTPUT_KEY: {"type": "array", "items": {"type": "string", "enum": list(self.slots_to_check)}}
+                },
+                "required": [COMPACT_OUTPUT_KEY],
+                "additionalProperties": False,
+            }
+        return None
+
+    def parse(self, gpt_response: str) -> dict:
+        """
+        Validates a gpt response and converts it to the classification result.
+
+        Args:
+            gpt_response (str): The gpt generated text.
+
+        Returns:
+            dict: The mapping of 0 or 1 for each slot to check, or None if the
+            response is not valid in the output format.
+        """
+
+        try:
+            parsed = json.loads(gpt_response)
+        except (TypeError, ValueError):
+            return None
+        return self.parse_object(parsed)
+
+    def parse_object(self, parsed) -> dict:
+        """
+        Validates a parsed gpt response (or an item of a batch response) and
+        converts it to the classification result.
+
+        Args:
+            parsed: The parsed json value.
+
+        Returns:
+            dict: The mapping of 0 or 1 for each slot to check, or None if the
+            value is not valid in the output format.
+        """
+
+        if not isinstance(parsed, dict):
+            return None
+
+        if self.output_mode == "compact":
+            filled_slots = parsed.get(COMPACT_OUTPUT_KEY)
+            if len(parsed) != 1 or not isinstance(filled_slots, list):
+                return None
+            if not all(isinstance(slot_id, str) and slot_id in self.slot_set for slot_id in filled_slots):
+                return None
+            return {slot_id: int(slot_id in filled_slots) for slot_id in self.slots_to_check}
+
+        # Json and schema mode: 0 or 1 for each slot (the json mode also
+        # accepts additional keys and numbers as strings)
+        if self.output_mode == "schema" and parsed.keys() != self.slot_set:
+            return None
+        classification_result = {}
+        for slot_id in self.slots_to_check:
+            value = parsed.get(slot_id)
+            if self.output_mode == "schema" and (isinstance(value, bool) or value not in (0, 1)):
+                return None
+            if str(value) not in ("0", "1"):
+                return None
+            classification_result[slot_id] = int(value)
+        return classification_result
+
+    def format_example(self, classification_result: dict) -> str:
+        """
+        Formats a classification result as example output of the prompt.
+
+        Args:
+            classification_result (dict): The mapping of 0 or 1 for each slot.
+
+        Returns:
+            str: The example output in string format.
+        """
+
+        if self.output_mode == "compact":
+            return json.dumps({COMPACT_OUTPUT_KEY: [slot_id for slot_id, value in classification_result.items() if value]})
+        return json.dumps(classification_result)
+
+
+class SlotBatchOutputFormat:
+    """
+    Class that represents the output format of the slot filling of a batch of
+    turns in the same dialogue state, e.g. {"items": [{"id": "1",
+    "filled_slots": ["a"]}, {"id": "2", "filled_slots": []}]} in the compact
+    output mode.
+    - Each item holds the id of its turn and the output of the turn in the
+    output format of a single turn.
+    - Items which are missing or invalid are left out of the parsed result,
+    so that only their turns need a single request.
+    """
+
+    def __init__(self, item_format: SlotOutputFormat):
+        """
+        Constructor of the SlotBatchOutputFormat class.
+
+        Args:
+            item_format (SlotOutputFormat): The output format of a single turn.
+        """
+
+        self.item_format = item_format
+        self.output_mode = item_format.output_mode
+        self.schema = None
+        self.response_format = None
+        if item_format.schema is not None:
+            item_schema = {
+                **item_format.schema,
+                "properties": {BATCH_ITEM_ID_KEY: {"type": "string"}, **item_format.schema["properties"]},
+                "required": [BATCH_ITEM_ID_KEY, *item_format.schema["required"]],
+            }
+            self.schema = {
+                "type": "object",
+                "properties": {BATCH_ITEMS_KEY: {"type": "array", "items": item_schema}},
+                "required": [BATCH_ITEMS_KEY],
+                "additionalProperties": False,
+            }
+            self.response_format = {
+                "type": "json_schema",
+                "json_schema": {"name": f"slot_filling_batch_{self.output_mode}", "strict": True, "schema": self.schema},
+            }
+
+    def parse(self, gpt_response: str, item_ids: list) -> dict:
+        """
+        Validates a gpt response of a batch and converts it to the
+        classification results of the items.
+
+        Args:
+            gpt_response (str): The gpt generated text.
+            item_ids (list): The ids of the items of the batch.
+
+        Returns:
+            dict: The classification result per item id (only the items which
+            are valid and unambiguous, i.e. whose id occurs once).
+        """
+
+        try:
+            parsed = json.loads(gpt_response)
+        except (TypeError, ValueError):
+            return {}
+        items = parsed.get(BATCH_ITEMS_KEY) if isinstance(parsed, dict) else None
+        if not isinstance(items, list):
+            return {}
+
+        expected_ids = set(item_ids)
+        results = {}
+        seen_ids = set()
+        duplicate_ids = set()
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            # The id may be any json value (e.g. an unhashable list or object)
+            item_id = item.get(BATCH_ITEM_ID_KEY)
+            if not isinstance(item_id, str) or item_id not in expected_ids:
+                continue
+            if item_id in seen_ids:
+                duplicate_ids.add(item_id)
+            seen_ids.add(item_id)
+            classification_result = self.item_format.parse_object(
+                {key: value for key, value in item.items() if key != BATCH_ITEM_ID_KEY})
+            if classification_result is not None:
+                results[item_id] = classification_result
+        for item_id in duplicate_ids:
+            results.pop(item_id, None)
+        return results
+
+    def format_example(self, classification_results: dict) -> str:
+        """
+        Formats classification results as example output of the prompt.
+
+        Args:
+            classification_results (dict): The mapping of 0 or 1 for each slot
+            per item id.
+
+        Returns:
+            str: The example output in string format.
+        """
+
+        items = []
+        for item_id, classification_result in classification_results.items():
+            item = json.loads(self.item_format.format_example(classification_result))
+            items.append({BATCH_ITEM_ID_KEY: item_id, **item})
+        return json.dumps({BATCH_ITEMS_KEY: items})
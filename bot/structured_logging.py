@@ -0,0 +1,250 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+
+
+# Loggers which write a record per request and only log warnings and errors
+QUIET_LOGGERS = ("aiohttp.access", "httpx", "openai")
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formatter that writes log records as json lines.
+    - Structured fields are passed with extra={"fields": {...}}.
+    - String fields are truncated, and fields listed as redacted are replaced,
+    so that the full user and bot texts do not end up in the logs.
+    """
+
+    def __init__(self, max_text_length: int = 200, redacted_fields: tuple = ()):
+        """
+        Constructor of the JsonLinesFormatter class.
+
+        Args:
+            max_text_length (int): The maximum length of string fields (0 for
+            no limit).
+            redacted_fields (tuple): The names of the fields whose values are
+            replaced by their length.
+        """
+
+        super().__init__()
+        self.max_text_length = max_text_length
+        self.redacted_fields = set(redacted_fields)
+
+    def _prepare_field(self, name: str, value):
+        """
+        Redacts or truncates the value of a field.
+
+        Args:
+            name (str): The name of the field.
+            value: The value of the field.
+
+        Returns:
+            The value to log.
+        """
+
+        if name in self.redacted_fields:
+            return f"[redacted, {len(str(value))} characters]"
+        if isinstance(value, str) and self.max_text_length and len(value) > self.max_text_length:
+            return value[:self.max_text_length] + "..."
+        return value
+
+    def format(self, record: logging.LogRecord) -> str:
+        """
+        Formats a log record as json line.
+
+        Args:
+            record (logging.LogRecord): The log record.
+
+        Returns:
+            str: The json line.
+        """
+
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name, value in (getattr(record, "fields", None) or {}).items():
+            entry[name] = self._prepare_field(name, value)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Filter that keeps only a fraction of the records below warning level.
+    Warnings and errors are always kept.
+    """
+
+    def __init__(self, sample_rate: float = 1.0):
+        """
+        Constructor of the SamplingFilter class.
+
+        Args:
+            sample_rate (float): The fraction of the records below warning
+            level to keep (0 to 1).
+        """
+
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Logging handler that hands the records over to a bounded queue, from which
+    a background thread writes them to the target handler, so that slow log
+    streams never block the event loop.
+    - Records are dropped (and counted) if the queue is full.
+    - The writer thread is started with the first record of each process, since
+    threads do not survive the fork of the worker processes.
+    """
+
+    def __init__(self, target: logging.Handler, max_queue_size: int = 10000):
+        """
+        Constructor of the NonBlockingQueueHandler class.
+
+        Args:
+            target (logging.Handler): The handler which writes the records (in
+            the background thread).
+            max_queue_size (int): The maximum number of records waiting to be
+            written.
+        """
+
+        super().__init__(queue.Queue(maxsize=max_queue_size))
+        self.target = target
+        self.max_queue_size = max_queue_size
+        self.listener = None
+        self.listener_pid = None
+        self.listener_lock = threading.Lock()
+        self.dropped_records = 0
+
+        # A forked process gets a new lock (the lock of the parent may have been
+        # held by another thread at the fork)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_listener_lock)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Prepares a record for the queue. Unlike the QueueHandler, the record is
+        not formatted here (formatting happens in the background thread), only
+        the message arguments and the exception are resolved.
+
+        Args:
+            record (logging.LogRecord): The log record.
+
+        Returns:
+            logging.LogRecord: The prepared record.
+        """
+
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        """
+        Puts a record into the queue or drops it if the queue is full.
+
+        Args:
+            record (logging.LogRecord): The prepared record.
+        """
+
+        if self.listener_pid != os.getpid():
+            with self.listener_lock:
+                # Checked again, as another thread may have started the listener
+                if self.listener_pid != os.getpid():
+                    self._start_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_records += 1
+
+    def _reset_listener_lock(self):
+        """
+        Replaces the lock of the listener in a forked process.
+        """
+
+        self.listener_lock = threading.Lock()
+
+    def _start_listener(self):
+        """
+        Starts the background thread which writes the queued records (called
+        while holding the lock of the listener).
+        """
+
+        if self.listener_pid is not None:
+            # Forked process: the queue and the thread of the parent are not usable
+            self.queue = queue.Queue(maxsize=self.max_queue_size)
+        self.listener_pid = os.getpid()
+        self.listener = logging.handlers.QueueListener(self.queue, self.target)
+        self.listener.start()
+
+    def close(self):
+        """
+        Writes the remaining records and stops the background thread.
+        """
+
+        if self.listener is not None and self.listener_pid == os.getpid():
+            try:
+                self.listener.stop()
+            except queue.Full:
+                pass
+            self.listener = None
+        super().close()
+
+
+def configure_logging(level: str = "INFO", sample_rate: float = 1.0, max_queue_size: int = 10000,
+                      max_text_length: int = 200, redacted_fields: tuple = (),
+                      quiet_loggers: tuple = QUIET_LOGGERS, stream=None) -> NonBlockingQueueHandler:
+    """
+    Configures the root logger to write json lines through a non-blocking
+    queue.
+    - The loggers which write a record per request (e.g. the access log of
+    aiohttp and the request log of httpx) only log warnings and errors, so
+    that they do not add records to every turn.
+
+    Args:
+        level (str): The minimum log level.
+        sample_rate (float): The fraction of the records below warning level
+        to keep.
+        max_queue_size (int): The maximum number of records waiting to be
+        written (further records are dropped).
+        max_text_length (int): The maximum length of string fields.
+        redacted_fields (tuple): The names of the fields whose values are not
+        logged.
+        quiet_loggers (tuple): The names of the loggers which only log
+        warnings and errors.
+        stream: The stream to write to (stdout by default).
+
+    Returns:
+        NonBlockingQueueHandler: The installed handler.
+    """
+
+    target = logging.StreamHandler(stream or sys.stdout)
+    target.setFormatter(JsonLinesFormatter(max_text_length, redacted_fields))
+    handler = NonBlockingQueueHandler(target, max_queue_size)
+    handler.addFilter(SamplingFilter(sample_rate))
+
+    root_logger = logging.getLogger()
+    for existing_handler in list(root_logger.handlers):
+        root_logger.removeHandler(existing_handler)
+    root_logger.addHandler(handler)
+    root_logger.setLevel(level)
+    for logger_name in quiet_loggers:
+        logging.getLogger(logger_name).setLevel(logging.WARNING)
+    atexit.register(handler.close)
+    return handler
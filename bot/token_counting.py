@@ -0,0 +1,99 @@
+import logging
+import threading
+
+# Optional local tokenizer of the gpt models, an estimate from the text length
+# is used as fallback
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+logger = logging.getLogger(__name__)
+
+# Tokenizer of the gpt-4o and gpt-4.1 models
+DEFAULT_ENCODING_NAME = "o200k_base"
+
+# Characters per token of the estimate (conservative for german texts)
+ESTIMATED_CHARACTERS_PER_TOKEN = 3
+
+
+class TokenCounter:
+    """
+    Class that counts and truncates texts in tokens of the gpt models.
+    - Uses tiktoken if it is installed and its encoding can be loaded (the
+    encoding files are downloaded on first use unless they are cached), and
+    otherwise estimates the tokens from the text length.
+    - The encoding is loaded on first use or with load().
+    """
+
+    def __init__(self, encoding_name: str = DEFAULT_ENCODING_NAME):
+        """
+        Constructor of the TokenCounter class.
+
+        Args:
+            encoding_name (str): The name of the tiktoken encoding.
+        """
+
+        self.encoding_name = encoding_name
+        self.encoding = None
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        Loads the encoding (once). Falls back to the estimate if tiktoken is
+        not installed or the encoding cannot be loaded.
+        """
+
+        if self.loaded:
+            return
+        with self.lock:
+            if self.loaded:
+                return
+            if tiktoken is not None:
+                try:
+                    self.encoding = tiktoken.get_encoding(self.encoding_name)
+                except Exception as e:
+                    logger.warning("Tokenizer %s could not be loaded, token counts are estimated: %r",
+                                   self.encoding_name, e)
+            self.loaded = True
+
+    def count(self, text: str) -> int:
+        """
+        Counts the tokens of a text.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            int: The number of tokens.
+        """
+
+        self.load()
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return -(-len(text) // ESTIMATED_CHARACTERS_PER_TOKEN)
+
+    def truncate_start(self, text: str, max_tokens: int) -> str:
+        """
+        Shortens a text to its last max_tokens tokens (removes the beginning).
+
+        Args:
+            text (str): The text.
+            max_tokens (int): The maximum number of tokens.
+
+        Returns:
+            str: The end of the text.
+        """
+
+        self.load()
+        if max_tokens <= 0:
+            return ""
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            if len(tokens) <= max_tokens:
+                return text
+            # Remove a character which was split at the cut
+            return self.encoding.decode(tokens[-max_tokens:]).lstrip("�")
+        return text[-max_tokens * ESTIMATED_CHARACTERS_PER_TOKEN:]
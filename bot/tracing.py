@@ -0,0 +1,391 @@
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import Dict, List
+
+from botbuilder.core import Storage
+
+
+logger = logging.getLogger(__name__)
+
+
+# The span which is currently open in this context (None outside of sampled
+# traces, which makes all spans of unsampled turns no-ops)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    Class that represents a timed operation within a trace.
+    """
+
+    def __init__(self, name: str, trace_id: str, parent: "Span" = None, attributes: dict = None):
+        """
+        Constructor of the Span class.
+
+        Args:
+            name (str): The name of the operation.
+            trace_id (str): The id of the trace (32 hex characters).
+            parent (Span): The parent span, or None for the root span.
+            attributes (dict): The initial attributes.
+        """
+
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        # The finished spans of the trace are collected in the list of the root
+        self.trace_spans = parent.trace_spans if parent is not None else []
+        self.attributes = {key: value for key, value in (attributes or {}).items() if value is not None}
+        self.error = None
+        self.start_time = time.time_ns()
+        self.end_time = None
+
+    def set_attribute(self, key: str, value):
+        """
+        Sets an attribute of the span.
+
+        Args:
+            key (str): The name of the attribute.
+            value: The value (str, int, float or bool).
+        """
+
+        if value is not None:
+            self.attributes[key] = value
+
+    def end(self):
+        """
+        Ends the span and adds it to the finished spans of its trace.
+        """
+
+        self.end_time = time.time_ns()
+        self.trace_spans.append(self)
+
+    def to_otlp(self) -> dict:
+        """
+        Converts the span to the OTLP json format.
+
+        Returns:
+            dict: The span in the OTLP json format.
+        """
+
+        otlp_span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_time),
+            "endTimeUnixNano": str(self.end_time),
+            "attributes": [_to_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id is not None:
+            otlp_span["parentSpanId"] = self.parent_id
+        return otlp_span
+
+
+def _to_otlp_attribute(key: str, value) -> dict:
+    """
+    Converts an attribute to the OTLP json format.
+
+    Args:
+        key (str): The name of the attribute.
+        value: The value of the attribute.
+
+    Returns:
+        dict: The attribute in the OTLP json format.
+    """
+
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class FileSpanExporter:
+    """
+    Class that appends finished traces to a local file (one OTLP json document
+    per line).
+    """
+
+    def __init__(self, file_path: str):
+        """
+        Constructor of the FileSpanExporter class.
+
+        Args:
+            file_path (str): The path of the trace file.
+        """
+
+        self.file_path = file_path
+
+    def export(self, document: dict):
+        """
+        Writes a trace.
+
+        Args:
+            document (dict): The trace as OTLP json document.
+        """
+
+        with open(self.file_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(document) + "\n")
+
+
+class OtlpHttpSpanExporter:
+    """
+    Class that sends finished traces to an OTLP/HTTP collector (json encoding),
+    e.g. http://localhost:4318/v1/traces.
+    """
+
+    def __init__(self, endpoint: str, timeout: float = 5.0):
+        """
+        Constructor of the OtlpHttpSpanExporter class.
+
+        Args:
+            endpoint (str): The url of the traces endpoint of the collector.
+            timeout (float): The timeout of a request in seconds.
+        """
+
+        self.endpoint = endpoint
+        self.timeout = timeout
+
+    def export(self, document: dict):
+        """
+        Sends a trace.
+
+        Args:
+            document (dict): The trace as OTLP json document.
+        """
+
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(document).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class Tracer:
+    """
+    Class that samples turns for tracing and exports the finished traces.
+    - The sampling decision is made once at the root span of a trace. Spans
+    outside of sampled traces are no-ops, so tracing costs a context variable
+    lookup per span for unsampled turns.
+    - Finished traces are exported by a background thread, so that slow files
+    or collectors never block the event loop (traces are dropped if the export
+    queue is full). The thread is started with the first trace of each
+    process, since threads do not survive the fork of the worker processes.
+    """
+
+    def __init__(self):
+        """
+        Constructor of the Tracer class. Tracing is disabled until it is
+        configured.
+        """
+
+        self.sample_rate = 0.0
+        self.service_name = "bot"
+        self.exporter = None
+        self.max_queue_size = 1000
+        self.export_queue = None
+        self.export_pid = None
+
+    def configure(self, sample_rate: float, exporter, service_name: str = "bot", max_queue_size: int = 1000):
+        """
+        Enables tracing.
+
+        Args:
+            sample_rate (float): The fraction of the turns to trace (0 to 1).
+            exporter: The exporter of the finished traces (FileSpanExporter or
+            OtlpHttpSpanExporter).
+            service_name (str): The service name attached to the traces.
+            max_queue_size (int): The maximum number of traces waiting for the
+            export.
+        """
+
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+        self.service_name = service_name
+        self.max_queue_size = max_queue_size
+
+    def should_sample(self) -> bool:
+        """
+        Decides whether a new trace is recorded.
+
+        Returns:
+            bool: Whether to record the trace.
+        """
+
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def finish_trace(self, spans: List[Span]):
+        """
+        Hands the spans of a finished trace over to the export thread.
+
+        Args:
+            spans (List[Span]): The finished spans.
+        """
+
+        document = {
+            "resourceSpans": [{
+                "resource": {"attributes": [_to_otlp_attribute("service.name", self.service_name)]},
+                "scopeSpans": [{"scope": {"name": "bot"}, "spans": [span.to_otlp() for span in spans]}],
+            }]
+        }
+        if self.export_pid != os.getpid():
+            self.export_pid = os.getpid()
+            self.export_queue = queue.Queue(maxsize=self.max_queue_size)
+            threading.Thread(target=self._export_worker, args=(self.export_queue,), name="trace-exporter",
+                             daemon=True).start()
+        try:
+            self.export_queue.put_nowait(document)
+        except queue.Full:
+            pass
+
+    def _export_worker(self, export_queue: queue.Queue):
+        """
+        Exports the finished traces (runs in the export thread).
+
+        Args:
+            export_queue (queue.Queue): The queue of the finished traces.
+        """
+
+        while True:
+            document = export_queue.get()
+            try:
+                self.exporter.export(document)
+            except Exception as error:
+                logger.warning(f"Exporting a trace failed: {error}")
+
+
+# Tracer of the process
+tracer = Tracer()
+
+
+@contextmanager
+def _open_span(name: str, trace_id: str, parent: Span, attributes: dict):
+    """
+    Opens a span as the current span of the context.
+
+    Args:
+        name (str): The name of the operation.
+        trace_id (str): The id of the trace.
+        parent (Span): The parent span, or None for the root span.
+        attributes (dict): The initial attributes.
+
+    Yields:
+        Span: The open span.
+    """
+
+    current_span = Span(name, trace_id, parent, attributes)
+    token = _current_span.set(current_span)
+    try:
+        yield current_span
+    except BaseException as error:
+        current_span.error = f"{type(error).__name__}: {error}"
+        raise
+    finally:
+        _current_span.reset(token)
+        current_span.end()
+        if parent is None:
+            tracer.finish_trace(current_span.trace_spans)
+
+
+@contextmanager
+def trace(name: str, **attributes):
+    """
+    Starts a new trace if the turn is sampled (or opens a child span if a trace
+    is already running in this context).
+
+    Args:
+        name (str): The name of the root operation.
+        **attributes: The attributes of the span, e.g. conversation_id.
+
+    Yields:
+        Span: The open span, or None if the turn is not traced.
+    """
+
+    parent = _current_span.get()
+    if parent is not None:
+        with _open_span(name, parent.trace_id, parent, attributes) as current_span:
+            yield current_span
+    elif tracer.should_sample():
+        with _open_span(name, os.urandom(16).hex(), None, attributes) as current_span:
+            yield current_span
+    else:
+        yield None
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Opens a child span of the current span. Does nothing outside of traces.
+
+    Args:
+        name (str): The name of the operation.
+        **attributes: The attributes of the span.
+
+    Yields:
+        Span: The open span, or None if the turn is not traced.
+    """
+
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    with _open_span(name, parent.trace_id, parent, attributes) as current_span:
+        yield current_span
+
+
+def set_attributes(**attributes):
+    """
+    Sets attributes of the current span. Does nothing outside of traces.
+
+    Args:
+        **attributes: The attributes to set.
+    """
+
+    current_span = _current_span.get()
+    if current_span is not None:
+        for key, value in attributes.items():
+            current_span.set_attribute(key, value)
+
+
+class TracedStorage(Storage):
+    """
+    Storage wrapper which records the reads and writes of the conversation
+    state as spans.
+    """
+
+    def __init__(self, storage: Storage):
+        """
+        Constructor of the TracedStorage class.
+
+        Args:
+            storage (Storage): The wrapped storage.
+        """
+
+        self.storage = storage
+
+    async def read(self, keys: List[str]) -> Dict[str, object]:
+        with span("storage_read", keys=len(keys)):
+            return await self.storage.read(keys)
+
+    async def write(self, changes: Dict[str, object]):
+        with span("storage_write", keys=len(changes)):
+            return await self.storage.write(changes)
+
+    async def delete(self, keys: List[str]):
+        with span("storage_delete", keys=len(keys)):
+            return await self.storage.delete(keys)
@@ -8,3 +8,4 @@ class DefaultConfig:
     PORT = int(os.environ.get("PORT", 3978))
     APP_ID = os.environ.get("MICROSOFT_APP_ID", "")
     APP_PASSWORD = os.environ.get("MICROSOFT_APP_PASSWORD", "")
+    ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
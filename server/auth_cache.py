@@ -0,0 +1,212 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from botbuilder.core import BotFrameworkAdapter
+from botbuilder.schema import Activity
+from botframework.connector.auth import AuthenticationConstants, ChannelValidation, ClaimsIdentity, JwtTokenExtractor
+
+from bot import instrumentation
+from server.token_utils import get_token_expiry
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenValidationCache:
+    """
+    Class that caches the identities of already validated inbound Bot
+    Framework tokens, so that repeated requests with the same token skip the
+    signature verification and the OpenID metadata lookup.
+    - The cache key is the hash of the authorization header together with the
+    channel id and the service url of the activity, since the validation also
+    checks the channel endorsements and the serviceUrl claim.
+    - Entries are kept until the exp claim of the token (minus a clock skew
+    margin) and the cache is bounded (least recently used entries are evicted).
+    - Failed validations are never cached.
+    - The signing keys (OpenID metadata) are refreshed in the background before
+    they become stale, since the Bot Framework refreshes them with blocking
+    http requests inside the event loop.
+    """
+
+    def __init__(self, max_entries: int = 10000, clock_skew: float = 300.0, max_key_age: float = 43200.0,
+                 key_refresh_interval: float = 3600.0):
+        """
+        Constructor of the TokenValidationCache class.
+
+        Args:
+            max_entries (int): The maximum number of cached tokens.
+            clock_skew (float): The time in seconds before the expiry of a
+            token after which it is validated again.
+            max_key_age (float): The age in seconds after which the signing
+            keys are refreshed in the background (the Bot Framework refreshes
+            them itself after one day).
+            key_refresh_interval (float): The interval in seconds in which the
+            age of the signing keys is checked.
+        """
+
+        self.max_entries = max_entries
+        self.clock_skew = clock_skew
+        self.max_key_age = max_key_age
+        self.key_refresh_interval = key_refresh_interval
+        self.entries = OrderedDict()
+        self.refresh_task = None
+
+    def _get_key(self, activity: Activity, auth_header: str) -> str:
+        """
+        Builds the cache key of a request.
+
+        Args:
+            activity (Activity): The incoming activity.
+            auth_header (str): The authorization header of the request.
+
+        Returns:
+            str: The cache key.
+        """
+
+        key = f"{auth_header}\n{activity.channel_id}\n{activity.service_url}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, activity: Activity, auth_header: str) -> ClaimsIdentity:
+        """
+        Looks up the identity of an already validated token.
+
+        Args:
+            activity (Activity): The incoming activity.
+            auth_header (str): The authorization header of the request.
+
+        Returns:
+            ClaimsIdentity: The cached identity, or None if the token has not
+            been validated yet or is about to expire.
+        """
+
+        key = self._get_key(activity, auth_header)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        identity, expires_at = entry
+        if time.time() >= expires_at:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return identity
+
+    def put(self, activity: Activity, auth_header: str, identity: ClaimsIdentity):
+        """
+        Stores the identity of a successfully validated token.
+        - Tokens without readable exp claim are not cached.
+
+        Args:
+            activity (Activity): The incoming activity.
+            auth_header (str): The authorization header of the request.
+            identity (ClaimsIdentity): The identity returned by the validation.
+        """
+
+        expiry = get_token_expiry(auth_header.split(" ")[-1])
+        if expiry is None or expiry - self.clock_skew <= time.time():
+            return
+        key = self._get_key(activity, auth_header)
+        self.entries[key] = (identity, expiry - self.clock_skew)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def attach(self, adapter: BotFrameworkAdapter):
+        """
+        Lets an adapter validate inbound requests through the cache (used by
+        process_activity as well as by the turn queue).
+
+        Args:
+            adapter (BotFrameworkAdapter): The adapter of the bot.
+        """
+
+        authenticate_request = adapter._authenticate_request
+
+        async def cached_authenticate_request(activity: Activity, auth_header: str) -> ClaimsIdentity:
+            with instrumentation.stage("auth", variant="validated") as auth_stage:
+                if not auth_header:
+                    return await authenticate_request(activity, auth_header)
+                identity = self.get(activity, auth_header)
+                if identity is not None:
+                    auth_stage.variant = "cache_hit"
+                    return identity
+                identity = await authenticate_request(activity, auth_header)
+                if identity is not None and identity.is_authenticated:
+                    self.put(activity, auth_header, identity)
+                return identity
+
+        adapter._authenticate_request = cached_authenticate_request
+
+    def start_key_refresh(self):
+        """
+        Starts the background refresh of the signing keys within the running
+        event loop.
+        """
+
+        # Register the metadata of the public cloud channels, so that their
+        # keys are loaded before the first request arrives
+        JwtTokenExtractor.get_open_id_metadata(
+            ChannelValidation.open_id_metadata_endpoint
+            or AuthenticationConstants.TO_BOT_FROM_CHANNEL_OPENID_METADATA_URL
+        )
+        JwtTokenExtractor.get_open_id_metadata(AuthenticationConstants.TO_BOT_FROM_EMULATOR_OPENID_METADATA_URL)
+        self.refresh_task = asyncio.create_task(self._refresh_keys_periodically())
+
+    async def stop_key_refresh(self):
+        """
+        Stops the background refresh of the signing keys.
+        """
+
+        if self.refresh_task is not None:
+            self.refresh_task.cancel()
+            await asyncio.gather(self.refresh_task, return_exceptions=True)
+            self.refresh_task = None
+
+    async def _refresh_keys_periodically(self):
+        """
+        Refreshes all signing keys which are older than the maximum key age.
+        """
+
+        while True:
+            stale_before = datetime.now() - timedelta(seconds=self.max_key_age)
+            for metadata in list(JwtTokenExtractor.metadataCache.values()):
+                if metadata.last_updated < stale_before:
+                    try:
+                        await asyncio.to_thread(self._refresh_metadata, metadata)
+                    except Exception as error:
+                        logger.warning(f"Refreshing the signing keys of {metadata.url} failed: {error}")
+            await asyncio.sleep(self.key_refresh_interval)
+
+    @staticmethod
+    def _refresh_metadata(metadata):
+        """
+        Refreshes OpenID metadata in a worker thread (the refresh of the Bot
+        Framework is a coroutine, but performs blocking http requests).
+
+        Args:
+            metadata (_OpenIdMetadata): The OpenID metadata of the Bot
+            Framework.
+        """
+
+        asyncio.run(metadata._refresh())
+
+
+def instrument_authentication(adapter: BotFrameworkAdapter):
+    """
+    Records the duration of the request authentication of an adapter without
+    token cache as the auth stage of the turn metrics.
+
+    Args:
+        adapter (BotFrameworkAdapter): The adapter of the bot.
+    """
+
+    authenticate_request = adapter._authenticate_request
+
+    async def timed_authenticate_request(activity: Activity, auth_header: str) -> ClaimsIdentity:
+        with instrumentation.stage("auth", variant="validated"):
+            return await authenticate_request(activity, auth_header)
+
+    adapter._authenticate_request = timed_authenticate_request
@@ -0,0 +1,309 @@
+import asyncio
+import functools
+import time
+from typing import Dict
+
+import aiohttp
+from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings
+from botbuilder.core.bot_framework_adapter import USER_AGENT
+from botframework.connector.aio import ConnectorClient
+from botframework.connector.auth import AppCredentials, AuthenticationConstants, MicrosoftAppCredentials
+from msrest.pipeline import AsyncHTTPPolicy, AsyncPipeline
+from msrest.pipeline.aiohttp import AioHTTPSender
+from msrest.pipeline.universal import RawDeserializer
+from msrest.universal_http import ClientRequest
+from msrest.universal_http.aiohttp import AioHTTPSender as AioHTTPSenderDriver, AioHttpClientResponse
+
+from server.token_utils import get_token_expiry
+
+
+class CachedAppToken:
+    """
+    Class that caches the access token of app credentials and refreshes it 
+    in the background ahead of its expiry.
+    """
+
+    def __init__(self, credentials: AppCredentials, refresh_margin: float = 300.0, default_lifetime: float = 3000.0):
+        """
+        Constructor of the CachedAppToken class.
+
+        Args:
+            credentials (AppCredentials): The app credentials to fetch tokens 
+            with.
+            refresh_margin (float): The time in seconds before the expiry at 
+            which the token is refreshed in the background.
+            default_lifetime (float): The assumed lifetime in seconds of tokens 
+            without a readable expiry time.
+        """
+
+        self.credentials = credentials
+        self.refresh_margin = refresh_margin
+        self.default_lifetime = default_lifetime
+        self.token = None
+        self.expires_at = 0.0
+        self.refresh_task = None
+
+    def requires_token(self) -> bool:
+        """
+        Checks whether the credentials need a token at all (not the case in 
+        the unauthenticated scenario without app id).
+
+        Returns:
+            bool: True if requests must carry a token.
+        """
+
+        app_id = self.credentials.microsoft_app_id
+        return bool(app_id) and app_id != AuthenticationConstants.ANONYMOUS_SKILL_APP_ID
+
+    async def get_token(self) -> str:
+        """
+        Returns the cached token.
+        - Fetches a new token if there is no valid token (only once for 
+        concurrent callers).
+        - Starts a background refresh if the token expires within the refresh 
+        margin.
+
+        Returns:
+            str: The access token.
+        """
+
+        now = time.time()
+        if self.token is None or now >= self.expires_at:
+            # Concurrent requests wait for the same token request
+            if self.refresh_task is None:
+                self.refresh_task = asyncio.create_task(self._refresh())
+            await asyncio.shield(self.refresh_task)
+        elif now >= self.expires_at - self.refresh_margin and self.refresh_task is None:
+            self.refresh_task = asyncio.create_task(self._refresh())
+        return self.token
+
+    async def _refresh(self):
+        """
+        Fetches a new token in a worker thread (the token request of the 
+        credentials is synchronous).
+        """
+
+        try:
+            token = await asyncio.to_thread(self.credentials.get_access_token, True)
+            self.token = token
+            self.expires_at = get_token_expiry(token) or time.time() + self.default_lifetime
+        finally:
+            self.refresh_task = None
+
+
+class CachedTokenPolicy(AsyncHTTPPolicy):
+    """
+    Pipeline policy that adds the cached access token to outgoing requests.
+    """
+
+    def __init__(self, cached_token: CachedAppToken):
+        """
+        Constructor of the CachedTokenPolicy class.
+
+        Args:
+            cached_token (CachedAppToken): The cached token of the credentials.
+        """
+
+        super().__init__()
+        self.cached_token = cached_token
+
+    async def send(self, request, **kwargs):
+        if self.cached_token.requires_token():
+            token = await self.cached_token.get_token()
+            request.http_request.headers["Authorization"] = f"Bearer {token}"
+        return await self.next.send(request, **kwargs)
+
+
+class PooledSessionDriver(AioHTTPSenderDriver):
+    """
+    Http driver of the connector client that sends requests through a shared 
+    aiohttp session instead of creating its own one.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession):
+        self._session = session
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_details):
+        # The shared session is closed by the PooledConnectorAdapter
+        pass
+
+    async def send(self, request: ClientRequest, **config) -> AioHttpClientResponse:
+        """
+        Sends a request of the connector client through the shared session.
+
+        Args:
+            request (ClientRequest): The request to send.
+
+        Returns:
+            AioHttpClientResponse: The response with the loaded body.
+        """
+
+        result = await self._session.request(
+            request.method,
+            request.url,
+            headers=request.headers,
+            data=request.data,
+            **config
+        )
+        response = AioHttpClientResponse(request, result)
+        await response.load_body()
+        return response
+
+
+class PooledPipeline(AsyncPipeline):
+    """
+    Pipeline of the connector client using the pooled session and the cached 
+    access token.
+    """
+
+    def __init__(self, config, session: aiohttp.ClientSession, cached_token: CachedAppToken):
+        policies = [
+            config.user_agent_policy,
+            CachedTokenPolicy(cached_token),
+            RawDeserializer(),
+            config.http_logger_policy,
+        ]
+        super().__init__(policies, AioHTTPSender(PooledSessionDriver(session)))
+
+
+class PooledConnectorAdapter(BotFrameworkAdapter):
+    """
+    Extension of the BotFrameworkAdapter which sends the replies through a 
+    shared, pooled http session per service url and caches the access token 
+    of the app credentials, so that the reply path does not pay for tls 
+    handshakes and token lookups on every turn.
+    """
+
+    def __init__(
+        self,
+        settings: BotFrameworkAdapterSettings,
+        limit_per_host: int = 100,
+        keepalive_timeout: float = 60.0,
+        token_refresh_margin: float = 300.0
+    ):
+        """
+        Constructor of the PooledConnectorAdapter class. Inherits from the 
+        BotFrameworkAdapter class.
+
+        Args:
+            settings (BotFrameworkAdapterSettings): The adapter settings.
+            limit_per_host (int): The maximum number of connections per 
+            service url.
+            keepalive_timeout (float): The time in seconds idle connections are 
+            kept open.
+            token_refresh_margin (float): The time in seconds before the expiry 
+            of an access token at which it is refreshed in the background.
+        """
+
+        super().__init__(settings)
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.token_refresh_margin = token_refresh_margin
+        self.sessions: Dict[str, aiohttp.ClientSession] = {}
+        self.cached_tokens: Dict[str, CachedAppToken] = {}
+
+    def _get_session(self, service_url: str) -> aiohttp.ClientSession:
+        """
+        Returns the shared http session of a service url.
+
+        Args:
+            service_url (str): The service url.
+
+        Returns:
+            aiohttp.ClientSession: The shared session.
+        """
+
+        session = self.sessions.get(service_url)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300
+            )
+            session = aiohttp.ClientSession(connector=connector)
+            self.sessions[service_url] = session
+        return session
+
+    def _get_cached_token(self, credentials: AppCredentials) -> CachedAppToken:
+        """
+        Returns the cached token of app credentials.
+
+        Args:
+            credentials (AppCredentials): The app credentials.
+
+        Returns:
+            CachedAppToken: The cached token.
+        """
+
+        key = BotFrameworkAdapter.key_for_app_credentials(credentials.microsoft_app_id, credentials.oauth_scope)
+        cached_token = self.cached_tokens.get(key)
+        if cached_token is None:
+            cached_token = CachedAppToken(credentials, self.token_refresh_margin)
+            self.cached_tokens[key] = cached_token
+        return cached_token
+
+    def _get_or_create_connector_client(self, service_url: str, credentials: AppCredentials) -> ConnectorClient:
+        """
+        Overwrites the method of the parent class BotFrameworkAdapter to 
+        create connector clients which use the pooled session and the cached 
+        access token.
+
+        Args:
+            service_url (str): The service url of the channel.
+            credentials (AppCredentials): The app credentials.
+
+        Returns:
+            ConnectorClient: The connector client.
+        """
+
+        if not credentials:
+            credentials = MicrosoftAppCredentials.empty()
+
+        client_key = BotFrameworkAdapter.key_for_connector_client(
+            service_url, credentials.microsoft_app_id, credentials.oauth_scope
+        )
+        client = self._connector_client_cache.get(client_key)
+        if not client:
+            pipeline_type = functools.partial(
+                PooledPipeline,
+                session=self._get_session(service_url),
+                cached_token=self._get_cached_token(credentials)
+            )
+            client = ConnectorClient(credentials, base_url=service_url, pipeline_type=pipeline_type)
+            client.config.add_user_agent(USER_AGENT)
+            self._connector_client_cache[client_key] = client
+        return client
+
+    async def prefetch_token(self, app_id: str, app_password: str):
+        """
+        Fetches the access token for the replies to the channels ahead of the 
+        first turn (e.g. in the startup warm-up). Uses the oauth scope of the 
+        replies to channels of the public cloud.
+
+        Args:
+            app_id (str): The app id of the bot (nothing is fetched without).
+            app_password (str): The app password of the bot.
+        """
+
+        if not app_id:
+            return
+        credentials = MicrosoftAppCredentials(
+            app_id, app_password, oauth_scope=AuthenticationConstants.TO_CHANNEL_FROM_BOT_OAUTH_SCOPE
+        )
+        cached_token = self._get_cached_token(credentials)
+        if cached_token.requires_token():
+            await cached_token.get_token()
+
+    async def close_sessions(self):
+        """
+        Closes all shared http sessions and drops the connector clients using 
+        them.
+        """
+
+        for session in self.sessions.values():
+            await session.close()
+        self.sessions = {}
+        self._connector_client_cache.clear()
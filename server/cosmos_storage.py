@@ -0,0 +1,65 @@
+import asyncio
+from typing import Dict
+
+from azure.cosmos.exceptions import CosmosAccessConditionFailedError
+from botbuilder.azure import CosmosDbPartitionedStorage, CosmosDbPartitionedConfig
+
+
+class RetryCosmosDbPartitionedStorage(CosmosDbPartitionedStorage):
+    """
+    Extension of the Botbuilder Storage, which undertakes automatic retries 
+    at PreconditionFailed errors with the database. 
+    """
+
+    def __init__(
+        self,
+        config: CosmosDbPartitionedConfig,
+        max_retries: int = 3,
+        retry_delay: float = 0.5
+    ):
+        """
+        Constructor of the RetryCosmosDbPartitionedStorage class. Inherits from
+        the CosmosDbPartitionedStorage class.
+
+        Args: 
+            config (CosmosDbPartitionedConfig): The config class instance for 
+            the cosmos db database.
+            max_retries (int): The maximum number of retries when an error 
+            with the internal database occurs.
+            retry_delay (float): The delay before a new retry of the database
+            operation.
+        """
+
+        super().__init__(config)
+        self.max_retries = max_retries 
+        self.retry_delay = retry_delay 
+
+    async def write(self, changes: Dict[str, object]):
+        """
+        Overwrites the write method of the parent class 
+        CosmosDbPartitionedStorage to retry failed database operations.
+
+        This method attempts to write a set of changes to the Cosmos DB
+        partitioned storage. If a write operation fails due to a 
+        PreconditionFailed (i.e., a concurrency conflict), it will 
+        automatically retry the operation up to the maximum number of retries 
+        specified in the constructor.
+
+        Args: 
+            changes (Dict[str, object]): A dictionary of key-value pairs 
+            representing items to be written to the storage. 
+        """
+        
+        attempt = 0
+        while True:
+            try:
+                # Invoke the orignial implementation from 
+                # CosmosDbPartitionedStorage
+                return await super().write(changes)
+            except CosmosAccessConditionFailedError as e:
+                attempt += 1
+                if attempt >= self.max_retries:
+                    # If all retries are exhausted, pass on the error
+                    raise e
+                # Wait a short time an try the databse operation again
+                await asyncio.sleep(self.retry_delay)
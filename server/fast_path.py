@@ -0,0 +1,145 @@
+import asyncio
+import json
+import sys
+
+from aiohttp.web import Response
+
+# Optional fast implementations, the standard library is used as fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+
+# Whether orjson is used for the request parsing and the responses
+_use_orjson = False
+
+
+def install_event_loop(use_uvloop: bool = True) -> str:
+    """
+    Installs uvloop as the event loop policy if it is available and enabled.
+    - Must be called before the event loop of the app is created.
+
+    Args:
+        use_uvloop (bool): Whether uvloop should be used.
+
+    Returns:
+        str: The name of the event loop implementation in use.
+    """
+
+    if use_uvloop and uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        return "uvloop"
+    asyncio.set_event_loop_policy(None)
+    return "asyncio"
+
+
+def install_json_codec(use_orjson: bool = True) -> str:
+    """
+    Selects orjson for the request parsing, the responses and the state
+    serialization if it is available and enabled.
+
+    Args:
+        use_orjson (bool): Whether orjson should be used.
+
+    Returns:
+        str: The name of the json codec in use.
+    """
+
+    global _use_orjson
+    _use_orjson = use_orjson and orjson is not None
+    # The Cosmos DB client is not imported for this (it is only imported if 
+    # the cosmos db storage is used, which calls install_storage_codec)
+    if "azure.cosmos" in sys.modules:
+        install_storage_codec()
+    if _use_orjson:
+        return "orjson"
+    return "json"
+
+
+def loads(data):
+    """
+    Parses a json document.
+
+    Args:
+        data (bytes/str): The json document.
+
+    Returns:
+        The parsed json document.
+    """
+
+    if _use_orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj) -> bytes:
+    """
+    Serializes an object to a json document.
+    - Falls back to the standard library for objects orjson cannot serialize.
+
+    Args:
+        obj: The object to serialize.
+
+    Returns:
+        bytes: The utf-8 encoded json document.
+    """
+
+    if _use_orjson:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass
+    return json.dumps(obj).encode("utf-8")
+
+
+def json_response(data, status: int = 200) -> Response:
+    """
+    Creates an aiohttp json response using the selected json codec.
+
+    Args:
+        data: The data to send as json.
+        status (int): The http status code.
+
+    Returns:
+        Response: The aiohttp response.
+    """
+
+    return Response(body=dumps(data), status=status, content_type="application/json")
+
+
+class _StorageJsonCodec:
+    """
+    Json module replacement for the Cosmos DB client, which parses the
+    responses (the stored conversation state) with orjson.
+    - Serialization stays with the standard library, since the Cosmos DB
+    client derives the Content-Length header from the length of the string,
+    which is only correct for the ascii escaped output of json.dumps.
+    """
+
+    @staticmethod
+    def dumps(obj, **kwargs) -> str:
+        return json.dumps(obj, **kwargs)
+
+    @staticmethod
+    def loads(data, **kwargs):
+        return orjson.loads(data)
+
+
+def install_storage_codec():
+    """
+    Lets the Cosmos DB client use orjson for parsing the stored state if 
+    orjson is selected (or restores the standard library).
+    """
+
+    try:
+        from azure.cosmos import _synchronized_request
+    except ImportError:
+        return
+    if getattr(_synchronized_request, "json", None) in (json, _StorageJsonCodec):
+        _synchronized_request.json = _StorageJsonCodec if _use_orjson else json
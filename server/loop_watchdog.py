@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import os
+import selectors
+import sys
+import threading
+import time
+import traceback
+
+from bot.metrics import registry
+
+
+logger = logging.getLogger(__name__)
+
+# Modules of the event loop itself (a loop thread caught in these is polling or
+# doing non-blocking socket i/o, so it is delayed by other threads holding the
+# GIL rather than blocked by a handler)
+LOOP_INTERNAL_FILES = {
+    os.path.normcase(os.path.abspath(selectors.__file__)),
+    os.path.normcase(os.path.abspath(asyncio.selector_events.__file__)),
+}
+
+# Metrics of the event loop
+EVENT_LOOP_LAG = registry.histogram(
+    "bot_event_loop_lag_seconds",
+    "Delay of the event loop in waking up a periodic timer.",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+EVENT_LOOP_BLOCKS = registry.counter(
+    "bot_event_loop_blocks_total",
+    "Number of times the event loop was blocked longer than the threshold, by "
+    "cause (blocking code on the loop or a delay by other threads holding the GIL).",
+    ("cause",)
+)
+
+
+class BlockedLoopReport:
+    """
+    Class that represents a detected blocking of the event loop.
+    """
+
+    def __init__(self, duration: float, stack: str, in_loop_internals: bool = False):
+        """
+        Constructor of the BlockedLoopReport class.
+
+        Args:
+            duration (float): How long the loop had been blocked when the stack
+            was captured (in seconds).
+            stack (str): The stack of the event loop thread at that time.
+            in_loop_internals (bool): Whether the loop thread was inside the
+            selector or its non-blocking socket calls (i.e. waiting for the
+            GIL instead of running blocking code).
+        """
+
+        self.duration = duration
+        self.stack = stack
+        self.in_loop_internals = in_loop_internals
+
+
+class LoopWatchdog:
+    """
+    Class that measures the lag of the event loop continuously and captures
+    the stack of the event loop thread when it is blocked (e.g. by synchronous
+    i/o in a handler).
+    - A periodic task on the loop records the lag of its timer as a metric and
+    updates a heartbeat.
+    - A watchdog thread checks the heartbeat. If the loop has not run for
+    longer than the block threshold, the stack of the loop thread is captured
+    and logged once per blocking (at debug level if the loop thread was only
+    waiting for the GIL).
+    """
+
+    def __init__(self, interval: float = 0.1, block_threshold: float = 0.1, max_reports: int = 100):
+        """
+        Constructor of the LoopWatchdog class.
+
+        Args:
+            interval (float): The interval of the lag measurement in seconds.
+            block_threshold (float): The time in seconds the loop must be
+            blocked before its stack is captured.
+            max_reports (int): The maximum number of kept reports.
+        """
+
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.max_reports = max_reports
+        self.reports = []
+        self.max_lag = 0.0
+        self.heartbeat = None
+        self.loop_thread_id = None
+        self.task = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        """
+        Starts the watchdog for the running event loop.
+        """
+
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.stopped.clear()
+        self.task = asyncio.create_task(self._measure_lag())
+        self.thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self.thread.start()
+
+    async def stop(self):
+        """
+        Stops the watchdog.
+        """
+
+        self.stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _measure_lag(self):
+        """
+        Measures how late the loop wakes up a periodic timer.
+        """
+
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - scheduled)
+            self.max_lag = max(self.max_lag, lag)
+            self.heartbeat = time.monotonic()
+            EVENT_LOOP_LAG.observe(lag)
+
+    def _watch(self):
+        """
+        Captures the stack of the loop thread when the heartbeat is overdue
+        (runs in the watchdog thread).
+        """
+
+        reported_heartbeat = None
+        check_interval = min(self.interval, self.block_threshold) / 2
+        while not self.stopped.wait(check_interval):
+            heartbeat = self.heartbeat
+            blocked_for = time.monotonic() - heartbeat - self.interval
+            if blocked_for < self.block_threshold or heartbeat == reported_heartbeat:
+                continue
+            reported_heartbeat = heartbeat
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+            in_loop_internals = frame is not None and os.path.normcase(frame.f_code.co_filename) in LOOP_INTERNAL_FILES
+            if len(self.reports) < self.max_reports:
+                self.reports.append(BlockedLoopReport(blocked_for, stack, in_loop_internals))
+
+            # A loop thread in the loop internals waits for the GIL held by
+            # other threads (e.g. the message processing threads), so it is
+            # only counted and logged at debug level
+            if in_loop_internals:
+                EVENT_LOOP_BLOCKS.inc(cause="gil_delay")
+                logger.debug(f"Event loop delayed for more than {blocked_for * 1000:.0f} ms waiting for the GIL")
+            else:
+                EVENT_LOOP_BLOCKS.inc(cause="blocking")
+                logger.warning(f"Event loop blocked for more than {blocked_for * 1000:.0f} ms at\n{stack}")
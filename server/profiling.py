@@ -0,0 +1,211 @@
+import asyncio
+import collections
+import hmac
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+from aiohttp import web
+from aiohttp.web import Request, Response
+
+
+def _format_frame(filename: str, lineno: int, function_name: str = None) -> str:
+    """
+    Formats a frame for a collapsed stack (the last two path components of the
+    file are kept).
+
+    Args:
+        filename (str): The file of the frame.
+        lineno (int): The line number.
+        function_name (str): The function of the frame, if known.
+
+    Returns:
+        str: The formatted frame.
+    """
+
+    location = "/".join(filename.replace("\\", "/").split("/")[-2:]) + f":{lineno}"
+    if function_name:
+        location = f"{function_name} ({location})"
+    return location.replace(";", ":")
+
+
+def _render_collapsed(stacks: collections.Counter) -> str:
+    """
+    Renders stacks in the collapsed format of flamegraph.pl and speedscope
+    ("root;...;leaf count" per line).
+
+    Args:
+        stacks (collections.Counter): The weights of the stacks (tuples of
+        frames from the root to the leaf).
+
+    Returns:
+        str: The collapsed stacks.
+    """
+
+    return "".join(f"{';'.join(stack)} {weight}\n" for stack, weight in stacks.most_common())
+
+
+class StackSampler:
+    """
+    Class that samples the call stacks of threads of the live process in fixed
+    intervals (statistical profiling without tracing overhead in the sampled
+    threads).
+    """
+
+    def __init__(self, interval: float, thread_ids: set = None):
+        """
+        Constructor of the StackSampler class.
+
+        Args:
+            interval (float): The sampling interval in seconds.
+            thread_ids (set): The ids of the threads to sample, or None to
+            sample all threads (except the sampler itself).
+        """
+
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.stacks = collections.Counter()
+        self.sample_count = 0
+
+    def run(self, duration: float) -> collections.Counter:
+        """
+        Samples the stacks for a given time (runs in a separate thread).
+
+        Args:
+            duration (float): The profiling time in seconds.
+
+        Returns:
+            collections.Counter: The number of samples per stack.
+        """
+
+        own_thread_id = threading.get_ident()
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        end_time = time.monotonic() + duration
+        while time.monotonic() < end_time:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_format_frame(frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name))
+                    frame = frame.f_back
+                stack.append(f"thread {thread_names.get(thread_id, thread_id)}")
+                self.stacks[tuple(reversed(stack))] += 1
+            self.sample_count += 1
+            time.sleep(self.interval)
+        return self.stacks
+
+
+class ProfilingEndpoint:
+    """
+    Class that provides the admin route for profiling a live worker process.
+    - mode=cpu samples the call stacks of the event loop thread (or of all
+    threads with threads=all, which includes the message processing threads).
+    - mode=memory tracks the allocations with tracemalloc and returns the
+    memory allocated (and still alive) during the profiling time per stack.
+    - The result is a collapsed stack file for flamegraph.pl or speedscope.
+    - Requires the admin token as bearer token, only one profile runs at a time
+    and the profiling time is bounded.
+    """
+
+    def __init__(self, admin_token: str, max_seconds: float = 60.0, default_interval: float = 0.005):
+        """
+        Constructor of the ProfilingEndpoint class.
+
+        Args:
+            admin_token (str): The admin token (the route is refused if no
+            token is configured).
+            max_seconds (float): The maximum profiling time in seconds.
+            default_interval (float): The default sampling interval in seconds.
+        """
+
+        self.admin_token = admin_token
+        self.max_seconds = max_seconds
+        self.default_interval = default_interval
+        self.running = False
+
+    def _check_authorization(self, req: Request):
+        """
+        Checks the admin token of a request.
+
+        Args:
+            req (Request): The incoming request.
+        """
+
+        expected = f"Bearer {self.admin_token}"
+        if not self.admin_token or not hmac.compare_digest(req.headers.get("Authorization", ""), expected):
+            raise PermissionError("Invalid admin token")
+
+    async def handle(self, req: Request) -> Response:
+        """
+        Runs a profile of this worker process and returns the collapsed stacks.
+        - Query parameters: seconds (profiling time), mode (cpu or memory),
+        interval_ms (sampling interval) and threads (loop or all).
+
+        Args:
+            req (Request): The incoming request.
+
+        Returns:
+            Response: The collapsed stacks as text file.
+        """
+
+        self._check_authorization(req)
+        try:
+            seconds = float(req.query.get("seconds", 10))
+            interval = float(req.query.get("interval_ms", self.default_interval * 1000)) / 1000
+        except ValueError:
+            raise web.HTTPBadRequest(text="seconds and interval_ms must be numbers")
+        mode = req.query.get("mode", "cpu")
+        if not 0 < seconds <= self.max_seconds or not 0.001 <= interval <= 1.0 or mode not in ("cpu", "memory"):
+            raise web.HTTPBadRequest(text=f"Expected 0 < seconds <= {self.max_seconds}, "
+                                          f"1 <= interval_ms <= 1000 and mode cpu or memory")
+        if self.running:
+            raise web.HTTPConflict(text="A profile is already running")
+
+        self.running = True
+        try:
+            if mode == "cpu":
+                thread_ids = None if req.query.get("threads") == "all" else {threading.get_ident()}
+                sampler = StackSampler(interval, thread_ids)
+                stacks = await asyncio.to_thread(sampler.run, seconds)
+            else:
+                stacks = await self._profile_memory(seconds)
+        finally:
+            self.running = False
+
+        return Response(
+            text=_render_collapsed(stacks),
+            content_type="text/plain",
+            headers={"Content-Disposition": f'attachment; filename="profile-{mode}-{os.getpid()}.collapsed"'}
+        )
+
+    async def _profile_memory(self, seconds: float) -> collections.Counter:
+        """
+        Tracks the allocations for a given time.
+
+        Args:
+            seconds (float): The profiling time in seconds.
+
+        Returns:
+            collections.Counter: The allocated bytes per stack.
+        """
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(25)
+        try:
+            await asyncio.sleep(seconds)
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        stacks = collections.Counter()
+        for statistic in snapshot.statistics("traceback"):
+            # Frames are ordered from the oldest to the most recent call
+            stack = tuple(_format_frame(frame.filename, frame.lineno) for frame in statistic.traceback)
+            stacks[stack] += statistic.size
+        return stacks
@@ -0,0 +1,23 @@
+import base64
+import json
+
+
+def get_token_expiry(token: str) -> float:
+    """
+    Reads the expiry time (exp claim) of a jwt token without validating it.
+
+    Args:
+        token (str): The jwt token.
+
+    Returns:
+        float: The expiry time as unix timestamp, or None if the token has no 
+        readable exp claim.
+    """
+
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
@@ -0,0 +1,240 @@
+import asyncio
+import collections
+import itertools
+import logging
+import time
+from typing import Callable
+
+from botbuilder.core import BotFrameworkAdapter, TurnContext
+from botbuilder.schema import Activity
+from botframework.connector.auth import ClaimsIdentity
+
+from bot import tracing
+from bot.admission_control import AdmissionControl
+from bot.metrics import registry
+
+
+logger = logging.getLogger(__name__)
+
+
+# Priorities of queued turns (lower values are processed first)
+PRIORITY_ONGOING_CONVERSATION = 0
+PRIORITY_NEW_CONVERSATION = 1
+
+# Turns discarded at the stop of the turn queue (acknowledged but not replied)
+TURN_QUEUE_DISCARDED_TURNS = registry.counter(
+    "bot_turn_queue_discarded_turns_total",
+    "Queued turns discarded at the stop of the turn queue."
+)
+
+
+class TurnJob:
+    """
+    Class that represents a single turn waiting in the turn queue.
+    """
+
+    def __init__(self, activity: Activity, identity: ClaimsIdentity, priority: int):
+        """
+        Constructor of the TurnJob class.
+        - Stores the activity and the already validated claims identity of the 
+        request.
+        - Stores the conversation reference of the activity, which identifies 
+        the conversation and the service url the reply is sent to once the 
+        turn has been processed.
+
+        Args:
+            activity (Activity): The incoming activity.
+            identity (ClaimsIdentity): The validated claims identity of the 
+            request.
+            priority (int): The priority of the turn.
+        """
+
+        self.activity = activity
+        self.identity = identity
+        self.priority = priority
+        self.conversation_reference = TurnContext.get_conversation_reference(activity)
+        self.conversation_id = self.conversation_reference.conversation.id if self.conversation_reference.conversation else ""
+        self.enqueued_at = time.monotonic()
+        self.sequence = None
+        self.admission_key = None
+
+
+class TurnQueue:
+    """
+    Class that processes turns asynchronously on a bounded pool of background 
+    workers. 
+    - The turns of a conversation are processed one after another in the 
+    order of their arrival (the lane of the conversation). The priorities 
+    only order the conversations: a turn which arrives while its 
+    conversation has a turn queued or processing joins the lane of the 
+    conversation, so that e.g. the first message of a new conversation is 
+    not processed before its conversation update.
+    """
+
+    def __init__(
+        self,
+        adapter: BotFrameworkAdapter,
+        logic: Callable,
+        worker_count: int = 8,
+        max_queue_size: int = 256,
+        admission_control: AdmissionControl = None,
+        drain_timeout: float = 10.0
+    ):
+        """
+        Constructor of the TurnQueue class.
+        - Initializes a priority queue of the conversations with waiting turns 
+        (one entry per conversation, for the first turn of its lane).
+        - Initializes the lanes of the conversations with queued or processing 
+        turns.
+
+        Args:
+            adapter (BotFrameworkAdapter): The adapter used to process the turns.
+            logic (Callable): The bot logic to execute for each turn.
+            worker_count (int): The number of background workers.
+            max_queue_size (int): The maximum number of waiting turns. 
+            admission_control (AdmissionControl): Optional admission control 
+            which is informed about the queued turns, their queue wait time 
+            and the turns in flight.
+            drain_timeout (float): The maximum time in seconds to process the 
+            remaining turns when the queue is stopped.
+        """
+
+        self.adapter = adapter
+        self.logic = logic
+        self.worker_count = worker_count
+        self.max_queue_size = max_queue_size
+        self.admission_control = admission_control
+        self.drain_timeout = drain_timeout
+        self.queue = asyncio.PriorityQueue()
+        self.conversation_lanes = {}
+        self.queued_turns = 0
+        self.pending_turns = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.stopping = False
+        self.workers = []
+        self._sequence = itertools.count()
+
+    async def start(self):
+        """
+        Starts the background workers.
+        """
+
+        self.stopping = False
+        for _ in range(self.worker_count):
+            self.workers.append(asyncio.create_task(self._worker()))
+
+    async def stop(self):
+        """
+        Stops the background workers.
+        - Refuses new turns and processes the remaining turns (which have 
+        already been acknowledged to the channel) for at most the drain 
+        timeout.
+        - Turns which are still waiting or processing after the drain timeout 
+        are discarded, logged and counted.
+        """
+
+        self.stopping = True
+        if self.workers and self.pending_turns:
+            try:
+                await asyncio.wait_for(self.idle.wait(), self.drain_timeout)
+            except asyncio.TimeoutError:
+                pass
+        if self.pending_turns:
+            logger.warning(f"Discarding {self.pending_turns} turns at the stop of the turn queue "
+                           f"({self.queued_turns} waiting)")
+            TURN_QUEUE_DISCARDED_TURNS.inc(self.pending_turns)
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def enqueue(self, activity: Activity, identity: ClaimsIdentity, priority: int = PRIORITY_ONGOING_CONVERSATION) -> bool:
+        """
+        Adds a turn to the queue without waiting (to the end of the lane of 
+        its conversation if the conversation has a turn queued or processing).
+
+        Args:
+            activity (Activity): The incoming activity.
+            identity (ClaimsIdentity): The validated claims identity of the 
+            request.
+            priority (int): The priority of the turn.
+
+        Returns:
+            bool: True if the turn has been queued, False if the queue is full 
+            or stopping.
+        """
+
+        if self.stopping or self.queued_turns >= self.max_queue_size:
+            return False
+        job = TurnJob(activity, identity, priority)
+        job.sequence = next(self._sequence)
+        lane = self.conversation_lanes.get(job.conversation_id)
+        if lane is not None:
+            lane.append(job)
+        else:
+            self.conversation_lanes[job.conversation_id] = collections.deque([job])
+            self.queue.put_nowait((job.priority, job.sequence, job.conversation_id))
+        self.queued_turns += 1
+        self.pending_turns += 1
+        self.idle.clear()
+
+        # Count the queued turn as pending in the admission control
+        if self.admission_control is not None:
+            job.admission_key = self.admission_control.turn_queued()
+        return True
+
+    async def _worker(self):
+        """
+        Background worker which takes the next conversation from the queue and 
+        processes the first turn of its lane.
+        - Only one worker processes a conversation at a time (the conversation 
+        is queued again for its next turn once the turn is finished), so that 
+        the conversation state is not written concurrently.
+        - The reply is sent proactively through the connector client of the 
+        conversation reference, as the original http request has already been 
+        answered.
+        """
+
+        while True:
+            _, _, conversation_id = await self.queue.get()
+            lane = self.conversation_lanes[conversation_id]
+            job = lane[0]
+            self.queued_turns -= 1
+            try:
+                await self._process_job(job)
+            except Exception as error:
+                logger.error("Failed to process queued turn", exc_info=error)
+            finally:
+                # Queue the conversation again for its next turn
+                lane.popleft()
+                if lane:
+                    next_job = lane[0]
+                    self.queue.put_nowait((next_job.priority, next_job.sequence, conversation_id))
+                else:
+                    del self.conversation_lanes[conversation_id]
+                self.pending_turns -= 1
+                if self.pending_turns == 0:
+                    self.idle.set()
+                self.queue.task_done()
+
+    async def _process_job(self, job: TurnJob):
+        """
+        Processes a single queued turn.
+        - Reports the queue wait time and the turn in flight to the admission 
+        control.
+
+        Args:
+            job (TurnJob): The queued turn.
+        """
+
+        if self.admission_control is not None:
+            self.admission_control.turn_dequeued(job.admission_key)
+            self.admission_control.turn_started()
+        try:
+            with tracing.trace("process_activity_with_identity", conversation_id=job.conversation_id,
+                               activity_type=job.activity.type, priority=job.priority):
+                await self.adapter.process_activity_with_identity(job.activity, job.identity, self.logic)
+        finally:
+            if self.admission_control is not None:
+                self.admission_control.turn_finished()
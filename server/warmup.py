@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import time
+from typing import Callable
+
+from aiohttp.web import Request, Response
+
+from bot.metrics import registry
+from server import fast_path
+
+
+logger = logging.getLogger(__name__)
+
+# Metrics of the startup warm-up
+STARTUP_WARMUP_DURATION = registry.histogram(
+    "bot_startup_warmup_duration_seconds",
+    "Duration of the steps of the startup warm-up.",
+    ("step", "result"),
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+
+
+class StartupWarmup:
+    """
+    Class that warms up a worker after the start of the server (e.g. the
+    prompt templates, the code paths of the pipeline and the connections to
+    the openai api, the storage and the channels) and reports its liveness
+    and readiness for the load balancer.
+    - The steps run concurrently in the background, so that the liveness
+    probe (/healthz) is answered from the start. The readiness probe
+    (/readyz) answers 503 until all steps have finished.
+    - The warm-up is best effort: a step that fails or exceeds the timeout is
+    logged and counted, and the worker becomes ready anyway (an outage of
+    the openai api must not keep all workers out of the load balancer, the
+    turns then use their fallbacks).
+    - Coroutine functions run on the event loop, other functions in worker
+    threads.
+    """
+
+    def __init__(self, timeout: float = 30.0):
+        """
+        Constructor of the StartupWarmup class.
+
+        Args:
+            timeout (float): The maximum duration of a step in seconds.
+        """
+
+        self.timeout = timeout
+        self.steps = []
+        self.step_results = {}
+        self.ready = False
+        self.ready_event = asyncio.Event()
+        self.task = None
+
+    def add_step(self, name: str, function: Callable):
+        """
+        Adds a step to the warm-up.
+
+        Args:
+            name (str): The name of the step (label of the metric).
+            function (Callable): The function of the step, without arguments
+            (a coroutine function or a synchronous function).
+        """
+
+        self.steps.append((name, function))
+
+    def start(self):
+        """
+        Starts the warm-up on the running event loop.
+        """
+
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stops the warm-up if it is still running.
+        """
+
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def wait_ready(self):
+        """
+        Waits until all steps have finished.
+        """
+
+        await self.ready_event.wait()
+
+    async def _run(self):
+        """
+        Runs all steps and marks the worker as ready.
+        """
+
+        start = time.perf_counter()
+        await asyncio.gather(*(self._run_step(name, function) for name, function in self.steps))
+        self.ready = True
+        self.ready_event.set()
+        logger.info(f"Startup warm-up finished in {(time.perf_counter() - start) * 1000:.0f} ms",
+                    extra={"fields": {"steps": self.step_results}})
+
+    async def _run_step(self, name: str, function: Callable):
+        """
+        Runs a step and records its duration and result.
+
+        Args:
+            name (str): The name of the step.
+            function (Callable): The function of the step.
+        """
+
+        start = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(function):
+                await asyncio.wait_for(function(), self.timeout)
+            else:
+                await asyncio.wait_for(asyncio.to_thread(function), self.timeout)
+            result = "ok"
+        except asyncio.TimeoutError:
+            result = "timeout"
+            logger.warning(f"Startup warm-up step {name} exceeded {self.timeout:.0f} s")
+        except Exception as e:
+            result = "failed"
+            logger.warning(f"Startup warm-up step {name} failed: {e!r}")
+        duration = time.perf_counter() - start
+        STARTUP_WARMUP_DURATION.observe(duration, step=name, result=result)
+        self.step_results[name] = {"result": result, "duration_ms": round(duration * 1000, 1)}
+
+    async def handle_liveness(self, req: Request) -> Response:
+        """
+        Answers the liveness probe (the event loop of the worker is
+        responsive).
+
+        Args:
+            req (Request): The request.
+
+        Returns:
+            Response: Always 200.
+        """
+
+        return fast_path.json_response({"status": "alive"})
+
+    async def handle_readiness(self, req: Request) -> Response:
+        """
+        Answers the readiness probe.
+
+        Args:
+            req (Request): The request.
+
+        Returns:
+            Response: 200 once the warm-up has finished, otherwise 503 (with
+            the results of the finished steps).
+        """
+
+        if self.ready:
+            return fast_path.json_response({"status": "ready", "steps": self.step_results})
+        return fast_path.json_response({"status": "warming_up", "steps": self.step_results}, status=503)
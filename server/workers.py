@@ -0,0 +1,306 @@
+import bisect
+import gc
+import hashlib
+import logging
+import os
+import signal
+import socket
+import time
+import traceback
+
+import aiohttp
+from aiohttp import web
+from aiohttp.web import Request, Response
+
+
+logger = logging.getLogger(__name__)
+
+# Header which marks requests that have already been forwarded to the worker
+# owning the conversation
+FORWARDED_HEADER = "X-Worker-Forwarded"
+
+# Headers of the response of the owning worker which are not copied to the
+# forwarded response (set by the connection or recomputed for the body)
+HOP_BY_HOP_HEADERS = ("connection", "keep-alive", "transfer-encoding", "content-length", "content-encoding",
+                      "date", "server")
+
+
+class ConsistentHashRing:
+    """
+    Class that maps keys (e.g. conversation ids) to workers using consistent
+    hashing.
+    """
+
+    def __init__(self, worker_count: int, replicas: int = 64):
+        """
+        Constructor of the ConsistentHashRing class.
+        - Places a number of virtual nodes per worker on the hash ring.
+
+        Args:
+            worker_count (int): The number of workers.
+            replicas (int): The number of virtual nodes per worker.
+        """
+
+        ring = []
+        for worker_index in range(worker_count):
+            for replica in range(replicas):
+                ring.append((self._hash(f"worker-{worker_index}-{replica}"), worker_index))
+        ring.sort()
+        self.hashes = [node_hash for node_hash, _ in ring]
+        self.workers = [worker_index for _, worker_index in ring]
+
+    def _hash(self, key: str) -> int:
+        """
+        Hashes a key to a position on the ring.
+
+        Args:
+            key (str): The key to hash.
+
+        Returns:
+            int: The position on the ring.
+        """
+
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    def get_worker(self, key: str) -> int:
+        """
+        Determines the worker responsible for a key.
+
+        Args:
+            key (str): The key, e.g. the conversation id.
+
+        Returns:
+            int: The index of the responsible worker.
+        """
+
+        position = bisect.bisect(self.hashes, self._hash(key)) % len(self.hashes)
+        return self.workers[position]
+
+
+class WorkerAffinity:
+    """
+    Class that routes the turns of a conversation to the same worker process,
+    so that the in-process caches and locks of that worker stay effective.
+    """
+
+    def __init__(self, worker_index: int, worker_count: int, internal_host: str, internal_base_port: int):
+        """
+        Constructor of the WorkerAffinity class.
+
+        Args:
+            worker_index (int): The index of this worker.
+            worker_count (int): The number of workers.
+            internal_host (str): The host of the internal listeners of the
+            workers.
+            internal_base_port (int): The port of the internal listener of the
+            first worker (the other workers use the subsequent ports).
+        """
+
+        self.worker_index = worker_index
+        self.ring = ConsistentHashRing(worker_count)
+        self.internal_host = internal_host
+        self.internal_base_port = internal_base_port
+        self.session = None
+
+    def get_owner(self, req: Request, body: dict) -> int:
+        """
+        Determines the worker owning the conversation of a request.
+        - Requests which have already been forwarded are always owned by this
+        worker.
+
+        Args:
+            req (Request): The incoming request.
+            body (dict): The parsed request body (the activity).
+
+        Returns:
+            int: The index of the owning worker.
+        """
+
+        conversation_id = (body.get("conversation") or {}).get("id")
+        if FORWARDED_HEADER in req.headers or not conversation_id:
+            return self.worker_index
+        return self.ring.get_worker(conversation_id)
+
+    async def forward(self, req: Request, body: dict, owner: int) -> Response:
+        """
+        Forwards a request to the internal listener of the owning worker and
+        returns its response (status, headers and body).
+
+        Args:
+            req (Request): The incoming request.
+            body (dict): The parsed request body (the activity).
+            owner (int): The index of the owning worker.
+
+        Returns:
+            Response: The response of the owning worker, or None if the owning
+            worker is not reachable (e.g. while it is restarting), in which
+            case the request is processed by this worker.
+        """
+
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        headers = {key: value for key, value in req.headers.items()
+                   if key in ("Authorization", "Content-Type")}
+        headers[FORWARDED_HEADER] = str(self.worker_index)
+        url = f"http://{self.internal_host}:{self.internal_base_port + owner}{req.path}"
+        try:
+            async with self.session.post(url, json=body, headers=headers) as response:
+                response_body = await response.read()
+                response_headers = {key: value for key, value in response.headers.items()
+                                    if key.lower() not in HOP_BY_HOP_HEADERS}
+                return Response(status=response.status, body=response_body, headers=response_headers)
+        except aiohttp.ClientConnectionError as e:
+            logger.warning(f"Worker {owner} is not reachable, processing the request in worker "
+                           f"{self.worker_index}: {e!r}")
+            return None
+
+    async def close(self, app: web.Application = None):
+        """
+        Closes the http session used for forwarding.
+        """
+
+        if self.session is not None:
+            await self.session.close()
+
+
+# Key of the WorkerAffinity instance in the aiohttp app
+WORKER_AFFINITY_KEY = web.AppKey("worker_affinity", WorkerAffinity)
+
+
+def create_listening_socket(host: str, port: int, reuse_port: bool) -> socket.socket:
+    """
+    Creates a listening tcp socket.
+
+    Args:
+        host (str): The host to bind to.
+        port (int): The port to bind to.
+        reuse_port (bool): Whether to set SO_REUSEPORT, so that several worker
+        processes can bind their own socket to the same port.
+
+    Returns:
+        socket.socket: The listening socket.
+    """
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.setblocking(False)
+    return sock
+
+
+def run_worker(app: web.Application, worker_index: int, worker_count: int, host: str, port: int,
+               shared_sock: socket.socket, conversation_affinity: bool, internal_base_port: int):
+    """
+    Runs the aiohttp app in a forked worker process.
+
+    Args:
+        app (web.Application): The aiohttp app.
+        worker_index (int): The index of this worker.
+        worker_count (int): The number of workers.
+        host (str): The public host.
+        port (int): The public port.
+        shared_sock (socket.socket): The listening socket inherited from the
+        supervisor, or None if each worker binds its own socket with
+        SO_REUSEPORT.
+        conversation_affinity (bool): Whether to route the turns of a
+        conversation to the same worker.
+        internal_base_port (int): The port of the internal listener of the
+        first worker.
+    """
+
+    socks = [shared_sock or create_listening_socket(host, port, reuse_port=True)]
+    if conversation_affinity:
+        affinity = WorkerAffinity(worker_index, worker_count, "127.0.0.1", internal_base_port)
+        app[WORKER_AFFINITY_KEY] = affinity
+        app.on_cleanup.append(affinity.close)
+        socks.append(create_listening_socket("127.0.0.1", internal_base_port + worker_index, reuse_port=False))
+
+    web.run_app(app, sock=socks, print=None)
+
+
+def serve(app: web.Application, host: str, port: int, worker_count: int,
+          conversation_affinity: bool = False, internal_base_port: int = 8100):
+    """
+    Serves the aiohttp app with several pre-forked worker processes.
+    - All data of the app (dialogue data, prompt templates, compiled regex
+    patterns) must be loaded before calling this function. The garbage
+    collector is frozen before forking, so that these pages are shared
+    copy-on-write between the workers.
+    - Uses SO_REUSEPORT to let the kernel distribute the connections between
+    the workers. If SO_REUSEPORT is not available, the workers accept
+    connections on one socket bound by the supervisor.
+    - The supervisor restarts crashed workers and forwards SIGTERM and SIGINT
+    to the workers.
+
+    Args:
+        app (web.Application): The aiohttp app.
+        host (str): The public host.
+        port (int): The public port.
+        worker_count (int): The number of worker processes.
+        conversation_affinity (bool): Whether to route the turns of a
+        conversation to the same worker (consistent hashing on the
+        conversation id).
+        internal_base_port (int): The port of the internal listener of the
+        first worker (used for the conversation affinity).
+    """
+
+    shared_sock = None
+    if not hasattr(socket, "SO_REUSEPORT"):
+        shared_sock = create_listening_socket(host, port, reuse_port=False)
+
+    # Freeze the objects loaded so far, so that the garbage collector does not
+    # touch (and thereby copy) their pages in the workers
+    gc.collect()
+    gc.freeze()
+
+    workers = {}
+    shutting_down = False
+
+    def start_worker(worker_index: int):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            exit_code = 0
+            try:
+                run_worker(app, worker_index, worker_count, host, port, shared_sock,
+                           conversation_affinity, internal_base_port)
+            except BaseException:
+                traceback.print_exc()
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        workers[pid] = worker_index
+
+    def stop_workers(signum, frame):
+        nonlocal shutting_down
+        shutting_down = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop_workers)
+    signal.signal(signal.SIGINT, stop_workers)
+
+    for worker_index in range(worker_count):
+        start_worker(worker_index)
+    logger.info(f"Serving on http://{host}:{port} with {worker_count} workers")
+
+    # Supervise the workers and restart crashed workers
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        worker_index = workers.pop(pid, None)
+        if worker_index is not None and not shutting_down:
+            logger.warning(f"Worker {worker_index} exited with status {status}, restarting")
+            time.sleep(1)
+            start_worker(worker_index)
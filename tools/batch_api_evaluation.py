@@ -0,0 +1,476 @@
+"""
+Offline evaluation of scripted conversations with the batch api of OpenAI
+(cheaper than the synchronous calls, with results within the completion
+window of the batch jobs).
+
+Reads the same json lines file of scripted conversations as
+tools.batch_transcripts and processes the conversations turn by turn in
+rounds. Each round:
+- classifies the current turn of all active conversations with the local
+slot classifier (if configured with --slot-classifier and confident),
+- submits the slot filling requests of the other turns as batch jobs, polls
+them until completion and parses the results as the bot does (invalid
+results are repeated with the escalation model of the route as a further
+set of batch jobs), and performs the dialogue management,
+- submits the response generation requests of these turns as batch jobs (with
+the same escalation).
+The requests and the parsing of the responses are those of the bot
+(build_request and parse_response of the slot filling and the response
+generation). Requests which fail in a batch use the fallbacks of the
+pipeline, as the synchronous processing does. Finished conversations are appended to the
+output file (in the format of tools.batch_transcripts, without timings), and
+conversations already in the output file are skipped. Run from the repository
+root (the local stand-in is python -m tools.fake_openai, used with
+OPENAI_BASE_URL=http://127.0.0.1:3985/v1):
+
+    python -m tools.batch_api_evaluation transcripts.jsonl results.jsonl --poll-interval 60
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import openai
+
+from bot.dialogue_start import DialogueStart
+from bot.message_processing import MessageProcessing
+from tools.batch_transcripts import read_conversations, read_finished_conversation_ids
+
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+TERMINAL_BATCH_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchJobRunner:
+    """
+    Class that runs chat completion requests as batch jobs of the batch api.
+    - Splits the requests into batch jobs of a maximum size, submits all jobs
+    and polls them until they are finished.
+    - Returns the responses of the successful requests (failed requests or
+    requests of failed or expired jobs have no response).
+    """
+
+    def __init__(self, client: openai.OpenAI, poll_interval: float = 60.0, completion_window: str = "24h",
+                 max_batch_size: int = 50000):
+        """
+        Constructor of the BatchJobRunner class.
+
+        Args:
+            client (openai.OpenAI): The openai client.
+            poll_interval (float): The time in seconds between two status
+            requests of a batch job.
+            completion_window (str): The completion window of the batch jobs.
+            max_batch_size (int): The maximum number of requests per batch job.
+        """
+
+        self.client = client
+        self.poll_interval = poll_interval
+        self.completion_window = completion_window
+        self.max_batch_size = max_batch_size
+
+    def run(self, requests: dict, description: str) -> dict:
+        """
+        Runs requests as batch jobs.
+
+        Args:
+            requests (dict): The parameters of the chat completion requests
+            per custom id.
+            description (str): The description of the batch jobs (stored in
+            their metadata).
+
+        Returns:
+            dict: The response bodies of the successful requests per custom id.
+        """
+
+        if not requests:
+            return {}
+
+        # Submit the batch jobs
+        custom_ids = list(requests)
+        batch_ids = []
+        for offset in range(0, len(custom_ids), self.max_batch_size):
+            lines = [
+                json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": requests[custom_id]},
+                           ensure_ascii=False)
+                for custom_id in custom_ids[offset:offset + self.max_batch_size]
+            ]
+            input_file = self.client.files.create(
+                file=("batch_input.jsonl", ("\n".join(lines) + "\n").encode("utf-8")),
+                purpose="batch"
+            )
+            batch = self.client.batches.create(
+                input_file_id=input_file.id,
+                endpoint=BATCH_ENDPOINT,
+                completion_window=self.completion_window,
+                metadata={"description": description}
+            )
+            batch_ids.append(batch.id)
+            print(f"Submitted batch {batch.id} ({description}, {len(lines)} requests)", file=sys.stderr)
+
+        # Poll the batch jobs until they are finished and collect the responses
+        responses = {}
+        pending_batch_ids = list(batch_ids)
+        while pending_batch_ids:
+            time.sleep(self.poll_interval)
+            for batch_id in list(pending_batch_ids):
+                batch = self.client.batches.retrieve(batch_id)
+                if batch.status not in TERMINAL_BATCH_STATUSES:
+                    continue
+                pending_batch_ids.remove(batch_id)
+                print(f"Batch {batch_id} {batch.status}", file=sys.stderr)
+                if batch.output_file_id:
+                    responses.update(self._read_output_file(batch.output_file_id))
+        return responses
+
+    def _read_output_file(self, file_id: str) -> dict:
+        """
+        Reads the successful responses of an output file of a batch job.
+
+        Args:
+            file_id (str): The id of the output file.
+
+        Returns:
+            dict: The response bodies per custom id.
+        """
+
+        responses = {}
+        for line in self.client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get("response") or {}
+            if response.get("status_code") == 200 and not result.get("error"):
+                responses[result["custom_id"]] = response["body"]
+        return responses
+
+
+class ConversationRun:
+    """
+    Class that holds the state of a scripted conversation during the
+    evaluation.
+    """
+
+    def __init__(self, conversation: dict, welcome_text: str, initial_dialogue_state: str):
+        """
+        Constructor of the ConversationRun class.
+
+        Args:
+            conversation (dict): The scripted conversation.
+            welcome_text (str): The welcome message of the bot.
+            initial_dialogue_state (str): The initial dialogue state.
+        """
+
+        self.conversation = conversation
+        self.conversation_history = [("bot", welcome_text)]
+        self.conversation_history_tokens = []
+        self.dialogue_state_history = [initial_dialogue_state]
+        self.slot_filling = {}
+        self.final_state = False
+        self.turns = []
+        # Intermediate results of the current turn
+        self.rg_action = None
+        self.current_turn = None
+
+    @property
+    def finished(self) -> bool:
+        return self.final_state or len(self.turns) >= len(self.conversation["turns"])
+
+    @property
+    def user_text(self) -> str:
+        return self.conversation["turns"][len(self.turns)]
+
+    def custom_id(self, component: str) -> str:
+        return f"{self.conversation['conversation_id']}:{len(self.turns)}:{component}"
+
+    def result(self) -> dict:
+        """
+        Returns the results of the conversation.
+
+        Returns:
+            dict: The results in the format of tools.batch_transcripts.
+        """
+
+        return {
+            "conversation_id": self.conversation["conversation_id"],
+            "treatment_group": self.conversation["treatment_group"],
+            "final_state": self.final_state,
+            "processed_turns": len(self.turns),
+            "skipped_turns": len(self.conversation["turns"]) - len(self.turns),
+            "prompt_tokens": sum(call.get("prompt_tokens", 0) for turn in self.turns for call in turn["llm_calls"]),
+            "completion_tokens": sum(call.get("completion_tokens", 0) for turn in self.turns for call in turn["llm_calls"]),
+            "turns": self.turns,
+        }
+
+
+def _llm_call_entry(component: str, response: dict) -> dict:
+    """
+    Creates the entry of a gpt api call of a turn from a batch response.
+
+    Args:
+        component (str): The calling component.
+        response (dict): The body of the chat completion.
+
+    Returns:
+        dict: The component, the model and the token usage of the call.
+    """
+
+    usage = response.get("usage") or {}
+    return {
+        "component": component,
+        "model": response.get("model", ""),
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        "completion_tokens": usage.get("completion_tokens", 0),
+        "cached_tokens": (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0),
+    }
+
+
+def _get_message(response: dict) -> tuple[str, bool]:
+    """
+    Returns the message of a chat completion of a batch response.
+
+    Args:
+        response (dict): The body of the chat completion.
+
+    Returns:
+        tuple[str, bool]: The content of the message and a flag whether it was
+        truncated by the output budget.
+    """
+
+    choice = response["choices"][0]
+    return choice["message"]["content"], choice.get("finish_reason") == "length"
+
+
+def run_slot_filling_round(message_processing: MessageProcessing, runner: BatchJobRunner, runs: list, round_index: int):
+    """
+    Performs the slot filling and the dialogue management of the current turn
+    of the conversations, as the synchronous processing does:
+    - Classifies the turns with the local slot classifier if it is configured
+    and confident.
+    - Classifies the other turns as batch jobs with the route of their dialogue
+    state, and the turns without a valid classification with the escalated
+    route (as a second set of batch jobs).
+    - Uses the fallback for the turns whose request failed or whose response
+    is still invalid.
+
+    Args:
+        message_processing (MessageProcessing): The message processing.
+        runner (BatchJobRunner): The batch job runner.
+        runs (list): The active conversations.
+        round_index (int): The index of the round.
+    """
+
+    slot_filling = message_processing.slot_filling
+    classification_results = {}
+    variants = {}
+    attempts = []
+    for run in runs:
+        dialogue_state = run.dialogue_state_history[-1]
+        run.current_turn = {
+            "user_text": run.user_text,
+            "dialogue_state": dialogue_state,
+            "stages": [],
+            "llm_calls": [],
+        }
+
+        # Classify the slots with the local slot classifier (if it is confident)
+        newly_filled_slots = slot_filling.run_classifier(run.user_text, dialogue_state, run.conversation_history)
+        if newly_filled_slots is not None:
+            classification_results[run] = newly_filled_slots
+            variants[run] = "classifier"
+        else:
+            attempts.append((run, slot_filling.model_router.route_slot_filling(dialogue_state)))
+
+    # Classify the slots with the gpt api (escalate the turns without a valid
+    # classification to the larger model of the route)
+    for component in ("slot_filling", "slot_filling_escalation"):
+        requests = {}
+        for run, route in attempts:
+            gpt_request = slot_filling.build_request(
+                run.user_text, run.dialogue_state_history[-1], run.conversation_history, route)
+            if gpt_request is None:
+                # No slots to check in the dialogue state
+                classification_results[run] = {}
+                variants[run] = "llm"
+                continue
+            requests[run.custom_id(component)] = gpt_request
+        responses = runner.run(requests, f"{component.replace('_', ' ')} round {round_index}")
+        escalations = []
+        for run, route in attempts:
+            response = responses.get(run.custom_id(component))
+            if response is None:
+                continue
+            run.current_turn["llm_calls"].append(_llm_call_entry("slot_filling", response))
+            gpt_response, _ = _get_message(response)
+            dialogue_state = run.dialogue_state_history[-1]
+            classification_result = slot_filling.parse_response(gpt_response, dialogue_state, route)
+            escalated_route = route.escalate()
+            if classification_result is None and escalated_route is not None:
+                escalations.append((run, escalated_route))
+                continue
+            if classification_result is None:
+                classification_result = slot_filling.parse_response(gpt_response, dialogue_state, route, lenient=True)
+            if classification_result is not None:
+                classification_results[run] = slot_filling.prepare_result(classification_result)
+                variants[run] = "llm"
+        attempts = escalations
+
+    for run in runs:
+        dialogue_state = run.dialogue_state_history[-1]
+        if run in classification_results:
+            newly_filled_slots = classification_results[run]
+            run.current_turn["stages"].append({"stage": "slot_filling", "variant": variants[run]})
+        else:
+            newly_filled_slots = slot_filling.run_fallback(run.user_text, dialogue_state)
+            run.current_turn["stages"].append({"stage": "slot_filling", "variant": "fallback"})
+
+        # Update the slot filling dictionary
+        for slot, value in newly_filled_slots.items():
+            if slot not in run.slot_filling:
+                run.slot_filling[slot] = value
+
+        # Perform the dialogue management
+        try:
+            new_dialogue_state, run.rg_action, final_state = message_processing.dialogue_management.run(
+                current_dialogue_state=dialogue_state,
+                slot_filling=run.slot_filling,
+                newly_filled_slots=newly_filled_slots
+            )
+            run.current_turn["stages"].append({"stage": "dialogue_management", "variant": ""})
+        except Exception:
+            new_dialogue_state, run.rg_action, final_state = message_processing.dialogue_management.run_fallback(
+                current_dialogue_state=dialogue_state
+            )
+            run.current_turn["stages"].append({"stage": "dialogue_management", "variant": "fallback"})
+        run.current_turn["new_dialogue_state"] = new_dialogue_state
+        run.current_turn["final_state"] = final_state
+
+
+def run_response_generation_round(message_processing: MessageProcessing, runner: BatchJobRunner, runs: list,
+                                  round_index: int):
+    """
+    Performs the response generation (as batch jobs, with a second set of
+    batch jobs for the escalated route of the invalid responses) of the
+    current turn of the conversations and completes the turns. The turns
+    whose request failed or whose response is still invalid use the canned
+    response.
+
+    Args:
+        message_processing (MessageProcessing): The message processing.
+        runner (BatchJobRunner): The batch job runner.
+        runs (list): The active conversations.
+        round_index (int): The index of the round.
+    """
+
+    response_generation = message_processing.response_generation
+    bot_responses = {}
+    attempts = [(run, response_generation.model_router.route_response_generation(run.rg_action)) for run in runs]
+    for component in ("response_generation", "response_generation_escalation"):
+        requests = {}
+        for run, route in attempts:
+            try:
+                requests[run.custom_id(component)] = response_generation.build_request(
+                    run.user_text, run.rg_action, run.conversation["treatment_group"], run.conversation_history,
+                    run.conversation_history_tokens, route)
+            except Exception:
+                # E.g. missing prompt files of the action (the fallback is used)
+                continue
+        responses = runner.run(requests, f"{component.replace('_', ' ')} round {round_index}")
+        escalations = []
+        for run, route in attempts:
+            response = responses.get(run.custom_id(component))
+            if response is None:
+                continue
+            run.current_turn["llm_calls"].append(_llm_call_entry("response_generation", response))
+            bot_response = response_generation.parse_response(*_get_message(response))
+            escalated_route = route.escalate()
+            if bot_response is None and escalated_route is not None:
+                escalations.append((run, escalated_route))
+            elif bot_response is not None:
+                bot_responses[run] = bot_response
+        attempts = escalations
+
+    for run in runs:
+        treatment_group = run.conversation["treatment_group"]
+        if run in bot_responses:
+            bot_response = bot_responses[run]
+            run.current_turn["stages"].append({"stage": "response_generation", "variant": "llm"})
+        else:
+            bot_response = response_generation.run_fallback(run.rg_action, treatment_group)
+            run.current_turn["stages"].append({"stage": "response_generation", "variant": "fallback"})
+
+        # Complete the turn and update the conversation state
+        user_text = run.user_text
+        run.conversation_history.append(("user", user_text))
+        run.conversation_history.append(("bot", bot_response))
+        run.dialogue_state_history.append(run.current_turn["new_dialogue_state"])
+        run.final_state = run.current_turn["final_state"]
+        run.turns.append({
+            "user_text": user_text,
+            "bot_response": bot_response,
+            "dialogue_state": run.current_turn["dialogue_state"],
+            "new_dialogue_state": run.current_turn["new_dialogue_state"],
+            "final_state": run.final_state,
+            "slot_filling": dict(run.slot_filling),
+            "stages": run.current_turn["stages"],
+            "llm_calls": run.current_turn["llm_calls"],
+        })
+        run.current_turn = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="The json lines file with the scripted conversations")
+    parser.add_argument("output", help="The json lines file for the results (appended to when resuming)")
+    parser.add_argument("--poll-interval", type=float, default=60.0, help="Seconds between two status requests")
+    parser.add_argument("--completion-window", default="24h")
+    parser.add_argument("--max-batch-size", type=int, default=50000, help="Maximum number of requests per batch job")
+    parser.add_argument("--limit", type=int, default=None, help="Process at most this many conversations")
+    parser.add_argument("--slot-classifier", default=None,
+                        help="The model file of the local slot classifier (as slot_classifier.model_path in botsettings.json)")
+    parser.add_argument("--confidence-threshold", type=float, default=None,
+                        help="The confidence threshold of the slot classifier (the threshold of the model file by default)")
+    args = parser.parse_args()
+
+    conversations = read_conversations(args.input)
+    finished_ids = read_finished_conversation_ids(args.output)
+    pending = [conversation for conversation in conversations if conversation["conversation_id"] not in finished_ids]
+    if args.limit is not None:
+        pending = pending[:args.limit]
+
+    message_processing = MessageProcessing()
+    if args.slot_classifier:
+        message_processing.slot_filling.configure_slot_classifier(args.slot_classifier, args.confidence_threshold)
+    dialogue_start = DialogueStart()
+    runner = BatchJobRunner(openai.OpenAI(), args.poll_interval, args.completion_window, args.max_batch_size)
+    runs = [ConversationRun(conversation, *dialogue_start.start_dialogue()) for conversation in pending]
+
+    start = time.perf_counter()
+    round_index = 0
+    with open(args.output, "a", encoding="utf-8") as output_file:
+        active_runs = runs
+        while True:
+            # Write the finished conversations
+            for run in active_runs:
+                if run.finished:
+                    output_file.write(json.dumps(run.result(), ensure_ascii=False) + "\n")
+            output_file.flush()
+            active_runs = [run for run in active_runs if not run.finished]
+            if not active_runs:
+                break
+
+            round_index += 1
+            run_slot_filling_round(message_processing, runner, active_runs, round_index)
+            run_response_generation_round(message_processing, runner, active_runs, round_index)
+
+    print(json.dumps({
+        "conversations": len(conversations),
+        "skipped": len(conversations) - len(pending),
+        "processed": len(runs),
+        "rounds": round_index,
+        "duration_seconds": round(time.perf_counter() - start, 3),
+    }), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Offline batch processing of scripted conversations through the message
+processing pipeline (e.g. to evaluate prompt changes on many transcripts).
+
+Reads a json lines file with one conversation per line:
+
+    {"conversation_id": "c1", "treatment_group": 1, "turns": ["Hallo", "Der Pullover fehlt."]}
+
+and runs the user turns of each conversation through
+MessageProcessing.process_message, with a bounded number of conversations
+processed concurrently. For each finished conversation, one json line with
+the bot responses, the dialogue states, the filled slots, the stage timings
+and the token usage of every turn is appended to the output file. Processing
+stops early when a conversation reaches the final state. Conversations which
+are already in the output file are skipped, so an interrupted run continues
+where it stopped. Run from the repository root:
+
+    python -m tools.batch_transcripts transcripts.jsonl results.jsonl --concurrency 16
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bot import instrumentation
+from bot.dialogue_start import DialogueStart
+from bot.message_processing import MessageProcessing
+
+
+def read_conversations(file_path: str) -> list:
+    """
+    Reads the scripted conversations.
+
+    Args:
+        file_path (str): The path of the input file.
+
+    Returns:
+        list: The conversations (with a conversation_id, the treatment group
+        and the user turns).
+    """
+
+    conversations = []
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            conversation = json.loads(line)
+            conversations.append({
+                "conversation_id": str(conversation.get("conversation_id", f"line-{line_number}")),
+                "treatment_group": int(conversation.get("treatment_group", 1)),
+                "turns": [str(turn) for turn in conversation.get("turns", [])],
+            })
+    return conversations
+
+
+def read_finished_conversation_ids(file_path: str) -> set:
+    """
+    Reads the ids of the conversations already in the output file.
+    - Removes an incomplete last line (e.g. of an interrupted run), so that new
+    results are appended to a valid file.
+
+    Args:
+        file_path (str): The path of the output file.
+
+    Returns:
+        set: The ids of the finished conversations.
+    """
+
+    if not os.path.exists(file_path):
+        return set()
+    with open(file_path, "rb") as f:
+        content = f.read()
+    complete_length = content.rfind(b"\n") + 1
+    if complete_length < len(content):
+        with open(file_path, "r+b") as f:
+            f.truncate(complete_length)
+
+    finished_ids = set()
+    for line in content[:complete_length].decode("utf-8").splitlines():
+        if line.strip():
+            finished_ids.add(json.loads(line)["conversation_id"])
+    return finished_ids
+
+
+def process_turn(message_processing: MessageProcessing, user_text: str, treatment_group: int,
+                 conversation_history: list, dialogue_state_history: list, slot_filling: dict,
+                 use_fallbacks: bool, conversation_history_tokens: list) -> tuple:
+    """
+    Processes a user turn and records its stages and gpt api calls (runs in a
+    worker thread).
+
+    Args:
+        message_processing (MessageProcessing): The message processing.
+        user_text (str): The user message.
+        treatment_group (int): The treatment group value.
+        conversation_history (list): The conversation history.
+        dialogue_state_history (list): The dialogue state history.
+        slot_filling (dict): The slot filling dictionary.
+        use_fallbacks (bool): Flag whether to skip the gpt api calls.
+        conversation_history_tokens (list): The cached token counts of the
+        conversation history.
+
+    Returns:
+        tuple: The result of process_message, the recorder of the turn and the
+        duration of the turn in seconds.
+    """
+
+    with instrumentation.record_turn() as recorder:
+        start = time.perf_counter()
+        result = message_processing.process_message(
+            user_text,
+            treatment_group,
+            conversation_history,
+            dialogue_state_history,
+            slot_filling,
+            use_fallbacks,
+            conversation_history_tokens
+        )
+        duration = time.perf_counter() - start
+    return result, recorder, duration
+
+
+async def process_conversation(message_processing: MessageProcessing, dialogue_start: DialogueStart,
+                               conversation: dict, use_fallbacks: bool) -> dict:
+    """
+    Runs the user turns of a conversation through the pipeline.
+
+    Args:
+        message_processing (MessageProcessing): The message processing.
+        dialogue_start (DialogueStart): The dialogue start.
+        conversation (dict): The scripted conversation.
+        use_fallbacks (bool): Flag whether to skip the gpt api calls.
+
+    Returns:
+        dict: The results of the conversation.
+    """
+
+    welcome_text, initial_dialogue_state = dialogue_start.start_dialogue()
+    conversation_history = [("bot", welcome_text)]
+    conversation_history_tokens = []
+    dialogue_state_history = [initial_dialogue_state]
+    slot_filling = {}
+    final_state = False
+    turns = []
+
+    for user_text in conversation["turns"]:
+        dialogue_state = dialogue_state_history[-1]
+        (bot_response, new_dialogue_state, final_state, slot_filling), recorder, duration = await asyncio.to_thread(
+            process_turn,
+            message_processing,
+            user_text,
+            conversation["treatment_group"],
+            conversation_history,
+            dialogue_state_history,
+            dict(slot_filling),
+            use_fallbacks,
+            conversation_history_tokens
+        )
+        conversation_history.append(("user", user_text))
+        conversation_history.append(("bot", bot_response))
+        dialogue_state_history.append(new_dialogue_state)
+        turns.append({
+            "user_text": user_text,
+            "bot_response": bot_response,
+            "dialogue_state": dialogue_state,
+            "new_dialogue_state": new_dialogue_state,
+            "final_state": final_state,
+            "slot_filling": slot_filling,
+            "duration_ms": round(duration * 1000, 3),
+            "stages": [
+                {"stage": entry["stage"], "variant": entry["variant"], "duration_ms": round(entry["duration"] * 1000, 3)}
+                for entry in recorder.stages
+            ],
+            "llm_calls": [
+                {**{key: value for key, value in entry.items() if key != "duration"},
+                 "duration_ms": round(entry["duration"] * 1000, 3)}
+                for entry in recorder.llm_calls
+            ],
+        })
+        if final_state:
+            break
+
+    return {
+        "conversation_id": conversation["conversation_id"],
+        "treatment_group": conversation["treatment_group"],
+        "final_state": final_state,
+        "processed_turns": len(turns),
+        "skipped_turns": len(conversation["turns"]) - len(turns),
+        "prompt_tokens": sum(call.get("prompt_tokens", 0) for turn in turns for call in turn["llm_calls"]),
+        "completion_tokens": sum(call.get("completion_tokens", 0) for turn in turns for call in turn["llm_calls"]),
+        "turns": turns,
+    }
+
+
+async def run_batch(args) -> dict:
+    """
+    Processes all unfinished conversations with bounded concurrency and
+    appends the results to the output file as they finish.
+
+    Args:
+        args: The command line arguments.
+
+    Returns:
+        dict: The summary of the run.
+    """
+
+    conversations = read_conversations(args.input)
+    finished_ids = read_finished_conversation_ids(args.output)
+    pending = [conversation for conversation in conversations if conversation["conversation_id"] not in finished_ids]
+    if args.limit is not None:
+        pending = pending[:args.limit]
+
+    # One worker thread per concurrently processed conversation
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=args.concurrency))
+    message_processing = MessageProcessing()
+    message_processing.preload_prompt_templates()
+    dialogue_start = DialogueStart()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    summary = {"conversations": len(conversations), "skipped": len(conversations) - len(pending),
+               "processed": 0, "failed": 0}
+
+    with open(args.output, "a", encoding="utf-8") as output_file:
+
+        async def process(conversation: dict):
+            async with semaphore:
+                try:
+                    result = await process_conversation(message_processing, dialogue_start, conversation,
+                                                        args.use_fallbacks)
+                except Exception as e:
+                    summary["failed"] += 1
+                    print(f"Conversation {conversation['conversation_id']} failed: {e!r}", file=sys.stderr)
+                    return
+                output_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output_file.flush()
+                summary["processed"] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(process(conversation) for conversation in pending))
+        summary["duration_seconds"] = round(time.perf_counter() - start, 3)
+
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="The json lines file with the scripted conversations")
+    parser.add_argument("output", help="The json lines file for the results (appended to when resuming)")
+    parser.add_argument("--concurrency", type=int, default=8, help="The number of conversations processed at a time")
+    parser.add_argument("--limit", type=int, default=None, help="Process at most this many conversations")
+    parser.add_argument("--use-fallbacks", action="store_true", help="Skip the gpt api calls and use the fallbacks")
+    args = parser.parse_args()
+
+    summary = asyncio.run(run_batch(args))
+    print(json.dumps(summary), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Builds the data bundle of the bot, which holds all data files of bot/data
+(states, slot template, rg mapping, model routing, prompt templates and
+canned responses) in one precompiled json file, so that the bot reads one
+file at the start instead of every data file (see bot.data_bundle and
+data_bundle in botsettings.json). The bundle is built by the deployment
+workflow and must be rebuilt after changes of the data files; with --check,
+only reports whether the bundle is up to date (exit code 1 if not). Run from
+the repository root:
+
+    python -m tools.build_data_bundle [--output bot/data/data_bundle/data_bundle.json] [--check]
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from bot.data_bundle import DATA_BUNDLE_VERSION, DATA_PATH, DEFAULT_DATA_BUNDLE_PATH, DataBundle
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=DATA_PATH, help="The data directory of the bot")
+    parser.add_argument("--output", default=DEFAULT_DATA_BUNDLE_PATH, help="The path of the data bundle")
+    parser.add_argument("--check", action="store_true", help="Only check whether the bundle is up to date")
+    args = parser.parse_args()
+
+    if args.check:
+        try:
+            bundle = DataBundle.load(args.output)
+        except (OSError, ValueError, KeyError) as e:
+            print(json.dumps({"data_bundle": args.output, "up_to_date": False, "error": repr(e)}))
+            sys.exit(1)
+        up_to_date = bundle.is_up_to_date(args.data)
+        print(json.dumps({"data_bundle": args.output, "up_to_date": up_to_date}))
+        sys.exit(0 if up_to_date else 1)
+
+    bundle = DataBundle.build(args.data)
+    bundle.save(args.output)
+    print(json.dumps({
+        "data_bundle": args.output,
+        "version": DATA_BUNDLE_VERSION,
+        "files": len(bundle.files),
+        "size_bytes": os.path.getsize(args.output),
+        "source_digest": bundle.source_digest,
+    }))
+
+
+if __name__ == "__main__":
+    main()
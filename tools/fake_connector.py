@@ -0,0 +1,110 @@
+"""
+Local fake of the Bot Framework connector service, which receives the replies
+of the bot. Run from the repository root:
+
+    python -m tools.fake_connector --port 3980 --latency 0.02
+
+Activities sent to the bot must use http://<host>:<port> as serviceUrl.
+"""
+
+import argparse
+import asyncio
+import time
+import uuid
+from typing import Callable
+
+from aiohttp import web
+
+
+class FakeConnector:
+    """
+    Class that simulates the connector service of the Bot Framework channel.
+    """
+
+    def __init__(self, latency: float = 0.0, on_activity: Callable = None):
+        """
+        Constructor of the FakeConnector class.
+
+        Args:
+            latency (float): The simulated processing time in seconds per
+            received activity.
+            on_activity (Callable): Optional callback, which is called with the
+            conversation id, the activity and the arrival time of each received
+            activity.
+        """
+
+        self.latency = latency
+        self.on_activity = on_activity
+        self.activity_count = 0
+        self.runner = None
+
+    def create_app(self) -> web.Application:
+        """
+        Creates the aiohttp app with the routes of the connector api used by
+        the bot.
+
+        Returns:
+            web.Application: The aiohttp app.
+        """
+
+        app = web.Application()
+        app.router.add_post("/v3/conversations/{conversation_id}/activities", self.receive_activity)
+        app.router.add_post("/v3/conversations/{conversation_id}/activities/{activity_id}", self.receive_activity)
+        return app
+
+    async def receive_activity(self, req: web.Request) -> web.Response:
+        """
+        Receives an activity sent by the bot.
+
+        Args:
+            req (web.Request): The incoming request.
+
+        Returns:
+            web.Response: The resource response with the id of the activity.
+        """
+
+        activity = await req.json()
+        arrival_time = time.perf_counter()
+        self.activity_count += 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        if self.on_activity is not None:
+            self.on_activity(req.match_info["conversation_id"], activity, arrival_time)
+        return web.json_response({"id": str(uuid.uuid4())})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 3980):
+        """
+        Starts the fake connector within the running event loop.
+
+        Args:
+            host (str): The host to listen on.
+            port (int): The port to listen on.
+        """
+
+        self.runner = web.AppRunner(self.create_app(), access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+
+    async def stop(self):
+        """
+        Stops the fake connector.
+        """
+
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3980)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    fake_connector = FakeConnector(latency=args.latency)
+    web.run_app(fake_connector.create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,509 @@
+"""
+Local fake of the OpenAI chat completions api, which lets the bot run without
+network access. Run from the repository root:
+
+    python -m tools.fake_openai --port 3985 --latency 0.3 --latency-distribution lognormal --error-rate 0.01
+
+The bot uses the fake with OPENAI_BASE_URL=http://<host>:<port>/v1 and any
+OPENAI_API_KEY. The fake also provides the files and batches api (as local
+stand-in for batch jobs of chat completions).
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import time
+import uuid
+
+from aiohttp import web
+
+
+# Example output of the slot filling prompt, which contains all slots to classify
+SLOT_FILLING_EXAMPLE_PATTERN = re.compile(r"Beispiel: (\{.*?\})", re.DOTALL)
+# User message within the slot filling prompt
+SLOT_FILLING_USER_TEXT_PATTERN = re.compile(r"Nutzernachricht:\n--- START ---\n(.*?)\n--- ENDE ---", re.DOTALL)
+
+# Turns (one json object per line) and slot ids within the slot filling prompt
+# of a batch of turns
+SLOT_FILLING_BATCH_ITEMS_PATTERN = re.compile(r"--- NACHRICHTEN START ---\n(.*?)\n--- NACHRICHTEN ENDE ---", re.DOTALL)
+SLOT_FILLING_SLOT_ID_PATTERN = re.compile(r'^  "(\w+)": ', re.MULTILINE)
+
+SLOT_TEMPLATE_FILE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                       "bot", "data", "slot_filling", "slot_template.json")
+
+LATENCY_DISTRIBUTIONS = ("fixed", "exponential", "lognormal")
+
+RESPONSE_TEXT = "Vielen Dank für Ihre Nachricht! Ich kümmere mich gerne darum. Können Sie mir dazu noch etwas mehr erzählen?"
+
+
+class FakeOpenAI:
+    """
+    Class that simulates the chat completions api of OpenAI.
+    - Slot filling requests are answered with a classification of the slots
+    of the example output of the prompt. A slot is filled if one of its
+    patterns of the slot template matches the user message (so that scripted
+    participants follow realistic paths through the dialogue states).
+    Requests with a json schema (structured outputs) are answered in the
+    format of the schema (0 or 1 per slot, or the list of the filled slots).
+    Requests for a batch of turns are answered with an item per turn.
+    - All other requests are answered with a fixed response text.
+    - The answer ends at the first stop sequence of the request and is cut
+    after max_tokens tokens (about 4 characters per token) with the finish
+    reason "length".
+    - The processing time of a request follows a fixed, exponential or
+    lognormal distribution with the given mean, and a share of the requests
+    fails with an error status.
+    - Batch jobs (of uploaded json lines files with chat completion requests)
+    complete after the batch latency. Failed requests are written to the
+    error file of the batch.
+    """
+
+    def __init__(self, latency: float = 0.0, latency_distribution: str = "fixed", latency_sigma: float = 0.5,
+                 error_rate: float = 0.0, error_status: int = 500, seed: int = None, batch_latency: float = 0.0,
+                 compress: bool = False):
+        """
+        Constructor of the FakeOpenAI class.
+
+        Args:
+            latency (float): The mean simulated processing time in seconds per
+            request.
+            latency_distribution (str): The distribution of the processing
+            time ("fixed", "exponential" or "lognormal").
+            latency_sigma (float): The standard deviation of the logarithm of
+            the processing time for the lognormal distribution.
+            error_rate (float): The share of the requests which fail.
+            error_status (int): The http status of the failed requests (e.g.
+            500 or 429).
+            seed (int): The seed of the random generator (for reproducible
+            runs).
+            batch_latency (float): The time in seconds until a batch job is
+            completed.
+            compress (bool): Whether the chat completions are compressed with
+            gzip (like the responses of the OpenAI api).
+        """
+
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution {latency_distribution}")
+        self.latency = latency
+        self.latency_distribution = latency_distribution
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.slot_patterns = self.load_slot_patterns()
+        self.batch_latency = batch_latency
+        self.compress = compress
+        self.request_count = 0
+        self.error_count = 0
+        self.files = {}
+        self.batches = {}
+        self.batch_tasks = set()
+        self.runner = None
+
+    def load_slot_patterns(self) -> dict:
+        """
+        Loads and compiles the patterns of the slots from the slot template.
+
+        Returns:
+            dict: The compiled patterns per slot id.
+        """
+
+        with open(SLOT_TEMPLATE_FILE_PATH, encoding="utf-8") as file:
+            slot_template = json.load(file)
+        return {
+            slot_id: [re.compile(pattern, re.IGNORECASE) for pattern in slot.get("slot_patterns", [])]
+            for slot_id, slot in slot_template["slots"].items()
+        }
+
+    def sample_latency(self) -> float:
+        """
+        Draws the processing time of a request.
+
+        Returns:
+            float: The processing time in seconds.
+        """
+
+        if self.latency <= 0:
+            return 0.0
+        if self.latency_distribution == "exponential":
+            return self.random.expovariate(1 / self.latency)
+        if self.latency_distribution == "lognormal":
+            # Choose mu so that the mean of the distribution equals the latency
+            mu = math.log(self.latency) - self.latency_sigma ** 2 / 2
+            return self.random.lognormvariate(mu, self.latency_sigma)
+        return self.latency
+
+    def create_app(self) -> web.Application:
+        """
+        Creates the aiohttp app with the routes of the api used by the bot.
+
+        Returns:
+            web.Application: The aiohttp app.
+        """
+
+        app = web.Application(client_max_size=16 * 1024 ** 2)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_post("/v1/files", self.upload_file)
+        app.router.add_get("/v1/files/{file_id}/content", self.file_content)
+        app.router.add_post("/v1/batches", self.create_batch)
+        app.router.add_get("/v1/batches/{batch_id}", self.retrieve_batch)
+        return app
+
+    def create_content(self, messages: list, response_format: dict = None) -> str:
+        """
+        Creates the content of the answer to a chat completion request.
+
+        Args:
+            messages (list): The messages of the request.
+            response_format (dict): The response format of the request, or None.
+
+        Returns:
+            str: The content of the answer.
+        """
+
+        user_prompt = messages[-1].get("content", "") if messages else ""
+        user_text_match = SLOT_FILLING_USER_TEXT_PATTERN.search(user_prompt)
+        user_text = user_text_match.group(1) if user_text_match else ""
+
+        # Answer the slot filling of a batch of turns
+        batch_items_match = SLOT_FILLING_BATCH_ITEMS_PATTERN.search(user_prompt)
+        if batch_items_match:
+            return self.create_batch_content(user_prompt, batch_items_match.group(1), response_format)
+
+        # Answer in the format of the json schema
+        if response_format and response_format.get("type") == "json_schema":
+            properties = response_format["json_schema"]["schema"].get("properties", {})
+            if "filled_slots" in properties:
+                slot_ids = properties["filled_slots"]["items"]["enum"]
+                classification = self.classify(user_text, slot_ids)
+                return json.dumps({"filled_slots": [slot_id for slot_id in slot_ids if classification[slot_id]]})
+            return json.dumps(self.classify(user_text, list(properties)))
+
+        example_match = SLOT_FILLING_EXAMPLE_PATTERN.search(user_prompt)
+        if not example_match:
+            return RESPONSE_TEXT
+        if not user_text_match:
+            return example_match.group(1)
+
+        # Classify the slots of the example with the patterns of the slots
+        return json.dumps(self.classify(user_text, list(json.loads(example_match.group(1)))))
+
+    def create_batch_content(self, user_prompt: str, items_section: str, response_format: dict = None) -> str:
+        """
+        Creates the content of the answer to a slot filling request of a batch
+        of turns.
+
+        Args:
+            user_prompt (str): The user prompt of the request.
+            items_section (str): The turns of the prompt (one json object per
+            line).
+            response_format (dict): The response format of the request, or None.
+
+        Returns:
+            str: The content of the answer.
+        """
+
+        slot_ids = SLOT_FILLING_SLOT_ID_PATTERN.findall(user_prompt)
+        compact = False
+        if response_format and response_format.get("type") == "json_schema":
+            item_schema = response_format["json_schema"]["schema"]["properties"]["items"]["items"]
+            compact = "filled_slots" in item_schema["properties"]
+        items = []
+        for line in items_section.splitlines():
+            item = json.loads(line)
+            classification = self.classify(item.get("nutzer", ""), slot_ids)
+            if compact:
+                items.append({"id": item["id"], "filled_slots": [slot_id for slot_id in slot_ids if classification[slot_id]]})
+            else:
+                items.append({"id": item["id"], **classification})
+        return json.dumps({"items": items})
+
+    def classify(self, user_text: str, slot_ids: list) -> dict:
+        """
+        Classifies slots with their patterns of the slot template.
+
+        Args:
+            user_text (str): The user message.
+            slot_ids (list): The ids of the slots.
+
+        Returns:
+            dict: The mapping of 0 or 1 for each slot.
+        """
+
+        classification = {}
+        for slot_id in slot_ids:
+            patterns = self.slot_patterns.get(slot_id, [])
+            classification[slot_id] = int(any(pattern.search(user_text) for pattern in patterns))
+        return classification
+
+    def create_completion(self, body: dict) -> tuple[int, dict]:
+        """
+        Creates the answer to a chat completion request (or a simulated error).
+
+        Args:
+            body (dict): The body of the request.
+
+        Returns:
+            tuple[int, dict]: The http status and the body of the answer.
+        """
+
+        self.request_count += 1
+        if self.error_rate > 0 and self.random.random() < self.error_rate:
+            self.error_count += 1
+            return self.error_status, {"error": {"message": "Simulated error", "type": "server_error", "code": None}}
+        messages = body.get("messages", [])
+        content = self.create_content(messages, body.get("response_format"))
+        stop_sequences = body.get("stop") or []
+        for stop_sequence in [stop_sequences] if isinstance(stop_sequences, str) else stop_sequences:
+            content = content.split(stop_sequence, 1)[0]
+        finish_reason = "stop"
+        max_tokens = body.get("max_tokens") or body.get("max_completion_tokens")
+        if max_tokens and len(content) // 4 > max_tokens:
+            content = content[:max_tokens * 4]
+            finish_reason = "length"
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in messages) // 4
+        completion_tokens = max(1, len(content) // 4)
+        return 200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": finish_reason,
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": 0},
+            },
+        }
+
+    async def chat_completions(self, req: web.Request) -> web.Response:
+        """
+        Answers a chat completion request.
+
+        Args:
+            req (web.Request): The incoming request.
+
+        Returns:
+            web.Response: The chat completion.
+        """
+
+        body = await req.json()
+        latency = self.sample_latency()
+        if latency > 0:
+            await asyncio.sleep(latency)
+        status, answer = self.create_completion(body)
+        response = web.json_response(answer, status=status)
+        if self.compress:
+            response.enable_compression(web.ContentCoding.gzip)
+        return response
+
+    def store_file(self, content: bytes, filename: str, purpose: str) -> dict:
+        """
+        Stores a file.
+
+        Args:
+            content (bytes): The content of the file.
+            filename (str): The name of the file.
+            purpose (str): The purpose of the file (e.g. batch or
+            batch_output).
+
+        Returns:
+            dict: The file object.
+        """
+
+        file_object = {
+            "id": f"file-{uuid.uuid4().hex}",
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+        self.files[file_object["id"]] = (file_object, content)
+        return file_object
+
+    async def upload_file(self, req: web.Request) -> web.Response:
+        """
+        Receives an uploaded file (multipart form with file and purpose).
+
+        Args:
+            req (web.Request): The incoming request.
+
+        Returns:
+            web.Response: The file object.
+        """
+
+        form = await req.post()
+        uploaded_file = form["file"]
+        return web.json_response(self.store_file(uploaded_file.file.read(), uploaded_file.filename, form["purpose"]))
+
+    async def file_content(self, req: web.Request) -> web.Response:
+        """
+        Returns the content of a file.
+
+        Args:
+            req (web.Request): The incoming request.
+
+        Returns:
+            web.Response: The content of the file.
+        """
+
+        stored_file = self.files.get(req.match_info["file_id"])
+        if stored_file is None:
+            return web.json_response({"error": {"message": "No such file", "type": "invalid_request_error"}}, status=404)
+        return web.Response(body=stored_file[1], content_type="application/octet-stream")
+
+    async def create_batch(self, req: web.Request) -> web.Response:
+        """
+        Creates a batch job for an uploaded file and processes it in the
+        background.
+
+        Args:
+            req (web.Request): The incoming request.
+
+        Returns:
+            web.Response: The batch object.
+        """
+
+        body = await req.json()
+        if body.get("input_file_id") not in self.files:
+            return web.json_response({"error": {"message": "No such file", "type": "invalid_request_error"}}, status=400)
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex}",
+            "object": "batch",
+            "endpoint": body.get("endpoint", "/v1/chat/completions"),
+            "input_file_id": body["input_file_id"],
+            "completion_window": body.get("completion_window", "24h"),
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": int(time.time()),
+            "completed_at": None,
+            "metadata": body.get("metadata"),
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        self.batches[batch["id"]] = batch
+        task = asyncio.create_task(self.process_batch(batch))
+        self.batch_tasks.add(task)
+        task.add_done_callback(self.batch_tasks.discard)
+        return web.json_response(batch)
+
+    async def process_batch(self, batch: dict):
+        """
+        Answers the requests of a batch job and writes the output and error
+        files.
+
+        Args:
+            batch (dict): The batch object.
+        """
+
+        batch["status"] = "in_progress"
+        if self.batch_latency > 0:
+            await asyncio.sleep(self.batch_latency)
+        output_lines = []
+        error_lines = []
+        for line in self.files[batch["input_file_id"]][1].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            status, answer = self.create_completion(request.get("body", {}))
+            result = {
+                "id": f"batch_req_{uuid.uuid4().hex}",
+                "custom_id": request.get("custom_id"),
+                "response": {"status_code": status, "request_id": uuid.uuid4().hex, "body": answer},
+                "error": None,
+            }
+            (output_lines if status == 200 else error_lines).append(json.dumps(result, ensure_ascii=False))
+
+        if output_lines:
+            batch["output_file_id"] = self.store_file(("\n".join(output_lines) + "\n").encode("utf-8"),
+                                                      "batch_output.jsonl", "batch_output")["id"]
+        if error_lines:
+            batch["error_file_id"] = self.store_file(("\n".join(error_lines) + "\n").encode("utf-8"),
+                                                     "batch_errors.jsonl", "batch_output")["id"]
+        batch["request_counts"] = {
+            "total": len(output_lines) + len(error_lines),
+            "completed": len(output_lines),
+            "failed": len(error_lines),
+        }
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+
+    async def retrieve_batch(self, req: web.Request) -> web.Response:
+        """
+        Returns the state of a batch job.
+
+        Args:
+            req (web.Request): The incoming request.
+
+        Returns:
+            web.Response: The batch object.
+        """
+
+        batch = self.batches.get(req.match_info["batch_id"])
+        if batch is None:
+            return web.json_response({"error": {"message": "No such batch", "type": "invalid_request_error"}}, status=404)
+        return web.json_response(batch)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 3985):
+        """
+        Starts the fake api within the running event loop.
+
+        Args:
+            host (str): The host to listen on.
+            port (int): The port to listen on.
+        """
+
+        self.runner = web.AppRunner(self.create_app(), access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+
+    async def stop(self):
+        """
+        Stops the fake api.
+        """
+
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3985)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--latency-distribution", choices=LATENCY_DISTRIBUTIONS, default="fixed")
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--batch-latency", type=float, default=0.0)
+    parser.add_argument("--compress", action="store_true", help="Compress the chat completions with gzip")
+    args = parser.parse_args()
+
+    fake_openai = FakeOpenAI(
+        latency=args.latency,
+        latency_distribution=args.latency_distribution,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        seed=args.seed,
+        batch_latency=args.batch_latency,
+        compress=args.compress
+    )
+    web.run_app(fake_openai.create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Monte Carlo simulation of the dialogue state graph (e.g. for capacity
+planning and study design without running any model).
+
+Encodes the transitions of the dialogue management (states.json and
+edge_conditions.json) as NumPy arrays indexed by the dialogue state, the
+bitmask of the newly filled slots and the bitmask of the already filled
+condition slots (e.g. d_val). Simulated participants fill each slot checked
+in their current state with a configurable probability per state and slot,
+and are moved through the graph in batched array operations until they reach
+the final state or the maximum number of turns. Prints the path length
+distribution, the final state reach rate, the state visits and the expected
+gpt api calls per conversation as json. Needs numpy (which the bot itself
+does not need). Run from the repository root:
+
+    python -m tools.state_graph_simulator --participants 1000000 --probabilities probabilities.json
+
+The probabilities file is optional and has the format
+
+    {"default": 0.3, "states": {"0": {"a": 0.6, "b": 0.4}}, "validation": {"c_val": 0.9, "d_val": 0.8}}
+
+where validation probabilities are conditional on the filled base slot (e.g.
+the probability that a provided order number is correct).
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from bot.dialogue_start import DialogueStart
+from bot.message_processing import MessageProcessing
+
+
+# Gpt api calls per turn (slot filling and response generation)
+LLM_CALLS_PER_TURN = 2
+
+
+class StateGraphModel:
+    """
+    Class that represents the dialogue state graph as transition arrays.
+    - Slots are bits of a slot bitmask (in the order of the slot template).
+    - next_state[state, newly_filled_mask, condition_mask] is the index of
+    the next state, where condition_mask holds the already filled slots which
+    are checked by the edge conditions.
+    - The arrays are computed with DialogueManagement.run (or its fallback if
+    it fails), so they follow the dialogue management exactly.
+    """
+
+    def __init__(self, message_processing: MessageProcessing):
+        """
+        Constructor of the StateGraphModel class.
+
+        Args:
+            message_processing (MessageProcessing): The message processing
+            with the state information and the dialogue management.
+        """
+
+        dialogue_management = message_processing.dialogue_management
+        slot_filling = message_processing.slot_filling
+        self.states = list(message_processing.state_info)
+        self.slots = list(message_processing.slot_template)
+        self.final_state = self.states.index(message_processing.final_state)
+        self.condition_slots = sorted({
+            condition["conditional_slot"] for condition in message_processing.edge_conditions.values()
+        })
+        self.condition_slot_bits = [self.slots.index(slot) for slot in self.condition_slots]
+
+        # Slots checked per state (as boolean matrix) and the base slot of
+        # each validation slot
+        self.checked_slots = np.zeros((len(self.states), len(self.slots)), dtype=bool)
+        for state_index, state in enumerate(self.states):
+            for slot in slot_filling._get_slots_to_check(state):
+                self.checked_slots[state_index, self.slots.index(slot)] = True
+        self.validation_base_slots = {
+            self.slots.index(slot_info["validation_slot"]): self.slots.index(slot_id)
+            for slot_id, slot_info in message_processing.slot_template.items()
+            if slot_info.get("validation_slot")
+        }
+
+        # Compute the transition arrays
+        slot_mask_count = 1 << len(self.slots)
+        condition_mask_count = 1 << len(self.condition_slots)
+        self.next_state = np.zeros((len(self.states), slot_mask_count, condition_mask_count), dtype=np.int8)
+        for state_index, state in enumerate(self.states):
+            for newly_filled_mask in range(slot_mask_count):
+                newly_filled_slots = {slot: 1 for bit, slot in enumerate(self.slots) if newly_filled_mask >> bit & 1}
+                for condition_mask in range(condition_mask_count):
+                    slot_filling_dict = dict(newly_filled_slots)
+                    for bit, slot in enumerate(self.condition_slots):
+                        if condition_mask >> bit & 1:
+                            slot_filling_dict[slot] = 1
+                    try:
+                        new_state, _, _ = dialogue_management.run(state, slot_filling_dict, newly_filled_slots)
+                    except Exception:
+                        new_state, _, _ = dialogue_management.run_fallback(state)
+                    self.next_state[state_index, newly_filled_mask, condition_mask] = self.states.index(new_state)
+
+    def fill_probabilities(self, probabilities: dict) -> np.ndarray:
+        """
+        Builds the matrix of the slot fill probabilities per state.
+
+        Args:
+            probabilities (dict): The probabilities ("default", "states" and
+            "validation", see the module description).
+
+        Returns:
+            np.ndarray: The probabilities per state and slot (0 for slots which
+            are not checked in a state).
+        """
+
+        default = float(probabilities.get("default", 0.3))
+        matrix = np.full((len(self.states), len(self.slots)), default, dtype=np.float32)
+        for slot, probability in probabilities.get("validation", {}).items():
+            matrix[:, self.slots.index(slot)] = probability
+        for state, state_probabilities in probabilities.get("states", {}).items():
+            for slot, probability in state_probabilities.items():
+                matrix[self.states.index(state), self.slots.index(slot)] = probability
+        matrix[~self.checked_slots] = 0.0
+        return matrix
+
+
+def simulate(model: StateGraphModel, fill_probabilities: np.ndarray, participant_count: int, initial_state: int,
+             max_turns: int, rng: np.random.Generator) -> tuple:
+    """
+    Simulates participants until they reach the final state or the maximum
+    number of turns.
+
+    Args:
+        model (StateGraphModel): The state graph model.
+        fill_probabilities (np.ndarray): The slot fill probabilities per state
+        and slot.
+        participant_count (int): The number of participants.
+        initial_state (int): The index of the initial state.
+        max_turns (int): The maximum number of turns per participant.
+        rng (np.random.Generator): The random generator.
+
+    Returns:
+        tuple: The number of turns per participant, the flags whether they
+        reached the final state and the number of visits per state.
+    """
+
+    slot_weights = (1 << np.arange(len(model.slots))).astype(np.int32)
+    condition_bits = np.array(model.condition_slot_bits, dtype=np.int32)
+    state = np.full(participant_count, initial_state, dtype=np.int8)
+    filled_mask = np.zeros(participant_count, dtype=np.int32)
+    turns = np.zeros(participant_count, dtype=np.int32)
+    finished = np.zeros(participant_count, dtype=bool)
+    state_visits = np.zeros(len(model.states), dtype=np.int64)
+
+    active = np.arange(participant_count)
+    for turn in range(1, max_turns + 1):
+        if active.size == 0:
+            break
+        current_state = state[active]
+        state_visits += np.bincount(current_state, minlength=len(model.states))
+
+        # Draw the newly filled slots (validation slots only with their base slot)
+        filled = rng.random((active.size, len(model.slots)), dtype=np.float32) < fill_probabilities[current_state]
+        for validation_bit, base_bit in model.validation_base_slots.items():
+            filled[:, validation_bit] &= filled[:, base_bit]
+        newly_filled_mask = filled.astype(np.int32) @ slot_weights
+
+        # Look up the next state given the filled condition slots
+        filled_mask[active] |= newly_filled_mask
+        condition_mask = ((filled_mask[active, None] >> condition_bits) & 1) @ (1 << np.arange(condition_bits.size))
+        next_state = model.next_state[current_state, newly_filled_mask, condition_mask]
+        state[active] = next_state
+        turns[active] = turn
+
+        reached_final_state = next_state == model.final_state
+        finished[active[reached_final_state]] = True
+        active = active[~reached_final_state]
+
+    return turns, finished, state_visits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--participants", type=int, default=1000000)
+    parser.add_argument("--max-turns", type=int, default=30)
+    parser.add_argument("--probabilities", default=None, help="The json file with the slot fill probabilities")
+    parser.add_argument("--default-probability", type=float, default=None,
+                        help="The fill probability of slots without a configured probability")
+    parser.add_argument("--chunk-size", type=int, default=1000000, help="The participants simulated at a time")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    probabilities = {}
+    if args.probabilities:
+        with open(args.probabilities, "r", encoding="utf-8") as f:
+            probabilities = json.load(f)
+    if args.default_probability is not None:
+        probabilities["default"] = args.default_probability
+
+    start = time.perf_counter()
+    model = StateGraphModel(MessageProcessing())
+    fill_probabilities = model.fill_probabilities(probabilities)
+    initial_state = model.states.index(DialogueStart().initial_state)
+    model_seconds = time.perf_counter() - start
+
+    # Simulate the participants in chunks (to bound the memory)
+    rng = np.random.default_rng(args.seed)
+    turn_counts = []
+    finished_flags = []
+    state_visits = np.zeros(len(model.states), dtype=np.int64)
+    start = time.perf_counter()
+    for offset in range(0, args.participants, args.chunk_size):
+        chunk_size = min(args.chunk_size, args.participants - offset)
+        turns, finished, visits = simulate(model, fill_probabilities, chunk_size, initial_state, args.max_turns, rng)
+        turn_counts.append(turns)
+        finished_flags.append(finished)
+        state_visits += visits
+    simulation_seconds = time.perf_counter() - start
+    turns = np.concatenate(turn_counts)
+    finished = np.concatenate(finished_flags)
+
+    finished_turns = turns[finished]
+    path_length_counts = np.bincount(finished_turns, minlength=args.max_turns + 1)
+    print(json.dumps({
+        "participants": args.participants,
+        "max_turns": args.max_turns,
+        "final_state_reach_rate": round(float(finished.mean()), 6),
+        "path_length_mean": round(float(finished_turns.mean()), 4) if finished_turns.size else None,
+        "path_length_p50": int(np.percentile(finished_turns, 50)) if finished_turns.size else None,
+        "path_length_p90": int(np.percentile(finished_turns, 90)) if finished_turns.size else None,
+        "path_length_p99": int(np.percentile(finished_turns, 99)) if finished_turns.size else None,
+        "path_length_distribution": {
+            str(length): round(float(count) / args.participants, 6)
+            for length, count in enumerate(path_length_counts) if count
+        },
+        "turns_per_conversation_mean": round(float(turns.mean()), 4),
+        "expected_llm_calls_per_conversation": round(float(turns.mean()) * LLM_CALLS_PER_TURN, 4),
+        "state_visits_per_conversation": {
+            state: round(float(visits) / args.participants, 4) for state, visits in zip(model.states, state_visits)
+        },
+        "model_build_seconds": round(model_seconds, 3),
+        "participants_per_second": round(args.participants / simulation_seconds),
+    }))
+
+
+if __name__ == "__main__":
+    main()
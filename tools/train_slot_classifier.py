@@ -0,0 +1,403 @@
+"""
+Trains the local slot classifier on the slot labels of the gpt api and
+evaluates it against held-out labels.
+
+Reads the slot label files written by the bot (slot_classifier.label_log_path
+in botsettings.json), merges duplicate turns (majority label per slot) and
+splits the turns deterministically (by a hash of the turn) into a training,
+a calibration and a test set. Trains a logistic regression per slot over the
+hashed features of bot.slot_classifier with NumPy, calibrates the scores on
+the calibration set (Platt scaling) and writes the model file. Slots with too
+few training turns, or too few positive or negative ones, get no model and
+are reported as skipped. Prints an evaluation report on the test set as
+json: the accuracy, precision, recall, F1, Brier score and calibration error
+per slot, the share of turns the classifier is confident for (i.e. gpt api
+calls saved) and its accuracy on them, and the inference time per turn.
+Needs numpy (which the bot itself does not need). Run from the repository
+root:
+
+    python -m tools.train_slot_classifier slot_labels.jsonl --output slot_classifier.json --report report.json
+"""
+
+import argparse
+import json
+import time
+import zlib
+
+import numpy as np
+
+from bot.slot_classifier import (DEFAULT_CONFIDENCE_THRESHOLD, DEFAULT_HASH_BITS, FEATURE_VERSION, SlotClassifier,
+                                 extract_features)
+from bot.slot_label_log import read_slot_labels
+
+
+# Share of the buckets of the turn hash per set
+HASH_BUCKETS = 1000
+
+# Bins of the expected calibration error
+CALIBRATION_BINS = 10
+
+# Weights with a smaller magnitude are not written to the model file
+MIN_WEIGHT = 1e-4
+
+
+def merge_turns(entries: list) -> list:
+    """
+    Merges the label entries of identical turns (same dialogue state, last bot
+    message and user message) by a majority vote per slot.
+
+    Args:
+        entries (list): The label entries.
+
+    Returns:
+        list: The turns with the dialogue state, the texts and the labels.
+    """
+
+    votes = {}
+    for entry in entries:
+        key = (str(entry.get("dialogue_state", "")), entry.get("last_bot_message") or "", entry.get("user_text") or "")
+        turn_votes = votes.setdefault(key, {})
+        for slot_id, label in entry["labels"].items():
+            if str(label) in ("0", "1"):
+                turn_votes.setdefault(slot_id, []).append(int(label))
+
+    turns = []
+    for (dialogue_state, last_bot_message, user_text), turn_votes in votes.items():
+        if not turn_votes:
+            continue
+        turns.append({
+            "dialogue_state": dialogue_state,
+            "last_bot_message": last_bot_message,
+            "user_text": user_text,
+            "labels": {slot_id: int(2 * sum(labels) >= len(labels)) for slot_id, labels in turn_votes.items()},
+        })
+    return turns
+
+
+def split_turns(turns: list, calibration_fraction: float, test_fraction: float) -> tuple:
+    """
+    Splits the turns into a training, a calibration and a test set by a hash
+    of the turn (so that a turn stays in its set when more labels are added).
+
+    Args:
+        turns (list): The merged turns.
+        calibration_fraction (float): The share of the calibration set.
+        test_fraction (float): The share of the test set.
+
+    Returns:
+        tuple: The training, the calibration and the test turns.
+    """
+
+    training_turns, calibration_turns, test_turns = [], [], []
+    for turn in turns:
+        key = "\x1f".join((turn["dialogue_state"], turn["last_bot_message"], turn["user_text"]))
+        bucket = zlib.crc32(key.encode("utf-8")) % HASH_BUCKETS
+        if bucket < test_fraction * HASH_BUCKETS:
+            test_turns.append(turn)
+        elif bucket < (test_fraction + calibration_fraction) * HASH_BUCKETS:
+            calibration_turns.append(turn)
+        else:
+            training_turns.append(turn)
+    return training_turns, calibration_turns, test_turns
+
+
+class FeatureMatrix:
+    """
+    Class that represents the binary features of the turns of a slot as a
+    sparse matrix (feature indices per row), scaled by 1/sqrt of the number
+    of features of a row like in the inference.
+    """
+
+    def __init__(self, feature_lists: list):
+        """
+        Constructor of the FeatureMatrix class.
+
+        Args:
+            feature_lists (list): The feature indices per turn.
+        """
+
+        lengths = np.array([len(features) for features in feature_lists], dtype=np.int64)
+        self.row_count = len(feature_lists)
+        self.indices = np.concatenate([np.asarray(features, dtype=np.int64) for features in feature_lists])
+        self.rows = np.repeat(np.arange(self.row_count), lengths)
+        self.values = np.repeat(1.0 / np.sqrt(lengths), lengths)
+
+    def scores(self, bias: float, weights: np.ndarray) -> np.ndarray:
+        """
+        Computes the scores of the rows.
+
+        Args:
+            bias (float): The bias.
+            weights (np.ndarray): The weights.
+
+        Returns:
+            np.ndarray: The score per row.
+        """
+
+        return bias + np.bincount(self.rows, weights=weights[self.indices] * self.values, minlength=self.row_count)
+
+def train_logistic_regression(matrix: FeatureMatrix, labels: np.ndarray, feature_count: int, epochs: int,
+                              learning_rate: float, l2: float) -> tuple:
+    """
+    Trains a logistic regression with full-batch Adam and L2 regularization.
+
+    Args:
+        matrix (FeatureMatrix): The features of the training turns.
+        labels (np.ndarray): The labels (0 or 1).
+        feature_count (int): The number of features.
+        epochs (int): The number of full-batch steps.
+        learning_rate (float): The learning rate.
+        l2 (float): The L2 regularization of the weights.
+
+    Returns:
+        tuple: The bias and the weights.
+    """
+
+    # Train only the weights of the features of the training turns (the other
+    # weights stay 0)
+    columns, column_indices = np.unique(matrix.indices, return_inverse=True)
+    column_count = columns.size
+
+    # Start at the log odds of the labels (smoothed)
+    positive_rate = (labels.sum() + 1.0) / (labels.size + 2.0)
+    bias = float(np.log(positive_rate / (1.0 - positive_rate)))
+    column_weights = np.zeros(column_count)
+    moments = np.zeros(column_count + 1)
+    squared_moments = np.zeros(column_count + 1)
+    beta1, beta2, epsilon = 0.9, 0.999, 1e-8
+    for step in range(1, epochs + 1):
+        scores = bias + np.bincount(matrix.rows, weights=column_weights[column_indices] * matrix.values,
+                                    minlength=matrix.row_count)
+        row_errors = (_sigmoid(scores) - labels) / labels.size
+        gradient = np.empty(column_count + 1)
+        gradient[:column_count] = np.bincount(column_indices, weights=row_errors[matrix.rows] * matrix.values,
+                                              minlength=column_count) + l2 * column_weights
+        gradient[column_count] = row_errors.sum()
+        moments = beta1 * moments + (1 - beta1) * gradient
+        squared_moments = beta2 * squared_moments + (1 - beta2) * gradient ** 2
+        update = (learning_rate * (moments / (1 - beta1 ** step))
+                  / (np.sqrt(squared_moments / (1 - beta2 ** step)) + epsilon))
+        column_weights -= update[:column_count]
+        bias -= update[column_count]
+
+    weights = np.zeros(feature_count)
+    weights[columns] = column_weights
+    return bias, weights
+
+
+def fit_calibration(scores: np.ndarray, labels: np.ndarray, iterations: int = 50) -> tuple:
+    """
+    Fits the Platt scaling of the scores (probability = sigmoid(scale * score
+    + offset)) with Newton's method and the smoothed targets of Platt.
+
+    Args:
+        scores (np.ndarray): The scores of the calibration turns.
+        labels (np.ndarray): The labels of the calibration turns.
+        iterations (int): The maximum number of Newton steps.
+
+    Returns:
+        tuple: The scale and the offset (1 and 0 without calibration turns of
+        both labels).
+    """
+
+    positive_count = labels.sum()
+    negative_count = labels.size - positive_count
+    if positive_count == 0 or negative_count == 0:
+        return 1.0, 0.0
+    targets = np.where(labels == 1, (positive_count + 1.0) / (positive_count + 2.0), 1.0 / (negative_count + 2.0))
+    parameters = np.array([1.0, 0.0])
+    design = np.stack([scores, np.ones_like(scores)], axis=1)
+    for _ in range(iterations):
+        probabilities = _sigmoid(design @ parameters)
+        gradient = design.T @ (probabilities - targets)
+        hessian = design.T @ (design * (probabilities * (1 - probabilities))[:, None]) + 1e-9 * np.eye(2)
+        step = np.linalg.solve(hessian, gradient)
+        parameters -= step
+        if np.abs(step).max() < 1e-9:
+            break
+    return float(parameters[0]), float(parameters[1])
+
+
+def evaluate_slot(probabilities: np.ndarray, labels: np.ndarray, confidence_threshold: float) -> dict:
+    """
+    Evaluates the predictions of a slot.
+
+    Args:
+        probabilities (np.ndarray): The calibrated probabilities.
+        labels (np.ndarray): The labels of the gpt api.
+        confidence_threshold (float): The confidence threshold.
+
+    Returns:
+        dict: The metrics of the slot.
+    """
+
+    predictions = (probabilities >= 0.5).astype(int)
+    true_positives = int(((predictions == 1) & (labels == 1)).sum())
+    precision = true_positives / max(int(predictions.sum()), 1)
+    recall = true_positives / max(int(labels.sum()), 1)
+    confident = np.maximum(probabilities, 1 - probabilities) >= confidence_threshold
+
+    # Expected calibration error of the predicted probability of the label 1
+    bins = np.minimum((probabilities * CALIBRATION_BINS).astype(int), CALIBRATION_BINS - 1)
+    calibration_error = 0.0
+    for bin_index in range(CALIBRATION_BINS):
+        in_bin = bins == bin_index
+        if in_bin.any():
+            calibration_error += in_bin.mean() * abs(probabilities[in_bin].mean() - labels[in_bin].mean())
+
+    return {
+        "turns": int(labels.size),
+        "positive_rate": round(float(labels.mean()), 4),
+        "accuracy": round(float((predictions == labels).mean()), 4),
+        "precision": round(precision, 4),
+        "recall": round(recall, 4),
+        "f1": round(2 * precision * recall / (precision + recall), 4) if precision + recall else 0.0,
+        "brier_score": round(float(((probabilities - labels) ** 2).mean()), 4),
+        "expected_calibration_error": round(float(calibration_error), 4),
+        "confident_rate": round(float(confident.mean()), 4),
+        "confident_accuracy": round(float((predictions[confident] == labels[confident]).mean()), 4)
+        if confident.any() else None,
+    }
+
+
+def evaluate_turns(classifier: SlotClassifier, turns: list) -> dict:
+    """
+    Evaluates the classifier as first stage of the slot filling: the share of
+    the turns it classifies (confident for all slots), the share of those
+    turns with all labels correct, and the inference time.
+
+    Args:
+        classifier (SlotClassifier): The trained classifier.
+        turns (list): The test turns.
+
+    Returns:
+        dict: The metrics of the turns.
+    """
+
+    classified_turns = 0
+    correct_turns = 0
+    durations = []
+    for turn in turns:
+        start = time.perf_counter()
+        classification_result = classifier.classify(turn["dialogue_state"], turn["last_bot_message"],
+                                                    turn["user_text"], list(turn["labels"]))
+        durations.append(time.perf_counter() - start)
+        if classification_result is not None:
+            classified_turns += 1
+            correct_turns += int(classification_result == turn["labels"])
+    durations_us = np.array(durations) * 1e6 if durations else np.zeros(1)
+    return {
+        "turns": len(turns),
+        "classified_turn_rate": round(classified_turns / max(len(turns), 1), 4),
+        "classified_turn_accuracy": round(correct_turns / classified_turns, 4) if classified_turns else None,
+        "inference_us_mean": round(float(durations_us.mean()), 2),
+        "inference_us_p99": round(float(np.percentile(durations_us, 99)), 2),
+    }
+
+
+def _sigmoid(values: np.ndarray) -> np.ndarray:
+    return 0.5 * (1.0 + np.tanh(0.5 * values))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("labels", nargs="+", help="The json lines files with the slot labels")
+    parser.add_argument("--output", default="slot_classifier.json", help="The path of the model file")
+    parser.add_argument("--report", default=None, help="The json file for the evaluation report (also printed)")
+    parser.add_argument("--hash-bits", type=int, default=DEFAULT_HASH_BITS)
+    parser.add_argument("--epochs", type=int, default=300)
+    parser.add_argument("--learning-rate", type=float, default=0.5)
+    parser.add_argument("--l2", type=float, default=1e-4)
+    parser.add_argument("--calibration-fraction", type=float, default=0.1)
+    parser.add_argument("--test-fraction", type=float, default=0.1)
+    parser.add_argument("--confidence-threshold", type=float, default=DEFAULT_CONFIDENCE_THRESHOLD)
+    parser.add_argument("--min-turns", type=int, default=20, help="Minimum training turns of a slot for a model")
+    parser.add_argument("--min-class-turns", type=int, default=5,
+                        help="Minimum positive and minimum negative training turns of a slot for a model")
+    args = parser.parse_args()
+
+    entries = read_slot_labels(args.labels)
+    turns = merge_turns(entries)
+    training_turns, calibration_turns, test_turns = split_turns(turns, args.calibration_fraction, args.test_fraction)
+    feature_count = 1 << args.hash_bits
+    for turn in turns:
+        turn["features"] = extract_features(turn["dialogue_state"], turn["last_bot_message"], turn["user_text"],
+                                            args.hash_bits)
+
+    # Train, calibrate and evaluate a model per slot
+    start = time.perf_counter()
+    slot_models = {}
+    slot_reports = {}
+    slot_ids = sorted({slot_id for turn in turns for slot_id in turn["labels"]})
+    for slot_id in slot_ids:
+        slot_training_turns = [turn for turn in training_turns if slot_id in turn["labels"]]
+        training_labels = np.array([turn["labels"][slot_id] for turn in slot_training_turns], dtype=np.float64)
+        if len(slot_training_turns) < args.min_turns:
+            slot_reports[slot_id] = {"skipped": f"{len(slot_training_turns)} training turns"}
+            continue
+        # A slot whose training turns are (almost) all of one class would get
+        # a model which is confident for every turn
+        positive_turns = int(training_labels.sum())
+        negative_turns = len(slot_training_turns) - positive_turns
+        if min(positive_turns, negative_turns) < args.min_class_turns:
+            slot_reports[slot_id] = {
+                "skipped": f"{positive_turns} positive and {negative_turns} negative training turns"}
+            continue
+        bias, weights = train_logistic_regression(
+            FeatureMatrix([turn["features"] for turn in slot_training_turns]), training_labels, feature_count,
+            args.epochs, args.learning_rate, args.l2)
+
+        slot_calibration_turns = [turn for turn in calibration_turns if slot_id in turn["labels"]]
+        calibration = (1.0, 0.0)
+        if slot_calibration_turns:
+            calibration_scores = FeatureMatrix([turn["features"] for turn in slot_calibration_turns]).scores(
+                bias, weights)
+            calibration = fit_calibration(
+                calibration_scores, np.array([turn["labels"][slot_id] for turn in slot_calibration_turns]))
+
+        nonzero = np.flatnonzero(np.abs(weights) >= MIN_WEIGHT)
+        slot_models[slot_id] = {
+            "bias": round(bias, 6),
+            "weights": {str(index): round(float(weights[index]), 6) for index in nonzero},
+            "calibration": [round(calibration[0], 6), round(calibration[1], 6)],
+        }
+
+        slot_test_turns = [turn for turn in test_turns if slot_id in turn["labels"]]
+        slot_reports[slot_id] = {"training_turns": len(slot_training_turns),
+                                 "calibration_turns": len(slot_calibration_turns)}
+        if slot_test_turns:
+            test_scores = FeatureMatrix([turn["features"] for turn in slot_test_turns]).scores(bias, weights)
+            slot_reports[slot_id].update(evaluate_slot(
+                _sigmoid(calibration[0] * test_scores + calibration[1]),
+                np.array([turn["labels"][slot_id] for turn in slot_test_turns]), args.confidence_threshold))
+    training_seconds = time.perf_counter() - start
+
+    model = {
+        "feature_version": FEATURE_VERSION,
+        "hash_bits": args.hash_bits,
+        "confidence_threshold": args.confidence_threshold,
+        "slots": slot_models,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"slot_classifier": model}, f)
+
+    classifier = SlotClassifier(slot_models, args.hash_bits, args.confidence_threshold)
+    report = {
+        "label_entries": len(entries),
+        "turns": len(turns),
+        "training_turns": len(training_turns),
+        "calibration_turns": len(calibration_turns),
+        "test_turns": len(test_turns),
+        "confidence_threshold": args.confidence_threshold,
+        "training_seconds": round(training_seconds, 3),
+        "slots": slot_reports,
+        "test": evaluate_turns(classifier, test_turns),
+    }
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()